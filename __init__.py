@@ -7,6 +7,7 @@ Version: 1.0.0
 """
 
 from .nodes import NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS
+from .nodes.genai_clients import warm_up_from_env
 
 __all__ = ['NODE_CLASS_MAPPINGS', 'NODE_DISPLAY_NAME_MAPPINGS']
 
@@ -18,3 +19,7 @@ print("\033[34m[JM-Gemini-API]\033[0m: Node loaded successfully")
 print(f"\033[34m[JM-Gemini-API]\033[0m: Version {__version__}")
 print("\033[34m[JM-Gemini-API]\033[0m: Image models: gemini-3-pro-image-preview, gemini-2.5-flash-image")
 print("\033[34m[JM-Gemini-API]\033[0m: Video models: veo-3.1-generate-preview, veo-3.1-fast-generate-preview, veo-3.0-generate-001, veo-3.0-fast-generate-001")
+
+# 可选：后台预热 genai 客户端（设置 JM_GEMINI_WARMUP=1 和 GEMINI_API_KEY 等环境变量）
+if warm_up_from_env() is not None:
+    print("\033[34m[JM-Gemini-API]\033[0m: Warming up genai clients in the background")
@@ -0,0 +1,251 @@
+"""
+批处理节点的本地替身校验
+用进程内的 batches / files 替身模拟 Gemini Batch API（任务排队、运行、完成，内联与JSONL文件两种结果），
+端到端运行 GeminiBatchRunner，校验提交、轮询、断点继续、从磁盘重新读取、部分失败和失败任务的处理。
+不需要API key，也不访问网络。
+
+用法:
+    python benchmarks/batch_standin.py
+"""
+import io
+import os
+import sys
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+from PIL import Image
+from google.genai import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nodes import jm_gemini_batch_node as batch_node  # noqa: E402
+from nodes.jm_gemini_batch_node import (  # noqa: E402
+    GeminiBatchRunner,
+    build_generation_config,
+    build_requests,
+)
+
+
+def render_image(seed_text, size=64):
+    """按请求内容生成确定的PNG图像"""
+    seed = int(hashlib.sha256(seed_text.encode("utf-8")).hexdigest()[:8], 16)
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(size, size, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def prompt_of(contents):
+    """请求中的提示词（最后一个文本部分）"""
+    if isinstance(contents, str):
+        return contents
+    return [item for item in contents if isinstance(item, str)][-1]
+
+
+class StandInFiles:
+    """Files API 替身：上传的文件和结果文件保存在内存中"""
+
+    def __init__(self):
+        self.blobs = {}
+
+    def upload(self, file, config=None):
+        name = f"files/upload-{len(self.blobs)}"
+        with open(file, "rb") as f:
+            self.blobs[name] = f.read()
+        return types.File(name=name)
+
+    def download(self, file):
+        return self.blobs[file]
+
+
+class StandInBatches:
+    """
+    Batch API 替身
+
+    任务创建后依次经过 PENDING → RUNNING → SUCCEEDED，每个状态停留 polls_per_state 次查询；
+    提示词包含 fail_marker 的请求返回错误，fail_job 为True时任务以 FAILED 结束。
+    """
+
+    def __init__(self, files, polls_per_state=2, fail_marker="FAIL", fail_job=False):
+        self.files = files
+        self.polls_per_state = polls_per_state
+        self.fail_marker = fail_marker
+        self.fail_job = fail_job
+        self.jobs = {}
+        self.created = 0
+        self.gets = 0
+
+    def create(self, model, src, config=None):
+        self.created += 1
+        name = f"batches/standin-{self.created}"
+        self.jobs[name] = {"model": model, "src": src, "polls": 0}
+        return types.BatchJob(name=name, state=types.JobState.JOB_STATE_PENDING)
+
+    def _respond(self, prompt):
+        if self.fail_marker in prompt:
+            return None, {"code": 400, "message": f"blocked prompt: {prompt}"}
+        return types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(role="model", parts=[
+            types.Part(text=f"generated {prompt}"),
+            types.Part.from_bytes(data=render_image(prompt), mime_type="image/png"),
+        ]))]), None
+
+    def _finish(self, name, job):
+        src = job["src"]
+        if isinstance(src, str):
+            # JSONL请求文件：按行生成结果文件
+            lines = []
+            for line in self.files.blobs[src].decode("utf-8").splitlines():
+                record = json.loads(line)
+                prompt = [part["text"] for part in record["request"]["contents"][0]["parts"] if "text" in part][-1]
+                response, error = self._respond(prompt)
+                result = {"key": record["key"]}
+                if response is not None:
+                    result["response"] = response.model_dump(mode="json", by_alias=True, exclude_none=True)
+                else:
+                    result["error"] = error
+                lines.append(json.dumps(result))
+            result_name = f"files/result-{name.split('/')[-1]}"
+            self.files.blobs[result_name] = "\n".join(reversed(lines)).encode("utf-8")
+            return types.BatchJobDestination(file_name=result_name)
+
+        responses = []
+        for request in src:
+            response, error = self._respond(prompt_of(request.contents))
+            responses.append(types.InlinedResponse(response=response, error=error and types.JobError(
+                code=error["code"], message=error["message"])))
+        return types.BatchJobDestination(inlined_responses=responses)
+
+    def get(self, name):
+        self.gets += 1
+        job = self.jobs[name]
+        job["polls"] += 1
+        stage = job["polls"] // self.polls_per_state
+        if stage == 0:
+            return types.BatchJob(name=name, state=types.JobState.JOB_STATE_PENDING)
+        if stage == 1:
+            return types.BatchJob(name=name, state=types.JobState.JOB_STATE_RUNNING)
+        if self.fail_job:
+            return types.BatchJob(name=name, state=types.JobState.JOB_STATE_FAILED,
+                                  error=types.JobError(message="stand-in failure"))
+        return types.BatchJob(name=name, state=types.JobState.JOB_STATE_SUCCEEDED, dest=self._finish(name, job))
+
+
+class StandInClient:
+    def __init__(self, **kwargs):
+        self.files = StandInFiles()
+        self.batches = StandInBatches(self.files, **kwargs)
+
+
+class SleepRecorder:
+    """记录轮询等待的时长，不真正等待"""
+
+    def __init__(self):
+        self.waits = []
+
+    def __call__(self, seconds):
+        self.waits.append(seconds)
+
+
+def expected_pixels(prompt):
+    return np.array(Image.open(io.BytesIO(render_image(prompt))).convert("RGB"))
+
+
+def check(name, condition):
+    print(f"{'✓' if condition else '✗'} {name}")
+    return bool(condition)
+
+
+def main():
+    ok = True
+    prompts = ["red chair", "blue lamp", "green sofa FAIL", "oak table"]
+    config = build_generation_config("gemini-3-pro-image-preview", "1:1", "2K")
+
+    with tempfile.TemporaryDirectory() as batch_dir:
+        # 1. 内联请求：提交、逐步加长间隔的轮询、取回并解码
+        client = StandInClient()
+        sleep = SleepRecorder()
+        requests = build_requests(prompts)
+        runner = GeminiBatchRunner(client, batch_dir, sleep=sleep)
+        result = runner.run("gemini-3-pro-image-preview", requests, config, poll_interval=30)
+        ok &= check("inline: one job submitted", client.batches.created == 1)
+        ok &= check("inline: 3 images, 1 failure reported", len(result["images"]) == 3
+                    and [index for index, _ in result["failures"]] == [2])
+        ok &= check("inline: polling interval grows", sleep.waits == sorted(sleep.waits) and sleep.waits[-1] > 30)
+        ok &= check("inline: results in prompt order",
+                    all(np.array_equal(np.round(image[0].numpy() * 255).astype(np.uint8), expected_pixels(prompt))
+                        for image, prompt in zip(result["images"], [p for p in prompts if "FAIL" not in p])))
+        ok &= check("inline: files written in request order",
+                    [os.path.basename(path)[:4] for path in result["files"]] == ["0001", "0002", "0004"])
+        print(f"  {client.batches.gets} status calls, waits {[round(w) for w in sleep.waits]}")
+
+        # 2. 已取回的任务：重新执行直接从磁盘读取，不查询API
+        gets_before = client.batches.gets
+        again = GeminiBatchRunner(client, batch_dir, sleep=sleep).run(
+            "gemini-3-pro-image-preview", requests, config)
+        ok &= check("collected: loaded from disk without API calls",
+                    client.batches.gets == gets_before and client.batches.created == 1
+                    and all(np.array_equal(a.numpy(), b.numpy()) for a, b in zip(again["images"], result["images"])))
+
+        # 3. 断点继续：等待超时后重新执行，继续等待同一个任务而不是重新提交
+        client = StandInClient(polls_per_state=3)
+        resume_requests = build_requests(["walnut shelf", "linen curtain"])
+        try:
+            GeminiBatchRunner(client, batch_dir, sleep=SleepRecorder()).run(
+                "gemini-3-pro-image-preview", resume_requests, config, timeout=0)
+            timed_out = False
+        except TimeoutError:
+            timed_out = True
+        resumed = GeminiBatchRunner(client, batch_dir, sleep=SleepRecorder()).run(
+            "gemini-3-pro-image-preview", resume_requests, config, decode=False)
+        ok &= check("resume: timeout keeps the job and the next run resumes it",
+                    timed_out and client.batches.created == 1 and len(resumed["files"]) == 2
+                    and resumed["images"] == [])
+
+        # 4. 超过内联上限：请求写成JSONL文件上传，结果文件下载到磁盘后逐行解析，按key还原顺序
+        client = StandInClient()
+        reference = types.Part.from_bytes(data=render_image("reference"), mime_type="image/png")
+        file_requests = build_requests(["brass clock", "wool rug", "glass vase"], [reference], "shared")
+        original_limit = batch_node.INLINE_REQUEST_LIMIT
+        batch_node.INLINE_REQUEST_LIMIT = 1
+        try:
+            file_result = GeminiBatchRunner(client, batch_dir, sleep=SleepRecorder()).run(
+                "gemini-3-pro-image-preview", file_requests, config)
+        finally:
+            batch_node.INLINE_REQUEST_LIMIT = original_limit
+        uploaded = client.files.blobs["files/upload-0"].decode("utf-8").splitlines()
+        ok &= check("file: requests uploaded as JSONL with the reference image",
+                    len(uploaded) == 3 and "inlineData" in uploaded[0] and "imageConfig" in uploaded[0])
+        ok &= check("file: results restored to request order",
+                    [os.path.basename(path)[:4] for path in file_result["files"]] == ["0001", "0002", "0003"]
+                    and np.array_equal(np.round(file_result["images"][1][0].numpy() * 255).astype(np.uint8),
+                                       expected_pixels("wool rug")))
+        ok &= check("file: downloaded result file removed after parsing",
+                    not [name for name in os.listdir(batch_dir) if name.startswith(".results_")])
+
+        # 5. 失败的任务：报错并删除记录，下次执行重新提交
+        client = StandInClient(fail_job=True)
+        failed_requests = build_requests(["marble lamp"])
+        runner = GeminiBatchRunner(client, batch_dir, sleep=SleepRecorder())
+        try:
+            runner.run("gemini-3-pro-image-preview", failed_requests, config)
+            raised = False
+        except RuntimeError:
+            raised = True
+        key = runner.request_key("gemini-3-pro-image-preview", failed_requests, config)
+        ok &= check("failed: error raised and job record removed", raised and runner.store.get(key) is None)
+
+        # 6. per_prompt 参考图像数量必须与提示词一致
+        try:
+            build_requests(["a", "b"], [reference], "per_prompt")
+            mismatched = False
+        except ValueError:
+            mismatched = True
+        ok &= check("per_prompt: mismatched reference count rejected", mismatched)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
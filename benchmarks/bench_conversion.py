@@ -0,0 +1,112 @@
+"""
+tensor ↔ PIL 转换基准测试
+对比原始的逐帧实现与批次化实现的耗时和峰值内存，并校验输出逐位一致
+
+峰值内存为转换过程中超出转换前常驻内存的部分，与最终输出的大小对比；
+每种实现在独立的子进程中运行。
+
+用法:
+    python benchmarks/bench_conversion.py
+    python benchmarks/bench_conversion.py --width 2048 --height 2048 --batch-size 16
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nodes.utils import pil2tensor, tensor2pil_batch  # noqa: E402
+from memory import current_rss_mb, peak_rss_mb, reset_peak_rss  # noqa: E402
+from reference import reference_pil2tensor, reference_tensor2pil  # noqa: E402
+
+
+def make_pil_images(width, height, batch_size, seed=0):
+    """生成随机内容的RGB图像（直接生成uint8，避免大的临时数组）"""
+    rng = np.random.default_rng(seed)
+    return [Image.fromarray(rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8))
+            for _ in range(batch_size)]
+
+
+def make_tensor(width, height, batch_size, seed=0):
+    """生成随机内容的IMAGE批次"""
+    generator = torch.Generator().manual_seed(seed)
+    return torch.rand((batch_size, height, width, 3), generator=generator)
+
+
+CASES = {
+    "pil2tensor (原始实现 + torch.cat)": (
+        "pil", lambda images: torch.cat([reference_pil2tensor(image) for image in images], dim=0)),
+    "pil2tensor (预分配批次)": (
+        "pil", pil2tensor),
+    "tensor2pil (原始实现逐帧)": (
+        "tensor", lambda images: [reference_tensor2pil(images[i:i + 1]) for i in range(images.shape[0])]),
+    "tensor2pil_batch": (
+        "tensor", tensor2pil_batch),
+}
+
+
+def output_mb(output):
+    if isinstance(output, torch.Tensor):
+        return output.numel() * output.element_size() / (1024 * 1024)
+    return sum(len(image.getbands()) * image.size[0] * image.size[1] for image in output) / (1024 * 1024)
+
+
+def run_case(name, width, height, batch_size):
+    """在子进程中运行一种实现，返回 (耗时秒, 额外峰值MB, 输出MB)"""
+    kind, func = CASES[name]
+    inputs = make_pil_images(width, height, batch_size) if kind == "pil" else make_tensor(width, height, batch_size)
+
+    reset_peak_rss()
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    output = func(inputs)
+    elapsed = time.perf_counter() - start
+    extra_peak = peak_rss_mb() - rss_before
+
+    return elapsed, extra_peak, output_mb(output)
+
+
+def check_outputs(width=256, height=256, batch_size=8):
+    """小尺寸上校验批次化实现与原始实现逐位一致"""
+    images = make_pil_images(width, height, batch_size)
+    expected = torch.cat([reference_pil2tensor(image) for image in images], dim=0)
+    ok = torch.equal(pil2tensor(images), expected)
+
+    tensor = make_tensor(width, height, batch_size)
+    for i, image in enumerate(tensor2pil_batch(tensor)):
+        ok &= np.array_equal(np.array(image), np.array(reference_tensor2pil(tensor[i:i + 1])))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tensor ↔ PIL 转换基准测试")
+    parser.add_argument("--width", type=int, default=4096)
+    parser.add_argument("--height", type=int, default=4096)
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    ok = check_outputs()
+    print(f"输出一致: {'✓' if ok else '✗'}")
+
+    print("=" * 78)
+    print(f"{args.width}x{args.height}, batch={args.batch_size}")
+    print("=" * 78)
+    print(f"{'实现':<34} {'耗时':>10} {'输出':>9} {'额外峰值':>10} {'峰值/输出':>9}")
+    for name in CASES:
+        # 每种实现一个全新的子进程，峰值内存互不影响
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            elapsed, extra_peak, size = executor.submit(
+                run_case, name, args.width, args.height, args.batch_size).result()
+        print(f"{name:<34} {elapsed * 1000:8.1f}ms {size:7.0f}MB {extra_peak:8.0f}MB {extra_peak / size:8.2f}x")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
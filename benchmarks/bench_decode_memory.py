@@ -0,0 +1,123 @@
+"""
+生成结果解码的峰值内存基准测试
+模拟 gemini-3-pro-image-preview 返回的4K图像（PNG和JPEG），对比原始的
+解码 → uint8 numpy → float32 numpy → tensor 路径与 load_image_tensor 的额外峰值内存。
+
+torch和PIL的内存不经过Python分配器，tracemalloc 统计不到，这里使用常驻内存（RSS）的峰值：
+Linux 上每次测量前通过 /proc/self/clear_refs 重置峰值。每次测量在新启动（spawn）的子进程中运行。
+
+glibc 的动态 mmap 阈值会让已释放的PIL图像块留在堆中，结果随运行多出几十MB。子进程固定
+MALLOC_MMAP_THRESHOLD_ 和 MALLOC_TRIM_THRESHOLD_（大块内存直接 mmap、释放后立即归还），
+每个用例运行 --runs 次取中位数，校验结果不受分配器的随机影响。
+
+用法:
+    python benchmarks/bench_decode_memory.py
+    python benchmarks/bench_decode_memory.py --size 2048 --max-ratio 1.35 --runs 5
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nodes.utils import load_image_tensor  # noqa: E402
+from memory import current_rss_mb, peak_rss_mb, reset_peak_rss  # noqa: E402
+from reference import reference_pil2tensor  # noqa: E402
+
+# 子进程的 glibc 分配器设置（字节）：超过该大小的块直接 mmap，释放后超过该大小的空闲堆立即归还
+MALLOC_ENV = {
+    "MALLOC_MMAP_THRESHOLD_": "131072",
+    "MALLOC_TRIM_THRESHOLD_": "131072",
+}
+
+
+def make_encoded_image(size, image_format, seed=0):
+    """生成带渐变和噪声的图像并编码，返回编码后的字节"""
+    rng = np.random.default_rng(seed)
+    image_array = np.empty((size, size, 3), dtype=np.uint8)
+    ramp = np.linspace(0, 200, size, dtype=np.float32)
+    for c in range(3):
+        image_array[:, :, c] = ramp[None, :] if c % 2 == 0 else ramp[:, None]
+    image_array += rng.integers(0, 48, size=image_array.shape, dtype=np.uint8)
+
+    buffer = io.BytesIO()
+    if image_format == "PNG":
+        Image.fromarray(image_array).save(buffer, format="PNG", compress_level=1)
+    else:
+        Image.fromarray(image_array).save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def legacy_decode(data):
+    """原始路径：解码为PIL → uint8 numpy → float32 numpy → tensor"""
+    return reference_pil2tensor(Image.open(io.BytesIO(data)))
+
+
+DECODERS = {
+    "原始路径": legacy_decode,
+    "load_image_tensor": load_image_tensor,
+}
+
+
+def run_case(decoder, data):
+    """在子进程中解码一次，返回 (耗时秒, 额外峰值MB, 输出MB, 输出tensor的校验和)"""
+    reset_peak_rss()
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    output = DECODERS[decoder](data)
+    elapsed = time.perf_counter() - start
+    extra_peak = peak_rss_mb() - rss_before
+
+    size = output.numel() * output.element_size() / (1024 * 1024)
+    return elapsed, extra_peak, size, float(output.double().sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成结果解码的峰值内存基准测试")
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--max-ratio", type=float, default=1.35,
+                        help="load_image_tensor 额外峰值/输出大小的上限，超过时退出码为1")
+    parser.add_argument("--runs", type=int, default=3, help="每个用例的运行次数，取中位数")
+    args = parser.parse_args()
+
+    # spawn 启动的子进程继承环境变量，glibc 在进程启动时读取分配器设置
+    os.environ.update(MALLOC_ENV)
+    context = multiprocessing.get_context("spawn")
+
+    failed = False
+    print(f"{'格式':<6} {'实现':<20} {'耗时':>10} {'输出':>9} {'额外峰值':>10} {'峰值/输出':>9}")
+    for image_format in ("PNG", "JPEG"):
+        data = make_encoded_image(args.size, image_format)
+        checksums = set()
+        for decoder in DECODERS:
+            # 每次测量一个全新的子进程，峰值内存互不影响
+            runs = []
+            for _ in range(max(1, args.runs)):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    runs.append(executor.submit(run_case, decoder, data).result())
+            elapsed = statistics.median(run[0] for run in runs)
+            extra_peak = statistics.median(run[1] for run in runs)
+            size = runs[0][2]
+            checksums.update(run[3] for run in runs)
+            ratio = extra_peak / size
+            if decoder == "load_image_tensor" and ratio > args.max_ratio:
+                failed = True
+            print(f"{image_format:<6} {decoder:<20} {elapsed * 1000:8.1f}ms {size:7.0f}MB "
+                  f"{extra_peak:8.0f}MB {ratio:8.2f}x")
+        same = len(checksums) == 1
+        failed |= not same
+        print(f"{image_format:<6} 输出一致: {'✓' if same else '✗'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+水印去除基准测试与黄金输出校验套件
+
+在 1K / 2K / 4K 分辨率、48px / 96px 水印配置和 1-64 的批次大小下生成带水印的合成图像，
+记录各阶段耗时（转换、内核、编码、保存）和峰值内存（RSS，base 为开始计时前的峰值，
+包含合成数据的开销），并将输出与逐像素参考实现的黄金结果逐位比对。
+每个配置在独立的子进程中运行，峰值内存互不影响。
+
+用法:
+    python benchmarks/bench_remover_suite.py
+    python benchmarks/bench_remover_suite.py --resolutions 1K,2K --batch-sizes 1,8 --json results.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nodes.jm_gemini_watermark_remover import (  # noqa: E402
+    ALPHA_THRESHOLD,
+    WATERMARK_CONFIGS,
+    calculate_watermark_position,
+    remove_watermark,
+    remove_watermark_batch,
+)
+from nodes.utils import tensor2pil, pil2tensor  # noqa: E402
+from reference import load_alpha_map, make_watermarked_image, reference_remove_watermark  # noqa: E402
+
+RESOLUTIONS = {
+    "1K": (1024, 1024),
+    "2K": (2048, 2048),
+    "4K": (4096, 4096),
+}
+
+# 每个配置中不同内容的帧数，批次按此循环复用（黄金结果只需计算这么多次）
+DISTINCT_FRAMES = 4
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_config(resolution, logo_size, batch_size):
+    """
+    在子进程中运行单个配置
+
+    Returns:
+        dict: 各阶段耗时（毫秒）、峰值内存和黄金输出校验结果
+    """
+    torch.set_grad_enabled(False)
+    width, height = RESOLUTIONS[resolution]
+    config = WATERMARK_CONFIGS[logo_size]
+    position = calculate_watermark_position(width, height, config)
+    alpha_map = load_alpha_map(logo_size)
+
+    # 合成输入批次（ComfyUI IMAGE 格式）
+    frames = [make_watermarked_image(width, height, alpha_map, position, seed=i)
+              for i in range(min(batch_size, DISTINCT_FRAMES))]
+    images = torch.empty((batch_size, height, width, 3), dtype=torch.float32)
+    for i in range(batch_size):
+        images[i].copy_(torch.from_numpy(frames[i % len(frames)])).div_(255.0)
+
+    # 黄金结果：对节点实际看到的uint8像素运行参考实现
+    golden = []
+    for i in range(len(frames)):
+        reference_input = np.array(tensor2pil(images[i:i + 1]))
+        reference_remove_watermark(reference_input, alpha_map, position)
+        golden.append(reference_input)
+    del frames
+
+    rss_before = peak_rss_mb()
+    stages = {"to_pil": 0.0, "kernel": 0.0, "encode": 0.0, "save": 0.0, "to_tensor": 0.0}
+    golden_ok = True
+
+    # 逐帧路径（与节点默认模式相同）
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for i in range(batch_size):
+            start = time.perf_counter()
+            image_array = np.array(tensor2pil(images[i:i + 1]))
+            stages["to_pil"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            remove_watermark(image_array, alpha_map, position)
+            stages["kernel"] += time.perf_counter() - start
+
+            golden_ok &= np.array_equal(image_array, golden[i % len(golden)])
+
+            start = time.perf_counter()
+            processed_image = Image.fromarray(image_array)
+            buffer = io.BytesIO()
+            processed_image.save(buffer, format="PNG")
+            stages["encode"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            with open(os.path.join(tmp_dir, f"frame_{i}.png"), "wb") as f:
+                f.write(buffer.getbuffer())
+            stages["save"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            pil2tensor(processed_image)
+            stages["to_tensor"] += time.perf_counter() - start
+            del buffer, processed_image, image_array
+
+    # 批次路径（直接在tensor上修正）
+    start = time.perf_counter()
+    output = remove_watermark_batch(images, alpha_map, position)
+    batch_kernel = time.perf_counter() - start
+
+    rows = slice(position["y"], position["y"] + logo_size)
+    cols = slice(position["x"], position["x"] + logo_size)
+    corrected = torch.from_numpy(np.asarray(alpha_map) >= ALPHA_THRESHOLD)
+    for i in range(batch_size):
+        region = output[i, rows, cols]
+        expected = torch.from_numpy(golden[i % len(golden)][rows, cols])
+        # 修正过的像素为 n/255，取整还原；未修正的像素保持原值，与 tensor2pil 一样截断
+        actual = torch.where(corrected[:, :, None], torch.round(region * 255), region * 255).to(torch.uint8)
+        golden_ok &= torch.equal(actual, expected)
+
+    return {
+        "resolution": resolution,
+        "logo_size": logo_size,
+        "batch_size": batch_size,
+        "stages_ms": {name: round(value * 1000, 2) for name, value in stages.items()},
+        "batch_kernel_ms": round(batch_kernel * 1000, 2),
+        "input_mb": round(images.numel() * images.element_size() / (1024 * 1024), 1),
+        "rss_before_mb": round(rss_before, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "golden_ok": bool(golden_ok),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="水印去除基准测试与黄金输出校验")
+    parser.add_argument("--resolutions", default="1K,2K,4K")
+    parser.add_argument("--logo-sizes", default="48,96")
+    parser.add_argument("--batch-sizes", default="1,4,16,64")
+    parser.add_argument("--max-batch-gb", type=float, default=2.0,
+                        help="跳过输入tensor超过该大小的配置")
+    parser.add_argument("--json", help="将结果写入JSON文件")
+    args = parser.parse_args()
+
+    results = []
+    failed = False
+    header = f"{'res':>4} {'logo':>4} {'B':>3} | {'to_pil':>9} {'kernel':>8} {'encode':>9} {'save':>7} " \
+             f"{'to_tensor':>9} | {'batch':>8} | {'input':>7} {'base RSS':>9} {'peak RSS':>9} | golden"
+    print(header)
+    print("-" * len(header))
+
+    for resolution in args.resolutions.split(","):
+        width, height = RESOLUTIONS[resolution]
+        for logo_size in (int(size) for size in args.logo_sizes.split(",")):
+            for batch_size in (int(size) for size in args.batch_sizes.split(",")):
+                input_gb = batch_size * width * height * 3 * 4 / 1024 ** 3
+                if input_gb > args.max_batch_gb:
+                    print(f"{resolution:>4} {logo_size:>4} {batch_size:>3} | 跳过（输入 {input_gb:.1f} GB）")
+                    continue
+
+                # 每个配置一个全新的子进程，峰值内存单独统计
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    result = executor.submit(run_config, resolution, logo_size, batch_size).result()
+                results.append(result)
+                failed |= not result["golden_ok"]
+
+                stages = result["stages_ms"]
+                print(f"{resolution:>4} {logo_size:>4} {batch_size:>3} | "
+                      f"{stages['to_pil']:9.1f} {stages['kernel']:8.2f} {stages['encode']:9.1f} "
+                      f"{stages['save']:7.1f} {stages['to_tensor']:9.1f} | "
+                      f"{result['batch_kernel_ms']:8.1f} | {result['input_mb']:6.0f}M "
+                      f"{result['rss_before_mb']:8.0f}M {result['peak_rss_mb']:8.0f}M | "
+                      f"{'✓' if result['golden_ok'] else '✗'}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Veo 任务轮询的模拟基准测试
+用模拟时钟运行 OperationPoller：任务完成时间按正态分布随机生成，对比原来每10秒查询一次的
+固定轮询和自适应轮询的查询次数，以及任务完成后多等待的时间（平均、最大）。
+自适应轮询完成后多等待的时间超过固定间隔时校验失败（退出码1）。
+不需要API key，也不真正等待。
+
+用法:
+    python benchmarks/bench_veo_polling.py
+    python benchmarks/bench_veo_polling.py --mean 150 --std 30 --jobs 100
+"""
+import os
+import sys
+import math
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nodes.operation_polling import MAX_POLL_INTERVAL, OperationPoller  # noqa: E402
+
+FIXED_POLL_INTERVAL = 10.0
+
+
+class SimulatedClock:
+    """模拟时钟：sleep 只推进时间"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class SimulatedOperation:
+    def __init__(self, done):
+        self.done = done
+
+
+def run_adaptive(completion_times, model="veo-sim"):
+    """返回每个任务的 (查询次数, 完成后多等待的秒数)"""
+    clock = SimulatedClock()
+    poller = OperationPoller(sleep=clock.sleep, clock=clock)
+    results = []
+    for completion in completion_times:
+        start = clock()
+        refresh = lambda operation: SimulatedOperation(clock() - start >= completion)  # noqa: E731
+        _, run = poller.wait(SimulatedOperation(False), refresh, model, deadline=3600)
+        results.append((run["status_calls"], clock() - start - completion))
+    return results
+
+
+def run_fixed(completion_times):
+    return [(math.ceil(completion / FIXED_POLL_INTERVAL),
+             math.ceil(completion / FIXED_POLL_INTERVAL) * FIXED_POLL_INTERVAL - completion)
+            for completion in completion_times]
+
+
+def summarize(name, results):
+    calls = sum(result[0] for result in results) / len(results)
+    waits = [result[1] for result in results]
+    print(f"{name:<22} {calls:6.1f} calls/job   wait after done: avg {sum(waits) / len(waits):5.1f}s, "
+          f"max {max(waits):5.1f}s")
+    return max(waits)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mean", type=float, default=60.0, help="mean completion time in seconds")
+    parser.add_argument("--std", type=float, default=10.0, help="standard deviation of completion time")
+    parser.add_argument("--jobs", type=int, default=60)
+    parser.add_argument("--warmup", type=int, default=10, help="jobs excluded from the adaptive summary")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    completion_times = [max(5.0, rng.gauss(args.mean, args.std)) for _ in range(args.jobs)]
+    print(f"{args.jobs} jobs, completion time {args.mean:.0f}s ± {args.std:.0f}s")
+
+    adaptive = run_adaptive(completion_times)
+    summarize(f"fixed {FIXED_POLL_INTERVAL:.0f}s", run_fixed(completion_times)[args.warmup:])
+    worst = max(summarize("adaptive (no history)", adaptive[:min(3, args.jobs)]),
+                summarize("adaptive", adaptive[args.warmup:]))
+    ok = worst <= MAX_POLL_INTERVAL + 1e-6
+    print(f"max wait after done {worst:.1f}s <= {MAX_POLL_INTERVAL:.0f}s: {'✓' if ok else '✗'}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
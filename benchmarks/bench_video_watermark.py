@@ -0,0 +1,140 @@
+"""
+视频水印去除基准测试与校验
+用与节点相同的 rawvideo 管道生成带水印的合成MP4夹具（可带正弦波音轨），运行流式去除水印，
+校验输出的帧数与输入一致、音频流被保留、水印区域接近原始背景，并输出吞吐量（帧/秒）。
+不需要网络，需要 ffmpeg（PATH 中或 imageio-ffmpeg）。
+
+用法:
+    python benchmarks/bench_video_watermark.py
+    python benchmarks/bench_video_watermark.py --width 1920 --height 1080 --frames 120 --chunk-frames 16
+"""
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nodes.jm_gemini_watermark_remover import calculate_watermark_position, detect_watermark_config  # noqa: E402
+from nodes.jm_gemini_video_watermark_remover import (  # noqa: E402
+    _read_frames,
+    find_ffmpeg,
+    probe_video,
+    remove_video_watermark,
+)
+from reference import load_alpha_map, make_watermarked_image  # noqa: E402
+
+# 夹具中不同内容的帧数，按此循环
+DISTINCT_FRAMES = 4
+
+# 水印区域的平均绝对误差（相对原始背景）至少应降低到去除前的该比例以下
+MAX_ERROR_RATIO = 0.35
+
+
+def make_fixture(ffmpeg, path, width, height, frames, fps, audio):
+    """
+    通过 rawvideo 管道写入带水印的合成帧，编码为H.264 MP4
+
+    Returns:
+        tuple: (水印位置, 原始背景帧列表)
+    """
+    config = detect_watermark_config(width, height)
+    position = calculate_watermark_position(width, height, config)
+    alpha_map = load_alpha_map(config["logo_size"])
+    clean_alpha = np.zeros_like(np.asarray(alpha_map))
+
+    # 相同种子、alpha全为0时得到同样的背景，作为去除水印后的期望结果
+    watermarked = [make_watermarked_image(width, height, alpha_map, position, seed=i) for i in range(DISTINCT_FRAMES)]
+    clean = [make_watermarked_image(width, height, clean_alpha, position, seed=i) for i in range(DISTINCT_FRAMES)]
+
+    cmd = [ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+           "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-"]
+    if audio:
+        cmd += ["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={frames / fps}",
+                "-map", "0:v", "-map", "1:a", "-c:a", "aac"]
+    cmd += ["-c:v", "libx264", "-crf", "12", "-pix_fmt", "yuv420p", path]
+    encoder = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    for i in range(frames):
+        encoder.stdin.write(watermarked[i % DISTINCT_FRAMES].tobytes())
+    encoder.stdin.close()
+    if encoder.wait() != 0:
+        raise RuntimeError(f"ffmpeg exited with code {encoder.returncode} while writing the fixture")
+    return position, clean
+
+
+def region_errors(ffmpeg, path, width, height, position, clean, chunk_frames=16):
+    """
+    解码视频，返回 (帧数, 水印区域相对原始背景的平均绝对误差)
+    """
+    decoder = subprocess.Popen(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", path, "-f", "rawvideo", "-pix_fmt", "rgb24", "-"],
+        stdout=subprocess.PIPE
+    )
+    rows = slice(position["y"], position["y"] + position["height"])
+    cols = slice(position["x"], position["x"] + position["width"])
+    buffer = np.empty((chunk_frames, height, width, 3), dtype=np.uint8)
+    frames = 0
+    error = 0.0
+    try:
+        while True:
+            count = _read_frames(decoder.stdout, buffer)
+            if not count:
+                break
+            for i in range(count):
+                expected = clean[(frames + i) % len(clean)][rows, cols].astype(np.float32)
+                error += float(np.abs(buffer[i, rows, cols].astype(np.float32) - expected).mean())
+            frames += count
+    finally:
+        decoder.stdout.close()
+        decoder.wait()
+    return frames, error / max(frames, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="视频水印去除基准测试与校验")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--frames", type=int, default=48)
+    parser.add_argument("--fps", type=int, default=24)
+    parser.add_argument("--chunk-frames", type=int, default=32)
+    args = parser.parse_args()
+
+    ffmpeg = find_ffmpeg()
+    failed = False
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for audio in (True, False):
+            fixture = os.path.join(tmp_dir, f"fixture_{'audio' if audio else 'silent'}.mp4")
+            position, clean = make_fixture(ffmpeg, fixture, args.width, args.height, args.frames, args.fps, audio)
+            for detect in (False, True):
+                output = os.path.join(tmp_dir, "output.mp4")
+
+                stats = remove_video_watermark(fixture, output, chunk_frames=args.chunk_frames, detect=detect)
+
+                input_frames, before = region_errors(ffmpeg, fixture, args.width, args.height, position, clean)
+                output_frames, after = region_errors(ffmpeg, output, args.width, args.height, position, clean)
+                has_audio = probe_video(ffmpeg, output)["has_audio"]
+
+                checks = {
+                    "frames": input_frames == args.frames and output_frames == args.frames
+                    and stats["frames"] == args.frames,
+                    "audio": has_audio == audio,
+                    "removed": stats["watermarked"] and after < before * MAX_ERROR_RATIO,
+                }
+                ok = all(checks.values())
+                failed |= not ok
+                print(f"{args.width}x{args.height} audio={'yes' if audio else 'no':<3} "
+                      f"detect={'yes' if detect else 'no':<3} | "
+                      f"帧 {output_frames}/{args.frames} | 音频 {'保留' if has_audio else '无'} | "
+                      f"水印区域误差 {before:6.2f} -> {after:5.2f} | "
+                      f"{stats['frames_per_second']:7.1f} 帧/秒 | "
+                      f"{'✓' if ok else '✗ ' + ', '.join(name for name, passed in checks.items() if not passed)}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
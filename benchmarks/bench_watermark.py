@@ -0,0 +1,171 @@
+"""
+水印去除基准测试
+对比逐像素参考实现与向量化实现的速度，并校验输出逐位一致
+
+用法: python benchmarks/bench_watermark.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nodes import jm_gemini_watermark_remover as remover  # noqa: E402
+from nodes.jm_gemini_watermark_remover import (  # noqa: E402
+    ASSETS_DIR,
+    calculate_alpha_map,
+    calculate_watermark_position,
+    detect_watermark_config,
+    detect_watermarks,
+    remove_watermark,
+    remove_watermark_batch,
+)
+from nodes.utils import tensor2pil, pil2tensor  # noqa: E402
+from reference import (  # noqa: E402
+    load_alpha_map,
+    reference_calculate_alpha_map,
+    reference_remove_watermark,
+)
+
+
+def best_of(func, repeat):
+    """返回多次运行中的最短耗时（秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_alpha_map():
+    print("=" * 60)
+    print("calculate_alpha_map / load_alpha_map")
+    print("=" * 60)
+
+    for logo_size in (48, 96):
+        png_path = os.path.join(ASSETS_DIR, f"bg_{logo_size}.png")
+        bg = np.array(Image.open(png_path).convert("RGB"))
+
+        identical = np.array_equal(reference_calculate_alpha_map(bg), calculate_alpha_map(bg))
+        ref_time = best_of(lambda: reference_calculate_alpha_map(bg), 3)
+        vec_time = best_of(lambda: calculate_alpha_map(bg), 50)
+
+        # 磁盘 .npy 缓存加载（清空进程内缓存）与进程内缓存命中
+        load_alpha_map(logo_size)
+
+        def load_from_disk():
+            remover._ALPHA_MAP_CACHE.clear()
+            load_alpha_map(logo_size)
+
+        disk_time = best_of(load_from_disk, 20)
+        memo_time = best_of(lambda: load_alpha_map(logo_size), 50)
+
+        print(f"bg_{logo_size}.png:")
+        print(f"  参考实现:     {ref_time * 1000:9.3f} ms")
+        print(f"  向量化:       {vec_time * 1000:9.3f} ms")
+        print(f"  磁盘缓存加载: {disk_time * 1e6:9.1f} us")
+        print(f"  进程内缓存:   {memo_time * 1e6:9.1f} us")
+        print(f"  输出一致: {'✓' if identical else '✗'}")
+
+        if not identical:
+            sys.exit(1)
+
+
+def bench_batch(width=1024, height=1024, batch_sizes=(1, 8, 32, 64)):
+    print("=" * 60)
+    print(f"remove_watermark_batch vs 逐帧 PIL 往返 ({width}x{height})")
+    print("=" * 60)
+
+    config = detect_watermark_config(width, height)
+    position = calculate_watermark_position(width, height, config)
+    alpha_map = load_alpha_map(config["logo_size"])
+
+    def per_frame(images):
+        frames = []
+        for i in range(images.shape[0]):
+            image_array = np.array(tensor2pil(images[i:i + 1]))
+            remove_watermark(image_array, alpha_map, position)
+            frames.append(pil2tensor(Image.fromarray(image_array)))
+        return torch.cat(frames, dim=0)
+
+    for batch_size in batch_sizes:
+        images = torch.rand(batch_size, height, width, 3)
+        loop_time = best_of(lambda: per_frame(images), 2)
+        batch_time = best_of(lambda: remove_watermark_batch(images, alpha_map, position), 5)
+        print(f"batch={batch_size:3d}: 逐帧 {loop_time * 1000:9.2f} ms, "
+              f"批次 {batch_time * 1000:8.2f} ms "
+              f"({batch_size / batch_time:8.1f} 帧/秒, {loop_time / batch_time:5.1f}x)")
+
+
+def bench_detection(batch_size=16):
+    print("=" * 60)
+    print(f"detect_watermarks vs remove_watermark_batch (batch={batch_size}，检测应比去除便宜)")
+    print("=" * 60)
+
+    alpha_maps = {48: load_alpha_map(48), 96: load_alpha_map(96)}
+    for width, height in [(1024, 1024), (2048, 2048)]:
+        config = detect_watermark_config(width, height)
+        position = calculate_watermark_position(width, height, config)
+        images = torch.rand(batch_size, height, width, 3)
+
+        detect_time = best_of(lambda: detect_watermarks(images, alpha_maps), 5)
+        remove_time = best_of(lambda: remove_watermark_batch(images, alpha_maps[config["logo_size"]], position), 5)
+        cheaper = detect_time < remove_time
+        print(f"{width}x{height}: 检测 {detect_time * 1000:8.2f} ms, 去除 {remove_time * 1000:8.2f} ms "
+              f"(检测/去除 {detect_time / remove_time:4.2f}) {'✓' if cheaper else '✗'}")
+        if not cheaper:
+            sys.exit(1)
+
+
+def main():
+    bench_alpha_map()
+    print()
+
+    rng = np.random.default_rng(0)
+
+    print("=" * 60)
+    print("remove_watermark: 逐像素参考实现 vs 向量化实现")
+    print("=" * 60)
+
+    for width, height in [(1024, 1024), (2048, 2048)]:
+        config = detect_watermark_config(width, height)
+        position = calculate_watermark_position(width, height, config)
+        alpha_map = load_alpha_map(config["logo_size"])
+        image = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+
+        expected = image.copy()
+        reference_remove_watermark(expected, alpha_map, position)
+        actual = image.copy()
+        remove_watermark(actual, alpha_map, position)
+        identical = np.array_equal(expected, actual)
+
+        ref_time = best_of(lambda: reference_remove_watermark(image.copy(), alpha_map, position), 3)
+        vec_time = best_of(lambda: remove_watermark(image.copy(), alpha_map, position), 20)
+        # 扣除每次复制整幅图像的开销
+        copy_time = best_of(lambda: image.copy(), 20)
+        ref_time = max(ref_time - copy_time, 1e-9)
+        vec_time = max(vec_time - copy_time, 1e-9)
+
+        logo = config["logo_size"]
+        print(f"{logo}x{logo} 水印 ({width}x{height}):")
+        print(f"  参考实现: {ref_time * 1000:9.3f} ms")
+        print(f"  向量化:   {vec_time * 1000:9.3f} ms")
+        print(f"  加速比:   {ref_time / vec_time:9.1f}x")
+        print(f"  输出一致: {'✓' if identical else '✗'}")
+
+        if not identical:
+            sys.exit(1)
+
+    print()
+    bench_batch()
+    print()
+    bench_detection()
+
+
+if __name__ == "__main__":
+    main()
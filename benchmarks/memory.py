@@ -0,0 +1,48 @@
+"""
+基准测试用的进程内存统计
+Linux 上通过 /proc/self/clear_refs 重置峰值，可以分别测量每个阶段的峰值；
+其他平台退回 getrusage（只能得到进程整个生命周期的峰值）
+"""
+import sys
+import resource
+
+PROC_STATUS = "/proc/self/status"
+
+
+def _read_status_mb(field):
+    with open(PROC_STATUS, "r") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def current_rss_mb():
+    """当前常驻内存（MB）"""
+    try:
+        return _read_status_mb("VmRSS")
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    """自上次 reset_peak_rss() 以来（或进程启动以来）的峰值常驻内存（MB）"""
+    try:
+        peak = _read_status_mb("VmHWM")
+        if peak is not None:
+            return peak
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def reset_peak_rss():
+    """把峰值重置为当前常驻内存，不支持时返回 False"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,96 @@
+"""
+水印去除与图像转换的参考实现、合成测试数据
+参考实现保留优化之前的原始算法，作为基准测试的黄金输出
+"""
+import os
+import sys
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nodes import jm_gemini_watermark_remover as remover  # noqa: E402
+from nodes.jm_gemini_watermark_remover import (  # noqa: E402
+    ALPHA_THRESHOLD,
+    ASSETS_DIR,
+    MAX_ALPHA,
+    LOGO_VALUE,
+)
+
+
+def reference_remove_watermark(image_data, alpha_map, position):
+    """逐像素参考实现（向量化之前的原始算法），用于校验输出"""
+    x = position["x"]
+    y = position["y"]
+    for row in range(position["height"]):
+        for col in range(position["width"]):
+            alpha = alpha_map[row, col]
+            if alpha < ALPHA_THRESHOLD:
+                continue
+            alpha = min(alpha, MAX_ALPHA)
+            one_minus_alpha = 1.0 - alpha
+            for c in range(3):
+                watermarked = image_data[y + row, x + col, c]
+                original = (watermarked - alpha * LOGO_VALUE) / one_minus_alpha
+                image_data[y + row, x + col, c] = np.clip(np.round(original), 0, 255).astype(np.uint8)
+
+
+def reference_calculate_alpha_map(bg_image_data):
+    """逐像素参考实现（向量化之前的原始算法），用于校验alpha映射"""
+    height, width = bg_image_data.shape[:2]
+    alpha_map = np.zeros((height, width), dtype=np.float32)
+    for i in range(height):
+        for j in range(width):
+            r, g, b = bg_image_data[i, j, 0], bg_image_data[i, j, 1], bg_image_data[i, j, 2]
+            alpha_map[i, j] = max(r, g, b) / 255.0
+    return alpha_map
+
+
+def load_alpha_map(logo_size):
+    return remover.load_alpha_map(os.path.join(ASSETS_DIR, f"bg_{logo_size}.png"))
+
+
+def make_watermarked_image(width, height, alpha_map, position, seed=0):
+    """
+    生成带水印的合成图像：平滑的随机背景 + 按Gemini方式混合的白色logo
+
+    Returns:
+        numpy.ndarray: (height, width, 3) uint8
+    """
+    rng = np.random.default_rng(seed)
+    # 低分辨率随机色块经双线性放大，得到接近真实照片的平滑背景
+    coarse = rng.integers(0, 256, size=(height // 64 + 2, width // 64 + 2, 3)).astype(np.float32)
+    ys = np.linspace(0, coarse.shape[0] - 1.001, height)
+    xs = np.linspace(0, coarse.shape[1] - 1.001, width)
+    y0, x0 = ys.astype(int), xs.astype(int)
+    fy, fx = (ys - y0)[:, None, None], (xs - x0)[None, :, None]
+    top = coarse[y0][:, x0] * (1 - fx) + coarse[y0][:, x0 + 1] * fx
+    bottom = coarse[y0 + 1][:, x0] * (1 - fx) + coarse[y0 + 1][:, x0 + 1] * fx
+    image = top * (1 - fy) + bottom * fy
+    image += rng.normal(0, 4, size=image.shape)
+
+    x, y = position["x"], position["y"]
+    size = position["width"]
+    alpha = np.asarray(alpha_map[:size, :size])[:, :, None]
+    region = image[y:y + size, x:x + size]
+    image[y:y + size, x:x + size] = alpha * LOGO_VALUE + (1 - alpha) * region
+
+    return np.clip(np.round(image), 0, 255).astype(np.uint8)
+
+
+def reference_tensor2pil(image_tensor):
+    """tensor2pil 的原始实现（只支持单帧），用于校验输出"""
+    if len(image_tensor.shape) == 3:
+        image_tensor = image_tensor.unsqueeze(0)
+    image_np = (image_tensor.squeeze(0).cpu().numpy() * 255).astype(np.uint8)
+    return Image.fromarray(image_np)
+
+
+def reference_pil2tensor(image):
+    """pil2tensor 的原始实现（只支持单张），用于校验输出"""
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image_np = np.array(image).astype(np.float32) / 255.0
+    return torch.from_numpy(image_np).unsqueeze(0)
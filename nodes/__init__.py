@@ -13,22 +13,32 @@ from .jm_gemini_video_node import NODE_DISPLAY_NAME_MAPPINGS as VIDEO_NODE_DISPL
 from .jm_gemini_watermark_remover import NODE_CLASS_MAPPINGS as WATERMARK_NODE_CLASS_MAPPINGS
 from .jm_gemini_watermark_remover import NODE_DISPLAY_NAME_MAPPINGS as WATERMARK_NODE_DISPLAY_NAME_MAPPINGS
 
+from .jm_gemini_video_watermark_remover import NODE_CLASS_MAPPINGS as VIDEO_WATERMARK_NODE_CLASS_MAPPINGS
+from .jm_gemini_video_watermark_remover import NODE_DISPLAY_NAME_MAPPINGS as VIDEO_WATERMARK_NODE_DISPLAY_NAME_MAPPINGS
+
 from .jm_gemini_reverse_node import NODE_CLASS_MAPPINGS as REVERSE_NODE_CLASS_MAPPINGS
 from .jm_gemini_reverse_node import NODE_DISPLAY_NAME_MAPPINGS as REVERSE_NODE_DISPLAY_NAME_MAPPINGS
 
+from .jm_gemini_batch_node import NODE_CLASS_MAPPINGS as BATCH_NODE_CLASS_MAPPINGS
+from .jm_gemini_batch_node import NODE_DISPLAY_NAME_MAPPINGS as BATCH_NODE_DISPLAY_NAME_MAPPINGS
+
 # 合并所有节点映射
 NODE_CLASS_MAPPINGS = {
     **IMAGE_NODE_CLASS_MAPPINGS,
     **VIDEO_NODE_CLASS_MAPPINGS,
     **WATERMARK_NODE_CLASS_MAPPINGS,
+    **VIDEO_WATERMARK_NODE_CLASS_MAPPINGS,
     **REVERSE_NODE_CLASS_MAPPINGS,
+    **BATCH_NODE_CLASS_MAPPINGS,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     **IMAGE_NODE_DISPLAY_NAME_MAPPINGS,
     **VIDEO_NODE_DISPLAY_NAME_MAPPINGS,
     **WATERMARK_NODE_DISPLAY_NAME_MAPPINGS,
+    **VIDEO_WATERMARK_NODE_DISPLAY_NAME_MAPPINGS,
     **REVERSE_NODE_DISPLAY_NAME_MAPPINGS,
+    **BATCH_NODE_DISPLAY_NAME_MAPPINGS,
 }
 
 __all__ = ['NODE_CLASS_MAPPINGS', 'NODE_DISPLAY_NAME_MAPPINGS']
@@ -0,0 +1,235 @@
+"""
+ComfyUI-JM-Gemini-API File Uploads
+参考图像通过 Files API 上传并复用
+
+参考图像上传一次后，请求中只引用文件URI，不再内联图像字节。上传结果按
+（API key、图像编码字节的哈希）缓存到服务端的过期时间（Files API 默认保存48小时），
+缓存保存在磁盘上，ComfyUI 重启后仍可复用。文件属于上传它的key所在的项目，
+使用key池时每个key分别上传。
+"""
+
+import io
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from google.genai import errors, types
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 参考图像的发送方式：inline 每次请求内联图像字节；files_api 上传一次后按URI引用
+REFERENCE_UPLOAD_MODES = ["inline", "files_api"]
+
+DEFAULT_UPLOAD_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                         "cache", "uploaded_files.json")
+
+# 距离过期不足该秒数的文件不再使用，避免请求过程中文件过期
+EXPIRY_MARGIN = 3600.0
+
+# 服务端没有返回过期时间时，按 Files API 的默认保存时间计算
+DEFAULT_FILE_TTL = 48 * 3600.0
+
+# 等待上传的文件变为 ACTIVE 的最长时间（秒）
+ACTIVE_TIMEOUT = 30.0
+ACTIVE_POLL_INTERVAL = 1.0
+
+# 400/403 错误的消息提到文件资源或文件URI时，才认为是引用的文件不可用
+FILE_ERROR_PATTERN = re.compile(r"\bfiles?\b|file_?uri", re.IGNORECASE)
+
+
+def _key_id(api_key):
+    """缓存中用key的哈希区分项目，不保存key本身"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def is_missing_file_error(error):
+    """
+    引用的文件已被删除、过期或不属于当前key时，API返回的错误：消息中提到文件的404/400/403。
+    其他错误不算：403（key无效或被撤销、没有权限）交给key池处理，404（例如模型名错误）重新上传也无济于事
+    """
+    if not isinstance(error, errors.APIError):
+        return False
+    return error.code in (400, 403, 404) and bool(FILE_ERROR_PATTERN.search(str(error.message or "")))
+
+
+class UploadedFileCache:
+    """
+    已上传参考图像的缓存，线程安全
+
+    条目：{key哈希}:{内容哈希} -> {"name", "uri", "mime_type", "expires"}，expires 为 Unix 时间戳。
+    同一张图像同时被多个请求使用时只上传一次。
+    """
+
+    def __init__(self, path=DEFAULT_UPLOAD_CACHE_PATH, sleep=time.sleep):
+        self.path = path
+        self.sleep = sleep
+        self._entries = None
+        self._lock = threading.Lock()
+        self._uploading = {}
+        self.uploads = 0
+        self.reused = 0
+        self.expired = 0
+        self.invalidated = 0
+        self.bytes_uploaded = 0
+        self.bytes_saved = 0
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"[JM-Gemini] Ignoring unreadable upload cache {self.path}: {e}")
+
+    def _save(self):
+        """写入临时文件再替换，过期条目不保存"""
+        now = time.time()
+        self._entries = {key: entry for key, entry in self._entries.items() if entry["expires"] > now}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"[JM-Gemini] Could not save upload cache: {e}")
+
+    def _lookup(self, cache_key):
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            return None
+        if entry["expires"] - EXPIRY_MARGIN <= time.time():
+            del self._entries[cache_key]
+            self.expired += 1
+            return None
+        return entry
+
+    def _upload(self, client, data, mime_type, digest):
+        """
+        上传图像并等待文件可用
+
+        Raises:
+            RuntimeError: 服务端处理失败
+            TimeoutError: ACTIVE_TIMEOUT 秒后文件仍不可用（不缓存，可以重试）
+        """
+        uploaded = client.files.upload(
+            file=io.BytesIO(data),
+            config=types.UploadFileConfig(mime_type=mime_type, display_name=f"jm-gemini-{digest[:16]}"),
+        )
+        deadline = time.monotonic() + ACTIVE_TIMEOUT
+        while uploaded.state == types.FileState.PROCESSING and time.monotonic() < deadline:
+            self.sleep(ACTIVE_POLL_INTERVAL)
+            uploaded = client.files.get(name=uploaded.name)
+        if uploaded.state == types.FileState.FAILED:
+            raise RuntimeError(f"Upload of reference image {uploaded.name} failed: {uploaded.error}")
+        if uploaded.state != types.FileState.ACTIVE:
+            raise TimeoutError(f"Uploaded reference image {uploaded.name} is still {uploaded.state} "
+                               f"after {ACTIVE_TIMEOUT:.0f}s")
+
+        expires = uploaded.expiration_time.timestamp() if uploaded.expiration_time else time.time() + DEFAULT_FILE_TTL
+        return {"name": uploaded.name, "uri": uploaded.uri,
+                "mime_type": uploaded.mime_type or mime_type, "expires": expires}
+
+    def get_or_upload(self, api_key, client, data, mime_type):
+        """
+        返回图像对应的已上传文件（缓存中没有或即将过期时上传）
+
+        Returns:
+            tuple: (缓存键, 条目dict)
+        """
+        cache_key = f"{_key_id(api_key)}:{hashlib.sha256(data).hexdigest()}"
+        while True:
+            with self._lock:
+                self._load()
+                entry = self._lookup(cache_key)
+                if entry is not None:
+                    self.reused += 1
+                    self.bytes_saved += len(data)
+                    return cache_key, entry
+                pending = self._uploading.get(cache_key)
+                if pending is None:
+                    pending = self._uploading[cache_key] = threading.Event()
+                    break
+            # 其他请求正在上传同一张图像：等它完成后再查缓存
+            pending.wait()
+
+        try:
+            start = time.perf_counter()
+            entry = self._upload(client, data, mime_type, cache_key.split(":")[1])
+            logger.info(f"[JM-Gemini] Uploaded reference image ({len(data) / 1024:.0f} KB) as {entry['name']} "
+                        f"in {time.perf_counter() - start:.1f}s")
+            with self._lock:
+                self._entries[cache_key] = entry
+                self.uploads += 1
+                self.bytes_uploaded += len(data)
+                self._save()
+            return cache_key, entry
+        finally:
+            with self._lock:
+                self._uploading.pop(cache_key).set()
+
+    def resolve(self, api_key, client, contents):
+        """
+        将contents中内联的图像替换为已上传文件的URI引用
+
+        Returns:
+            tuple: (新的contents列表, 使用的缓存键列表)
+        """
+        if not isinstance(contents, (list, tuple)):
+            return contents, []
+        resolved = []
+        used = []
+        for item in contents:
+            inline_data = getattr(item, "inline_data", None)
+            if inline_data is None or not inline_data.data:
+                resolved.append(item)
+                continue
+            cache_key, entry = self.get_or_upload(api_key, client, inline_data.data,
+                                                  inline_data.mime_type or "image/png")
+            resolved.append(types.Part.from_uri(file_uri=entry["uri"], mime_type=entry["mime_type"]))
+            used.append(cache_key)
+        return resolved, used
+
+    def invalidate(self, cache_keys):
+        """删除条目（服务端报告文件不存在时），下次使用时重新上传"""
+        with self._lock:
+            self._load()
+            removed = [key for key in cache_keys if self._entries.pop(key, None) is not None]
+            self.invalidated += len(removed)
+            if removed:
+                self._save()
+
+    def stats(self):
+        """上传次数、复用次数、过期和失效的条目数、上传字节数和复用节省的请求字节数"""
+        with self._lock:
+            self._load()
+            return {
+                "entries": len(self._entries),
+                "uploads": self.uploads,
+                "reused": self.reused,
+                "expired": self.expired,
+                "invalidated": self.invalidated,
+                "bytes_uploaded": self.bytes_uploaded,
+                "bytes_saved": self.bytes_saved,
+            }
+
+
+_UPLOAD_CACHE = None
+_UPLOAD_CACHE_LOCK = threading.Lock()
+
+
+def get_upload_cache():
+    """获取进程内共享的上传缓存"""
+    global _UPLOAD_CACHE
+    with _UPLOAD_CACHE_LOCK:
+        if _UPLOAD_CACHE is None:
+            _UPLOAD_CACHE = UploadedFileCache()
+        return _UPLOAD_CACHE
@@ -16,6 +16,11 @@ from dataclasses import dataclass, field
 from datetime import datetime
 import time
 
+from ..rate_limiter import get_scheduler
+
+# 网页版请求在共享调度器中的限额键（同一账号的各模型共用配额）
+RATE_LIMIT_KEY = "gemini-web"
+
 
 class CookieExpiredError(Exception):
     """Cookie 过期或无效异常"""
@@ -107,6 +112,7 @@ class GeminiClient:
         model_ids: dict = None,
         debug: bool = False,
         media_base_url: str = None,
+        priority: int = 0,
     ):
         """
         初始化客户端 - 手动填写 token
@@ -122,6 +128,7 @@ class GeminiClient:
             model_ids: 模型 ID 映射 {"flash": "xxx", "pro": "xxx", "thinking": "xxx"}
             debug: 是否打印调试信息
             media_base_url: 媒体文件的基础 URL (如 http://localhost:8000)，用于构建完整的媒体访问 URL
+            priority: 在共享调度器中排队时的优先级（越大越先发送）
         """
         self.secure_1psid = secure_1psid
         self.secure_1psidts = secure_1psidts
@@ -131,6 +138,7 @@ class GeminiClient:
         self.push_id = push_id
         self.debug = debug
         self.media_base_url = media_base_url or ""
+        self.priority = priority
         
         # 模型 ID 映射 (用于请求头选择模型)
         self.model_ids = model_ids or {
@@ -1145,7 +1153,9 @@ class GeminiClient:
         
         for attempt in range(max_retries):
             try:
-                resp = self.session.post(url, params=params, data=form_data, headers=model_headers, timeout=60.0)
+                # 按共享调度器的限额排队，避免多个节点同时请求触发限流
+                with get_scheduler().slot(RATE_LIMIT_KEY, self.priority):
+                    resp = self.session.post(url, params=params, data=form_data, headers=model_headers, timeout=60.0)
             
                 if self.debug:
                     print(f"[DEBUG] 响应状态: {resp.status_code}")
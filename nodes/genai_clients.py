@@ -0,0 +1,158 @@
+"""
+ComfyUI-JM-Gemini-API genai Client Pool
+进程内共享的 genai.Client 注册表
+
+按API key和客户端参数复用 genai.Client，保留HTTP连接池和TLS会话，
+后续请求走keep-alive连接，不必每次重新握手。
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from google import genai
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 客户端空闲超过该秒数后从注册表移除
+CLIENT_IDLE_TIMEOUT = 600
+
+# 启动预热：JM_GEMINI_WARMUP=1 时，用以下环境变量中的API key预先建立连接
+WARMUP_ENV = "JM_GEMINI_WARMUP"
+WARMUP_KEY_ENVS = ("JM_GEMINI_API_KEY", "GEMINI_API_KEY", "GOOGLE_API_KEY")
+WARMUP_MODEL = "gemini-2.5-flash-image"
+
+
+class GenaiClientPool:
+    """
+    genai.Client 注册表
+
+    键为API key与客户端参数的哈希（不保存明文key），线程安全。
+    被移除的客户端不主动关闭：仍在使用它的调用持有引用，最后一个引用释放时
+    由 genai 在垃圾回收时关闭连接。
+    """
+
+    def __init__(self, idle_timeout=CLIENT_IDLE_TIMEOUT, factory=None):
+        self.idle_timeout = idle_timeout
+        self._factory = factory or genai.Client
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    @staticmethod
+    def _key(api_key, options):
+        hasher = hashlib.sha256(api_key.encode("utf-8"))
+        hasher.update(repr(sorted(options.items())).encode("utf-8"))
+        return hasher.hexdigest()
+
+    def get(self, api_key, **options):
+        """
+        获取（或创建）API key对应的客户端
+
+        Args:
+            api_key: Gemini API key
+            **options: 传给 genai.Client 的其他参数（例如 http_options）
+        """
+        key = self._key(api_key, options)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                entry[1] = now
+                self.reused += 1
+                return entry[0]
+
+        # 在锁外创建，避免阻塞其他节点；并发创建时保留先写入的那个
+        client = self._factory(api_key=api_key, **options)
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None:
+                entry[1] = now
+                self.reused += 1
+                return entry[0]
+            self._clients[key] = [client, now]
+            self.created += 1
+        logger.info(f"[JM-Gemini] Created genai client ({len(self._clients)} pooled)")
+        return client
+
+    def _evict_idle(self, now):
+        expired = [key for key, (_, last_used) in self._clients.items() if now - last_used > self.idle_timeout]
+        for key in expired:
+            del self._clients[key]
+        self.evicted += len(expired)
+
+    def evict_idle(self):
+        """移除空闲超时的客户端"""
+        with self._lock:
+            self._evict_idle(time.monotonic())
+
+    def stats(self):
+        """创建、复用、移除次数和当前池中的客户端数"""
+        with self._lock:
+            return {
+                "pooled": len(self._clients),
+                "created": self.created,
+                "reused": self.reused,
+                "evicted": self.evicted,
+            }
+
+    def clear(self):
+        """清空注册表"""
+        with self._lock:
+            self._clients.clear()
+
+
+_CLIENT_POOL = GenaiClientPool()
+
+
+def get_client_pool():
+    """获取进程内共享的客户端注册表"""
+    return _CLIENT_POOL
+
+
+def get_client(api_key, **options):
+    """从共享注册表获取 genai.Client"""
+    return _CLIENT_POOL.get(api_key, **options)
+
+
+def warm_up(api_keys, model=WARMUP_MODEL):
+    """
+    预热客户端：创建客户端并发送一次轻量请求（查询模型信息），提前建立TLS连接
+
+    Returns:
+        int: 预热成功的客户端数
+    """
+    warmed = 0
+    for api_key in api_keys:
+        try:
+            start = time.perf_counter()
+            get_client(api_key).models.get(model=model)
+            warmed += 1
+            logger.info(f"[JM-Gemini] Warmed up genai client in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            logger.warning(f"[JM-Gemini] genai client warm-up failed: {e}")
+    return warmed
+
+
+def warm_up_from_env():
+    """
+    ComfyUI启动时调用：设置了 JM_GEMINI_WARMUP=1 时，在后台线程中预热环境变量里的API key
+
+    Returns:
+        threading.Thread 或 None
+    """
+    if os.environ.get(WARMUP_ENV, "").strip().lower() not in ("1", "true", "yes"):
+        return None
+    api_keys = [os.environ[name].strip() for name in WARMUP_KEY_ENVS if os.environ.get(name, "").strip()]
+    if not api_keys:
+        logger.warning(f"[JM-Gemini] {WARMUP_ENV} is set but no API key found in {', '.join(WARMUP_KEY_ENVS)}")
+        return None
+    thread = threading.Thread(target=warm_up, args=(list(dict.fromkeys(api_keys)),),
+                              name="JM-Gemini-Warmup", daemon=True)
+    thread.start()
+    return thread
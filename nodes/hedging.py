@@ -0,0 +1,252 @@
+"""
+ComfyUI-JM-Gemini-API Hedging
+对冲请求：降低长尾延迟
+
+请求超过该模型历史延迟的某个分位数仍未返回时，再发送一个相同的请求，使用先成功的结果。
+一个请求成功后立即返回，不再等待另一个：它的结果被忽略（同步SDK无法取消进行中的请求，
+它会在后台线程中结束，仍会计费）。
+每个请求通过 acquire 各自占用资源（key、限速名额），在它自己的线程中 func 结束后才释放，
+被忽略的请求在结束前同样计入限速和key的进行中请求数；对冲请求不等待资源，没有空闲名额时不对冲。
+只对 func 计时：等待key和名额的时间不计入延迟。
+对冲次数受预算限制：每个请求积累 budget 个对冲额度（例如0.1表示每10个请求最多对冲1次），
+额度上限为 HEDGE_BUDGET_BURST，成本始终有界。
+
+每个模型记录最近成功请求的延迟（latency.LatencyHistory，包括被忽略的请求，它们结束时同样记录），
+作为对冲时机的依据。
+"""
+
+import time
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+from .latency import LatencyHistory
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 样本少于该数量时不对冲（分位数还不可靠）
+MIN_SAMPLES = 5
+
+# 对冲额度上限（允许短时间内连续对冲的次数）
+HEDGE_BUDGET_BURST = 3.0
+
+DEFAULT_HEDGE_PERCENTILE = 90
+DEFAULT_HEDGE_BUDGET_PERCENT = 10
+
+
+class HedgePolicy:
+    """
+    对冲策略
+
+    Args:
+        percentile: 请求超过历史延迟的该分位数后发送对冲请求
+        budget: 每个请求积累的对冲额度（0.1 表示最多约10%的请求被对冲）
+    """
+
+    def __init__(self, percentile=DEFAULT_HEDGE_PERCENTILE, budget=DEFAULT_HEDGE_BUDGET_PERCENT / 100.0):
+        self.percentile = percentile
+        self.budget = budget
+
+
+class HedgeBudget:
+    """对冲额度：每个请求增加 ratio，对冲消耗1，上限 max_tokens"""
+
+    def __init__(self, max_tokens=HEDGE_BUDGET_BURST):
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def add(self, ratio):
+        self.tokens = min(self.max_tokens, self.tokens + ratio)
+
+    def refund(self):
+        self.tokens = min(self.max_tokens, self.tokens + 1.0)
+
+    def try_spend(self):
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+class Hedger:
+    """
+    按模型记录延迟并对冲慢请求，线程安全
+    """
+
+    def __init__(self, history=None):
+        self.history = history or LatencyHistory()
+        self._budgets = defaultdict(HedgeBudget)
+        self._stats = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def _count(self, model, **counters):
+        with self._lock:
+            stats = self._stats[model]
+            for name, value in counters.items():
+                stats[name] += value
+
+    def _start(self, func, args, model, kwargs, name, held=None):
+        """
+        在新线程中调用 func，成功时记录延迟；不使用线程池，被忽略的请求不会占用其他请求的线程。
+        held 为 acquire 返回的 (value, release)：value 作为第一个参数，func 结束后调用 release(error)
+        """
+        future = Future()
+        if held is not None:
+            args = (held[0],) + tuple(args)
+
+        def run():
+            future.set_running_or_notify_cancel()
+            start = time.monotonic()
+            try:
+                result = func(*args, model=model, **kwargs)
+            except BaseException as e:
+                if held is not None:
+                    held[1](e)
+                future.set_exception(e)
+                return
+            self.history.record(model, time.monotonic() - start)
+            if held is not None:
+                held[1](None)
+            future.set_result(result)
+
+        threading.Thread(target=run, name=f"JM-Gemini-{name}", daemon=True).start()
+        return future
+
+    def _acquire_hedge(self, acquire, model):
+        """不等待地为对冲请求占用资源；不可用时返回None"""
+        try:
+            return acquire(False)
+        except Exception as e:
+            logger.info(f"[JM-Gemini] Not hedging {model} request: {e}")
+            return None
+
+    def call(self, func, *args, model, policy=None, acquire=None, **kwargs):
+        """
+        调用 func(*args, model=model, **kwargs)；policy 为None时直接调用（只记录延迟）
+
+        超过延迟分位数仍未返回且有对冲额度时，发送相同的对冲请求，返回先成功的结果，
+        不等待另一个请求结束；两个请求都失败时抛出先失败的异常。
+
+        Args:
+            acquire: acquire(wait) 为一个请求占用资源，返回 (value, release)：value 作为 func 的第一个参数，
+                func 结束后（包括被忽略的请求）调用 release(error)，成功时 error 为None。
+                wait 为True时可以等待（原请求）；为False时（对冲请求）不等待，资源不可用时返回None，跳过对冲。
+                为None时不占用资源
+        """
+        if policy is None:
+            held = acquire(True) if acquire is not None else None
+            call_args = (held[0],) + args if held is not None else args
+            start = time.monotonic()
+            try:
+                result = func(*call_args, model=model, **kwargs)
+            except BaseException as e:
+                if held is not None:
+                    held[1](e)
+                raise
+            self.history.record(model, time.monotonic() - start)
+            if held is not None:
+                held[1](None)
+            return result
+
+        delay = self.history.percentile(model, policy.percentile, min_samples=MIN_SAMPLES)
+        with self._lock:
+            self._budgets[model].add(policy.budget)
+        self._count(model, requests=1)
+
+        primary = self._start(func, args, model, kwargs, "Primary", acquire(True) if acquire is not None else None)
+        if delay is None:
+            self._count(model, no_history=1)
+            return primary.result()
+        if wait([primary], timeout=delay).done:
+            return primary.result()
+
+        with self._lock:
+            allowed = self._budgets[model].try_spend()
+        if not allowed:
+            self._count(model, budget_denied=1)
+            return primary.result()
+
+        held = self._acquire_hedge(acquire, model) if acquire is not None else None
+        if acquire is not None and held is None:
+            with self._lock:
+                self._budgets[model].refund()
+            self._count(model, no_slot=1)
+            return primary.result()
+
+        logger.info(f"[JM-Gemini] {model} request still running after p{policy.percentile} ({delay:.1f}s), "
+                    f"sending a hedged request")
+        self._count(model, hedged=1)
+        start = time.monotonic()
+        pending = {primary: "primary", self._start(func, args, model, kwargs, "Hedge", held): "hedge"}
+        failures = []
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                if future.exception() is None:
+                    self._count(model, **{f"{name}_won": 1})
+                    if name == "hedge":
+                        logger.info(f"[JM-Gemini] Hedged {model} request won {time.monotonic() - start:.1f}s "
+                                    f"after it was sent")
+                    return future.result()
+                failures.append(future.exception())
+        self._count(model, both_failed=1)
+        raise failures[0]
+
+    def stats(self, model):
+        """
+        请求数、对冲次数、对冲请求先返回的次数（hedge_won）及比例、原请求先返回的次数、
+        预算不足未对冲的次数、历史样本不足未对冲的次数、没有空闲key或名额未对冲的次数（no_slot），
+        以及延迟分位数
+        """
+        with self._lock:
+            stats = dict(self._stats.get(model, {}))
+            budget = self._budgets[model].tokens if model in self._budgets else HEDGE_BUDGET_BURST
+        hedged = stats.get("hedged", 0)
+        stats["hedge_win_rate"] = round(stats.get("hedge_won", 0) / hedged, 2) if hedged else 0.0
+        stats["budget_left"] = round(budget, 2)
+        stats["latency"] = self.history.summary(model)
+        return stats
+
+
+_HEDGER = Hedger()
+
+
+def get_hedger():
+    """获取进程内共享的对冲器（延迟历史和对冲额度按模型共享）"""
+    return _HEDGER
+
+
+def hedge_stats(model):
+    """模型的对冲统计和延迟分位数"""
+    return _HEDGER.stats(model)
+
+
+def hedge_policy(hedge_percentile=0, hedge_budget=DEFAULT_HEDGE_BUDGET_PERCENT):
+    """按节点输入创建对冲策略；hedge_percentile 为0时不对冲，返回None"""
+    if not hedge_percentile:
+        return None
+    return HedgePolicy(percentile=hedge_percentile, budget=hedge_budget / 100.0)
+
+
+def hedging_input_types():
+    """
+    节点共用的对冲选项（放在节点的 optional 输入中）
+    """
+    return {
+        "hedge_percentile": ("INT", {
+            "default": 0,
+            "min": 0,
+            "max": 99,
+            "tooltip": "0 = off. When a request runs longer than this percentile of recent latencies, "
+                       "send a duplicate and use whichever succeeds first (the duplicate is billed)"
+        }),
+        "hedge_budget": ("INT", {
+            "default": DEFAULT_HEDGE_BUDGET_PERCENT,
+            "min": 1,
+            "max": 100,
+            "tooltip": "At most this many hedged requests per 100 requests"
+        }),
+    }
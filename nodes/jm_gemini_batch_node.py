@@ -0,0 +1,570 @@
+"""
+ComfyUI-JM-Gemini-API Batch Node
+通过 Gemini Batch API 批量生成图像：将提示词列表（和参考图像）打包成一个批处理任务
+
+批处理任务按标准价格的一半计费，通常在24小时内完成，适合不在意延迟的批量生成。
+任务名保存在 output/gemini_batch/jobs.json 中：ComfyUI重启后重新执行相同的输入时，
+继续等待已提交的任务，不会重复提交；已取回的结果直接从磁盘读取。
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import mimetypes
+import tempfile
+import threading
+import torch
+from google.genai import errors, types
+
+from .genai_clients import get_client
+from .jm_gemini_image_node import (
+    DEFAULT_RESOLUTION,
+    GEMINI_2_5_FLASH_MODEL,
+    GEMINI_3_PRO_MODEL,
+    REFERENCE_IMAGE_FORMAT,
+    SUPPORTED_RESOLUTIONS,
+)
+from .response_cache import ResponseCache
+from .utils import (
+    DEFAULT_UPLOAD_QUALITY,
+    format_upload_summary,
+    get_output_dir,
+    iter_upload_frames,
+    load_image_tensor,
+    stack_images,
+    upload_input_types,
+    upload_policy,
+    write_output_file,
+)
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 批处理任务记录和结果保存在 output/gemini_batch 下
+BATCH_DIR_NAME = "gemini_batch"
+JOBS_FILE_NAME = "jobs.json"
+
+# 内联请求的总大小上限，超过时写成JSONL文件通过Files API上传
+INLINE_REQUEST_LIMIT = 20 * 1024 * 1024
+
+# 结果文件分块下载到磁盘时每块的字节数
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+# 轮询间隔从 poll_interval 开始，每次乘以 POLL_BACKOFF，最长 MAX_POLL_INTERVAL 秒
+POLL_BACKOFF = 1.5
+MAX_POLL_INTERVAL = 600
+
+COMPLETED_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED"}
+FAILED_STATES = {"JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+OUTPUT_MODES = ["image_batch", "directory"]
+REFERENCE_MODES = ["shared", "per_prompt"]
+
+
+def build_generation_config(model, aspect_ratio, resolution):
+    """与图像节点相同的生成参数"""
+    if model == GEMINI_2_5_FLASH_MODEL:
+        image_config = types.ImageConfig(aspect_ratio=aspect_ratio)
+    else:
+        image_size = resolution if resolution in SUPPORTED_RESOLUTIONS else DEFAULT_RESOLUTION
+        image_config = types.ImageConfig(aspect_ratio=aspect_ratio, image_size=image_size)
+    return types.GenerateContentConfig(response_modalities=['TEXT', 'IMAGE'], image_config=image_config)
+
+
+def build_requests(prompts, reference_parts=None, reference_mode="shared"):
+    """
+    为每个提示词构建请求的contents，顺序与图像节点相同
+
+    Args:
+        prompts: 提示词列表
+        reference_parts: 参考图像的 Part 列表
+        reference_mode: shared 每个请求都带上全部参考图像；per_prompt 第i张参考图像只用于第i个提示词
+
+    Returns:
+        list: 每个请求的contents
+    """
+    reference_parts = reference_parts or []
+    if reference_mode == "per_prompt" and reference_parts and len(reference_parts) != len(prompts):
+        raise ValueError(f"per_prompt reference mode needs one reference image per prompt, "
+                         f"got {len(reference_parts)} images for {len(prompts)} prompts")
+
+    requests = []
+    for index, prompt in enumerate(prompts):
+        if not reference_parts:
+            requests.append(prompt)
+            continue
+        parts = [reference_parts[index]] if reference_mode == "per_prompt" else reference_parts
+        if len(parts) == 1:
+            # 单图编辑模式：[prompt, image]
+            requests.append([prompt, parts[0]])
+        else:
+            # 多图输入模式：[image1, image2, ..., prompt]
+            requests.append([*parts, prompt])
+    return requests
+
+
+def _request_size(contents):
+    """请求中文本和图像数据的字节数（上传时图像按base64编码，再放大4/3）"""
+    if isinstance(contents, str):
+        return len(contents.encode("utf-8"))
+    return sum(_request_size(item) if isinstance(item, str) else len(item.inline_data.data) * 4 // 3
+               for item in contents)
+
+
+def _to_content(contents):
+    """将contents转换为API格式的 Content（JSONL请求文件使用）"""
+    if isinstance(contents, str):
+        contents = [contents]
+    parts = [types.Part(text=item) if isinstance(item, str) else item for item in contents]
+    return types.Content(role="user", parts=parts).model_dump(mode="json", by_alias=True, exclude_none=True)
+
+
+def _state_name(job):
+    state = getattr(job, "state", None)
+    return getattr(state, "value", state) or "JOB_STATE_UNSPECIFIED"
+
+
+def download_file_to(client, file_name, path):
+    """
+    将Files API中的文件分块下载到 path，不在内存中保留整个文件
+
+    SDK的 files.download 会把整个文件读入内存，这里使用SDK客户端的httpx连接流式下载；
+    客户端没有这些内部接口时（例如测试替身）退回 files.download。
+
+    Returns:
+        int: 下载的字节数
+    """
+    api_client = getattr(client, "_api_client", None)
+    if not (hasattr(api_client, "_build_request") and hasattr(api_client, "_httpx_client")):
+        data = client.files.download(file=file_name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return len(data)
+
+    name = file_name[len("files/"):] if file_name.startswith("files/") else file_name
+    request = api_client._build_request("get", path=f"files/{name}:download?alt=media", request_dict={})
+    size = 0
+    with api_client._httpx_client.stream(request.method, request.url, headers=request.headers,
+                                         timeout=request.timeout) as response:
+        errors.APIError.raise_for_response(response)
+        with open(path, "wb") as f:
+            for chunk in response.iter_bytes(DOWNLOAD_CHUNK_BYTES):
+                f.write(chunk)
+                size += len(chunk)
+    return size
+
+
+class BatchJobStore:
+    """
+    已提交的批处理任务记录（jobs.json），键为请求内容的哈希，线程安全
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            logger.warning(f"[JM-Gemini] Ignoring unreadable batch job file {self.path}: {e}")
+            return {}
+
+    def _write(self, records):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", dir=os.path.dirname(self.path))
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(records, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def get(self, key):
+        with self._lock:
+            return self._read().get(key)
+
+    def set(self, key, record):
+        with self._lock:
+            records = self._read()
+            records[key] = record
+            self._write(records)
+
+    def remove(self, key):
+        with self._lock:
+            records = self._read()
+            if records.pop(key, None) is not None:
+                self._write(records)
+
+
+class GeminiBatchRunner:
+    """
+    提交、等待和取回一个图像批处理任务
+
+    Args:
+        client: genai.Client（或实现了 batches / files 接口的替身）
+        batch_dir: 任务记录和结果文件的目录
+        sleep: 轮询等待函数
+    """
+
+    def __init__(self, client, batch_dir, sleep=time.sleep):
+        self.client = client
+        self.batch_dir = batch_dir
+        self.store = BatchJobStore(os.path.join(batch_dir, JOBS_FILE_NAME))
+        self._sleep = sleep
+
+    @staticmethod
+    def request_key(model, requests, config):
+        """整个批次的内容哈希：每个请求的缓存键（模型、提示词、参考图像、生成参数）依次写入"""
+        hasher = hashlib.sha256()
+        for contents in requests:
+            hasher.update(ResponseCache.make_key(model, contents, config).encode("ascii"))
+        return hasher.hexdigest()
+
+    def submit(self, model, requests, config, display_name=None):
+        """
+        创建批处理任务：总大小不超过 INLINE_REQUEST_LIMIT 时内联请求，否则上传JSONL请求文件
+
+        Returns:
+            types.BatchJob
+        """
+        total_size = sum(_request_size(contents) for contents in requests)
+        if total_size <= INLINE_REQUEST_LIMIT:
+            src = [types.InlinedRequest(contents=contents, config=config, metadata={"key": str(index)})
+                   for index, contents in enumerate(requests)]
+            logger.info(f"[JM-Gemini] Submitting batch of {len(requests)} inline requests ({total_size / 1024 / 1024:.1f} MB)")
+        else:
+            src = self._upload_requests(requests, config, display_name)
+            logger.info(f"[JM-Gemini] Submitting batch of {len(requests)} requests from {src} ({total_size / 1024 / 1024:.1f} MB)")
+
+        return self.client.batches.create(
+            model=model,
+            src=src,
+            config=types.CreateBatchJobConfig(display_name=display_name),
+        )
+
+    def _upload_requests(self, requests, config, display_name=None):
+        """将请求写成JSONL文件（每行一个 {key, request}）并上传，返回文件名"""
+        generation_config = {"responseModalities": list(config.response_modalities or [])}
+        if config.image_config is not None:
+            generation_config["imageConfig"] = config.image_config.model_dump(mode="json", by_alias=True, exclude_none=True)
+
+        fd, tmp_path = tempfile.mkstemp(prefix="jm_gemini_batch_", suffix=".jsonl")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for index, contents in enumerate(requests):
+                    line = {"key": str(index),
+                            "request": {"contents": [_to_content(contents)], "generationConfig": generation_config}}
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            uploaded = self.client.files.upload(
+                file=tmp_path,
+                config=types.UploadFileConfig(display_name=display_name, mime_type="jsonl"),
+            )
+        finally:
+            os.unlink(tmp_path)
+        return uploaded.name
+
+    def wait(self, job_name, poll_interval=30, timeout=24 * 3600):
+        """
+        轮询任务状态直到完成（成功、部分成功或失败）；间隔逐步加长，只在状态变化时输出日志
+
+        Returns:
+            types.BatchJob
+
+        Raises:
+            TimeoutError: 超时仍未完成（任务记录保留，重新执行节点即可继续等待）
+        """
+        deadline = time.monotonic() + timeout
+        interval = max(1.0, float(poll_interval))
+        last_state = None
+        polls = 0
+        start = time.monotonic()
+        while True:
+            job = self.client.batches.get(name=job_name)
+            polls += 1
+            state = _state_name(job)
+            if state != last_state:
+                logger.info(f"[JM-Gemini] Batch {job_name}: {state} after {time.monotonic() - start:.0f}s ({polls} polls)")
+                last_state = state
+            if state in COMPLETED_STATES or state in FAILED_STATES:
+                return job
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Batch job {job_name} is still {state}; run the node again to keep waiting")
+            self._sleep(min(interval, remaining))
+            interval = min(interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+
+    def iter_results(self, job):
+        """
+        依次产出每个请求的结果 (序号, 响应, 错误)，响应和错误有一个为None
+
+        内联任务的结果按请求顺序返回；文件任务的结果文件先分块下载到磁盘，再逐行解析，
+        同一时间只有一行（一个响应）在内存中，序号取自请求的key。
+        """
+        dest = job.dest
+        if dest is not None and dest.inlined_responses:
+            for index, item in enumerate(dest.inlined_responses):
+                yield index, item.response, item.error
+        elif dest is not None and dest.file_name:
+            os.makedirs(self.batch_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=".results_", suffix=".jsonl", dir=self.batch_dir)
+            os.close(fd)
+            try:
+                size = download_file_to(self.client, dest.file_name, tmp_path)
+                logger.info(f"[JM-Gemini] Downloaded batch results {dest.file_name} ({size / 1024 / 1024:.1f} MB)")
+                with open(tmp_path, "r", encoding="utf-8") as f:
+                    for line_number, line in enumerate(f):
+                        if not line.strip():
+                            continue
+                        record = json.loads(line)
+                        index = int(record.get("key", line_number))
+                        if record.get("response") is None:
+                            yield index, None, record.get("error") or record.get("status") or "no response"
+                            continue
+                        try:
+                            response = types.GenerateContentResponse.model_validate(record.pop("response"))
+                        except ValueError as e:
+                            yield index, None, f"unreadable response: {e}"
+                            continue
+                        del record, line
+                        yield index, response, None
+            finally:
+                os.unlink(tmp_path)
+        else:
+            raise RuntimeError(f"Batch job {job.name} finished without results")
+
+    def collect(self, job, output_dir, decode=True):
+        """
+        取回结果：逐个响应处理，图像一到就按API返回的字节写入 output_dir（文件名以请求序号开头），
+        decode 为True时同时解码；写入后不保留编码字节和响应
+
+        Returns:
+            tuple: (图像tensor列表, 文件路径列表, 失败列表 [(序号, 原因)])
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        # 结果文件中的行不保证按请求顺序排列，取回后按序号排序
+        results, failures = [], []
+        for index, response, error in self.iter_results(job):
+            if response is None:
+                failures.append((index, str(error)))
+                continue
+
+            found = False
+            for part in response.parts or []:
+                inline_data = getattr(part, "inline_data", None)
+                if inline_data is None or not inline_data.data:
+                    continue
+                extension = mimetypes.guess_extension(inline_data.mime_type or "") or ".png"
+                file_path = write_output_file(f"{index + 1:04d}", data=inline_data.data, extension=extension,
+                                              output_format="original", output_dir=output_dir)
+                results.append((index, file_path, load_image_tensor(inline_data.data) if decode else None))
+                found = True
+            if not found:
+                failures.append((index, (response.text or "no image in response")[:200]))
+
+        results.sort(key=lambda result: result[0])
+        failures.sort(key=lambda failure: failure[0])
+        images = [image for _, _, image in results if image is not None]
+        files = [file_path for _, file_path, _ in results]
+        return images, files, failures
+
+    def run(self, model, requests, config, poll_interval=30, timeout=24 * 3600, decode=True, job_name=None):
+        """
+        提交（或继续）任务、等待完成并取回结果
+
+        相同的请求已提交过时继续等待原任务；已取回过且文件仍在时直接从磁盘读取。
+        指定 job_name 时直接取回该任务的结果。
+
+        Returns:
+            dict: job_name, output_dir, images, files, failures
+        """
+        key = self.request_key(model, requests, config)
+        record = None if job_name else self.store.get(key)
+
+        if record and record.get("collected"):
+            job_dir = os.path.join(self.batch_dir, record["output_dir"])
+            files = [os.path.join(job_dir, name) for name in record["files"]]
+            if files and all(os.path.exists(path) for path in files):
+                logger.info(f"[JM-Gemini] Batch {record['job_name']} already collected, loading {len(files)} files")
+                return {
+                    "job_name": record["job_name"],
+                    "output_dir": job_dir,
+                    "images": [load_image_tensor(path) for path in files] if decode else [],
+                    "files": files,
+                    "failures": [tuple(failure) for failure in record.get("failures", [])],
+                }
+
+        if job_name:
+            logger.info(f"[JM-Gemini] Collecting results of batch {job_name}")
+        elif record:
+            job_name = record["job_name"]
+            logger.info(f"[JM-Gemini] Resuming batch {job_name} submitted at {time.ctime(record['created'])}")
+        else:
+            job = self.submit(model, requests, config, display_name=f"jm-gemini-{key[:12]}")
+            job_name = job.name
+            record = {"job_name": job_name, "model": model, "requests": len(requests), "created": time.time()}
+            self.store.set(key, record)
+            logger.info(f"[JM-Gemini] Submitted batch {job_name}")
+
+        job = self.wait(job_name, poll_interval, timeout)
+        state = _state_name(job)
+        if state in FAILED_STATES:
+            if record:
+                # 失败的任务不再继续：下次执行重新提交
+                self.store.remove(key)
+            raise RuntimeError(f"Batch job {job_name} ended with {state}: {getattr(job, 'error', None)}")
+
+        output_dir = os.path.join(self.batch_dir, job_name.split("/")[-1])
+        images, files, failures = self.collect(job, output_dir, decode)
+        if record:
+            record.update({
+                "collected": True,
+                "output_dir": os.path.basename(output_dir),
+                "files": [os.path.basename(path) for path in files],
+                "failures": failures,
+            })
+            self.store.set(key, record)
+
+        return {"job_name": job_name, "output_dir": output_dir, "images": images, "files": files, "failures": failures}
+
+
+class JMGeminiBatchImageGenerator:
+    """
+    ComfyUI custom node for bulk image generation through the Gemini Batch API
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "gemini_api_key": ("STRING", {
+                    "multiline": False,
+                    "default": "",
+                    "placeholder": "Enter your Gemini API key",
+                    "password": True
+                }),
+                "prompts": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "placeholder": "One prompt per line"
+                }),
+                "model": ([GEMINI_3_PRO_MODEL, GEMINI_2_5_FLASH_MODEL], {
+                    "default": GEMINI_3_PRO_MODEL
+                }),
+                "aspect_ratio": ([
+                    "1:1", "2:3", "3:2", "3:4", "4:3",
+                    "4:5", "5:4", "9:16", "16:9", "21:9"
+                ], {
+                    "default": "1:1"
+                }),
+                "resolution": (["1K", "2K", "4K"], {
+                    "default": "2K"
+                }),
+                "output_mode": (OUTPUT_MODES, {
+                    "default": "image_batch",
+                    "tooltip": "image_batch: decode all results into one IMAGE batch; directory: only write the files"
+                }),
+            },
+            "optional": {
+                "reference_images": ("IMAGE",),
+                "reference_mode": (REFERENCE_MODES, {
+                    "default": "shared",
+                    "tooltip": "shared: every prompt gets all reference frames; per_prompt: frame i goes with prompt i"
+                }),
+                "poll_interval": ("INT", {
+                    "default": 30,
+                    "min": 5,
+                    "max": 600,
+                    "tooltip": "Initial seconds between status checks; the interval grows up to 10 minutes"
+                }),
+                "timeout_minutes": ("INT", {
+                    "default": 1440,
+                    "min": 1,
+                    "max": 2880,
+                    "tooltip": "Stop waiting after this long; the job keeps running and the next run resumes it"
+                }),
+                "job_name": ("STRING", {
+                    "multiline": False,
+                    "default": "",
+                    "placeholder": "batches/... (collect an existing job)"
+                }),
+                **upload_input_types(),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "STRING", "STRING")
+    RETURN_NAMES = ("images", "output_dir", "job_name")
+    FUNCTION = "generate_batch"
+    CATEGORY = "JM-Gemini"
+
+    def generate_batch(self, gemini_api_key, prompts, model, aspect_ratio, resolution, output_mode,
+                       reference_images=None, reference_mode="shared", poll_interval=30, timeout_minutes=1440,
+                       job_name="", upload_max_megapixels=0.0, upload_format="default",
+                       upload_quality=DEFAULT_UPLOAD_QUALITY, lossless_max_megapixels=0.0):
+        """
+        主函数：提交批处理任务，等待完成后返回所有生成的图像
+        """
+        if not gemini_api_key or not gemini_api_key.strip():
+            raise ValueError("Gemini API key is required")
+
+        prompt_list = [line.strip() for line in (prompts or "").splitlines() if line.strip()]
+        if not prompt_list and not job_name.strip():
+            raise ValueError("At least one prompt is required (one per line)")
+
+        try:
+            # 参考图像按上传策略编码（与图像节点相同）
+            reference_parts = []
+            if reference_images is not None:
+                policy = upload_policy(upload_max_megapixels, upload_format, upload_quality, lossless_max_megapixels)
+                upload_stats = []
+                for data, mime_type, stats in iter_upload_frames(reference_images, policy, REFERENCE_IMAGE_FORMAT):
+                    reference_parts.append(types.Part.from_bytes(data=data, mime_type=mime_type))
+                    upload_stats.append(stats)
+                logger.info(f"[JM-Gemini] Upload payload: {format_upload_summary(upload_stats)}")
+
+            requests = build_requests(prompt_list, reference_parts, reference_mode)
+            config = build_generation_config(model, aspect_ratio, resolution)
+
+            runner = GeminiBatchRunner(get_client(gemini_api_key), os.path.join(get_output_dir(), BATCH_DIR_NAME))
+            result = runner.run(model, requests, config, poll_interval=poll_interval, timeout=timeout_minutes * 60,
+                                decode=output_mode == "image_batch", job_name=job_name.strip() or None)
+
+            failures = result["failures"]
+            logger.info(f"[JM-Gemini] Batch {result['job_name']}: {len(result['files'])} images written to "
+                        f"{result['output_dir']}, {len(failures)} requests failed")
+            if failures:
+                logger.warning("[JM-Gemini] Failed batch requests: " +
+                               "; ".join(f"#{index + 1}: {reason}" for index, reason in sorted(failures)))
+            if not result["files"]:
+                raise RuntimeError("No images were generated by the batch job")
+
+            if result["images"]:
+                images = stack_images(result["images"])
+            else:
+                # directory 模式不解码结果，返回一张占位图像
+                images = torch.zeros((1, 64, 64, 3), dtype=torch.float32)
+
+            return (images, result["output_dir"], result["job_name"])
+
+        except Exception as e:
+            logger.exception(f"[JM-Gemini] Error running batch job: {e}")
+            raise RuntimeError(f"Failed to run batch job: {str(e)}")
+
+
+# 节点类映射
+NODE_CLASS_MAPPINGS = {
+    "JMGeminiBatchImageGenerator": JMGeminiBatchImageGenerator
+}
+
+# 节点显示名称映射
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "JMGeminiBatchImageGenerator": "JM Gemini Batch Image Generator"
+}
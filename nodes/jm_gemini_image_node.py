@@ -3,16 +3,42 @@ ComfyUI-JM-Gemini-API Image Node
 A custom node for ComfyUI that generates images using Google's Gemini API
 """
 
-import os
 import time
 import mimetypes
-import io
 import logging
-from PIL import Image
-from google import genai
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from google.genai import types
 
-from .utils import tensor2pil, pil2tensor, get_output_dir
+from .file_uploads import REFERENCE_UPLOAD_MODES, get_upload_cache, is_missing_file_error
+from .genai_clients import get_client
+from .hedging import DEFAULT_HEDGE_BUDGET_PERCENT, get_hedger, hedge_policy, hedge_stats, hedging_input_types
+from .key_pool import key_pool_input_types, resolve_keys
+from .rate_limiter import get_scheduler, rate_limit_input_types, rate_limit_stats
+from .resilience import (
+    DEFAULT_DEADLINE,
+    DEFAULT_MAX_RETRIES,
+    RATE_LIMIT,
+    RetryPolicy,
+    call_with_retry,
+    classify_error,
+    resilience_stats,
+    retry_input_types,
+)
+from .response_cache import CACHE_MODES, get_response_cache
+from .utils import (
+    DEFAULT_GENERATED_OUTPUT_FORMAT,
+    DEFAULT_PNG_COMPRESS_LEVEL,
+    DEFAULT_UPLOAD_QUALITY,
+    format_upload_summary,
+    get_encoded_image_cache,
+    iter_upload_frames,
+    load_image_tensor,
+    output_input_types,
+    save_output,
+    stack_images,
+    upload_input_types,
+    upload_policy,
+)
 
 # 设置日志
 logger = logging.getLogger(__name__)
@@ -55,6 +81,19 @@ ASPECT_RATIO_RESOLUTIONS = {
 
 DEFAULT_RESOLUTION = "2K"
 
+# 参考图像的上传编码：与SDK处理RGB PIL图像的方式一致（JPEG，PIL默认质量）
+REFERENCE_IMAGE_FORMAT = "JPEG"
+
+# 多张生成：单次执行最多的图像数和并发请求数
+MAX_NUM_IMAGES = 16
+DEFAULT_MAX_CONCURRENCY = 4
+
+# API的seed为32位有符号整数
+MAX_API_SEED = 2 ** 31
+
+# 返回所有图像时，并行解码的最大线程数
+DECODE_WORKERS = 4
+
 
 class JMGeminiImageGenerator:
     """
@@ -95,6 +134,26 @@ class JMGeminiImageGenerator:
                     "min": 0,
                     "max": 0xffffffffffffffff
                 }),
+                "num_images": ("INT", {
+                    "default": 1,
+                    "min": 1,
+                    "max": MAX_NUM_IMAGES,
+                    "tooltip": "Number of images to generate; requests run in parallel and are returned as one batch"
+                }),
+                "max_concurrency": ("INT", {
+                    "default": DEFAULT_MAX_CONCURRENCY,
+                    "min": 1,
+                    "max": MAX_NUM_IMAGES,
+                    "tooltip": "Maximum number of requests in flight when num_images > 1"
+                }),
+                "return_all_images": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Return every image the model sends back in a response instead of only the first"
+                }),
+                "response_cache": (CACHE_MODES, {
+                    "default": "off",
+                    "tooltip": "on: reuse the saved response for an identical request; bypass: call the API and refresh the saved response"
+                }),
                 "image1": ("IMAGE",),
                 "image2": ("IMAGE",),
                 "image3": ("IMAGE",),
@@ -105,25 +164,46 @@ class JMGeminiImageGenerator:
                 "image8": ("IMAGE",),
                 "image9": ("IMAGE",),
                 "image10": ("IMAGE",),
+                **output_input_types(DEFAULT_GENERATED_OUTPUT_FORMAT),
+                **upload_input_types(),
+                "reference_upload": (REFERENCE_UPLOAD_MODES, {
+                    "default": "inline",
+                    "tooltip": "files_api: upload reference images once through the Files API and send their URIs; "
+                               "uploads are reused until they expire (48h)"
+                }),
+                **retry_input_types(),
+                **hedging_input_types(),
+                **key_pool_input_types(),
+                **rate_limit_input_types(),
             }
         }
 
-    RETURN_TYPES = ("IMAGE",)
-    RETURN_NAMES = ("image",)
+    RETURN_TYPES = ("IMAGE", "STRING")
+    RETURN_NAMES = ("image", "text")
     FUNCTION = "generate_image"
     CATEGORY = "JM-Gemini"
 
     def generate_image(self, gemini_api_key, prompt, model, aspect_ratio, resolution,
-                      seed=0, image1=None, image2=None, image3=None, image4=None, image5=None,
-                      image6=None, image7=None, image8=None, image9=None, image10=None):
+                      seed=0, num_images=1, max_concurrency=DEFAULT_MAX_CONCURRENCY, return_all_images=False,
+                      response_cache="off",
+                      image1=None, image2=None, image3=None, image4=None, image5=None,
+                      image6=None, image7=None, image8=None, image9=None, image10=None,
+                      save_to_disk=True, output_format=DEFAULT_GENERATED_OUTPUT_FORMAT,
+                      png_compress_level=DEFAULT_PNG_COMPRESS_LEVEL,
+                      upload_max_megapixels=0.0, upload_format="default",
+                      upload_quality=DEFAULT_UPLOAD_QUALITY, lossless_max_megapixels=0.0,
+                      reference_upload="inline",
+                      max_retries=DEFAULT_MAX_RETRIES, retry_deadline=int(DEFAULT_DEADLINE),
+                      hedge_percentile=0, hedge_budget=DEFAULT_HEDGE_BUDGET_PERCENT, key_pool="",
+                      queue_priority=0):
         """
         主函数：调用Gemini API生成图像
         """
-        # seed参数仅用于ComfyUI重新执行，不传递给API
+        # 生成一张图像时，seed参数仅用于ComfyUI重新执行，不传递给API；
+        # 生成多张时，第i个请求使用 seed + i，使每个请求得到不同的结果
 
-        # 验证API key
-        if not gemini_api_key or not gemini_api_key.strip():
-            raise ValueError("Gemini API key is required")
+        # 验证API key（设置了key_pool时使用key池）
+        keys = resolve_keys(gemini_api_key, key_pool)
 
         # 收集输入的图像
         input_images = []
@@ -132,43 +212,72 @@ class JMGeminiImageGenerator:
             if img is not None:
                 input_images.append(img)
 
-        # 设置输出目录
-        output_dir = get_output_dir()
+        # 输出保存选项
+        output_options = {
+            "save_to_disk": save_to_disk,
+            "output_format": output_format,
+            "compress_level": png_compress_level,
+        }
+
+        # 多张生成选项
+        sample_options = {
+            "num_images": num_images,
+            "max_concurrency": max_concurrency,
+            "seed": seed,
+            "return_all_images": return_all_images,
+            "cache_mode": response_cache,
+            "retry_policy": RetryPolicy(max_retries=max_retries, deadline=retry_deadline),
+            "priority": queue_priority,
+            "use_files_api": reference_upload == "files_api",
+            "hedge_policy": hedge_policy(hedge_percentile, hedge_budget),
+        }
 
         try:
             # 根据是否有输入图像选择生成模式
             if len(input_images) == 0:
                 # 文生图模式
                 logger.info("[JM-Gemini] Text-to-Image mode")
-                generated_image = self._generate_text_to_image(
-                    api_key=gemini_api_key,
+                generated_image, response_text = self._generate_text_to_image(
+                    keys=keys,
                     prompt=prompt,
                     model=model,
                     aspect_ratio=aspect_ratio,
                     resolution=resolution,
-                    output_dir=output_dir
+                    output_options=output_options,
+                    sample_options=sample_options
                 )
             else:
                 # 图生图/图片编辑模式
                 logger.info(f"[JM-Gemini] Image-to-Image mode with {len(input_images)} input images")
-                generated_image = self._generate_with_images(
-                    api_key=gemini_api_key,
+                generated_image, response_text = self._generate_with_images(
+                    keys=keys,
                     prompt=prompt,
                     model=model,
                     aspect_ratio=aspect_ratio,
                     resolution=resolution,
                     input_images=input_images,
-                    output_dir=output_dir
+                    output_options=output_options,
+                    sample_options=sample_options,
+                    upload_options=upload_policy(upload_max_megapixels, upload_format,
+                                                 upload_quality, lossless_max_megapixels)
                 )
 
-            return (generated_image,)
+            logger.info(f"[JM-Gemini] Retry metrics for {model}: {resilience_stats(model)}")
+            logger.info(f"[JM-Gemini] Rate-limit queue for {model}: {rate_limit_stats(model)}")
+            if sample_options["hedge_policy"] is not None:
+                logger.info(f"[JM-Gemini] Hedging for {model}: {hedge_stats(model)}")
+            if sample_options["use_files_api"] and input_images:
+                logger.info(f"[JM-Gemini] Files API uploads: {get_upload_cache().stats()}")
+            if keys.stats() is not None:
+                logger.info(f"[JM-Gemini] Key pool usage: {keys.stats()}")
+            return (generated_image, response_text)
 
         except Exception as e:
             logger.exception(f"[JM-Gemini] Error generating image: {e}")
             raise RuntimeError(f"Failed to generate image: {str(e)}")
 
-    def _generate_text_to_image(self, api_key, prompt, model, aspect_ratio,
-                               resolution, output_dir):
+    def _generate_text_to_image(self, keys, prompt, model, aspect_ratio,
+                               resolution, output_options, sample_options=None):
         """
         文生图模式
         """
@@ -177,9 +286,6 @@ class JMGeminiImageGenerator:
 
         prompt_value = prompt.strip()
 
-        # 创建客户端
-        client = genai.Client(api_key=api_key)
-
         # 根据模型类型配置生成参数
         if model == GEMINI_2_5_FLASH_MODEL:
             config = types.GenerateContentConfig(
@@ -204,52 +310,50 @@ class JMGeminiImageGenerator:
 
         logger.info(f"[JM-Gemini] Calling API with model={model}, aspect_ratio={aspect_ratio}, resolution={resolution_info}")
 
-        # 调用API
-        response = client.models.generate_content(
-            model=model,
-            contents=prompt_value,
-            config=config,
-        )
-
-        # 处理响应并保存图像
-        generated_image = self._process_response(response, model, output_dir, "text2img")
-
-        return generated_image
+        # 调用API，处理响应并保存图像
+        return self._generate_samples(keys, model, prompt_value, config, output_options,
+                                      "text2img", sample_options)
 
-    def _generate_with_images(self, api_key, prompt, model, aspect_ratio,
-                             resolution, input_images, output_dir):
+    def _generate_with_images(self, keys, prompt, model, aspect_ratio,
+                             resolution, input_images, output_options, sample_options=None,
+                             upload_options=None):
         """
         图生图/图片编辑模式
         """
+        # 展开批次：包含多帧的IMAGE输入，每一帧都作为一张参考图像
+        # 按上传策略缩小和编码，编码结果按内容缓存，重复使用的参考图像不会再次编码
+        image_parts = []
+        upload_stats = []
+        for img_tensor in input_images:
+            for data, mime_type, stats in iter_upload_frames(img_tensor, upload_options, REFERENCE_IMAGE_FORMAT):
+                image_parts.append(types.Part.from_bytes(data=data, mime_type=mime_type))
+                upload_stats.append(stats)
+        logger.info(f"[JM-Gemini] Upload payload: {format_upload_summary(upload_stats)}")
+        logger.info(f"[JM-Gemini] Reference image cache: {get_encoded_image_cache().stats()}")
+
         # 准备提示词
         if not prompt or not prompt.strip():
-            if len(input_images) == 1:
+            if len(image_parts) == 1:
                 prompt_value = "Turn this image into a professional quality studio shoot with better lighting and depth of field."
             else:
                 prompt_value = "Combine the subjects of these images in a natural way, producing a new image."
         else:
             prompt_value = prompt.strip()
 
-        # 创建客户端
-        client = genai.Client(api_key=api_key)
-
         # 构建contents
         contents = []
-        is_single_image = len(input_images) == 1
+        is_single_image = len(image_parts) == 1
 
         if is_single_image:
             # 单图编辑模式：[prompt, image]
             contents.append(prompt_value)
-            pil_image = tensor2pil(input_images[0])
-            contents.append(pil_image)
+            contents.append(image_parts[0])
             logger.info("[JM-Gemini] Single image edit mode: [prompt, image]")
         else:
             # 多图输入模式：[image1, image2, ..., prompt]
-            for img_tensor in input_images:
-                pil_image = tensor2pil(img_tensor)
-                contents.append(pil_image)
+            contents.extend(image_parts)
             contents.append(prompt_value)
-            logger.info(f"[JM-Gemini] Multi-image mode: [{len(input_images)} images, prompt]")
+            logger.info(f"[JM-Gemini] Multi-image mode: [{len(image_parts)} images, prompt]")
 
         # 配置生成参数
         if model == GEMINI_2_5_FLASH_MODEL:
@@ -275,80 +379,246 @@ class JMGeminiImageGenerator:
 
         logger.info(f"[JM-Gemini] Calling API with model={model}, aspect_ratio={aspect_ratio}, resolution={resolution_info}")
 
-        # 调用API
-        response = client.models.generate_content(
-            model=model,
-            contents=contents,
-            config=config,
-        )
-
-        # 处理响应并保存图像
+        # 调用API，处理响应并保存图像
         mode = "imageedit" if is_single_image else "image2image"
-        generated_image = self._process_response(response, model, output_dir, mode)
+        return self._generate_samples(keys, model, contents, config, output_options,
+                                      mode, sample_options)
 
-        return generated_image
+    def _generate_samples(self, keys, model, contents, config, output_options, mode, sample_options=None):
+        """
+        调用API生成一张或多张图像
+
+        多张时在线程池中并行发送请求，每个请求使用不同的seed；部分请求失败时返回成功的图像
+        并记录失败原因，全部失败时抛出异常。结果按请求顺序拼接为一个IMAGE批次。
 
-    def _process_response(self, response, model, output_dir, mode):
+        Returns:
+            tuple: (IMAGE tensor, 响应文本；多张时每个请求的文本和失败原因按序号列出)
+        """
+        sample_options = sample_options or {}
+        num_images = max(1, int(sample_options.get("num_images", 1)))
+        return_all_images = bool(sample_options.get("return_all_images", False))
+        seed = int(sample_options.get("seed", 0))
+
+        if num_images == 1:
+            response = self._request(keys, model, contents, config, sample_options)
+            return self._process_response(response, model, output_options, mode, return_all_images)
+
+        max_concurrency = max(1, min(int(sample_options.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)), num_images))
+
+        def generate_one(index):
+            sample_config = config.model_copy(update={"seed": (seed + index) % MAX_API_SEED})
+            start = time.perf_counter()
+            response = self._request(keys, model, contents, sample_config, sample_options)
+            result = self._process_response(response, model, output_options, mode, return_all_images)
+            logger.info(f"[JM-Gemini] Request {index + 1}/{num_images} done in {time.perf_counter() - start:.1f}s")
+            return result
+
+        logger.info(f"[JM-Gemini] Generating {num_images} images with max_concurrency={max_concurrency}")
+        start = time.perf_counter()
+        results = [None] * num_images
+        failures = []
+        with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="JM-Gemini-Sample") as executor:
+            futures = {executor.submit(generate_one, index): index for index in range(num_images)}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    failures.append((index, e))
+                    logger.warning(f"[JM-Gemini] Image {index + 1}/{num_images} failed: {e}")
+
+        images = [result[0] for result in results if result is not None]
+        logger.info(f"[JM-Gemini] {len(images)}/{num_images} requests succeeded in {time.perf_counter() - start:.1f}s")
+
+        failures.sort(key=lambda failure: failure[0])
+        report = "; ".join(f"#{index + 1} (seed {(seed + index) % MAX_API_SEED}): {e}" for index, e in failures)
+        if not images:
+            raise RuntimeError(f"All {num_images} requests failed: {report}")
+        if failures:
+            logger.warning(f"[JM-Gemini] {len(failures)} of {num_images} requests failed, "
+                           f"returning {len(images)} results: {report}")
+
+        texts = [f"[#{index + 1}] {result[1]}" for index, result in enumerate(results)
+                 if result is not None and result[1]]
+        texts.extend(f"[#{index + 1} failed] seed {(seed + index) % MAX_API_SEED}: {e}" for index, e in failures)
+        return stack_images(images), "\n\n".join(texts)
+
+    def _generate_content(self, keys, model, contents, config, sample_options=None):
         """
-        处理Gemini API响应，提取并保存图像
+        调用 generate_content：每次调用（包括重试）使用key池中负载最低的key，再在共享调度器中
+        按该key和模型的限额排队，客户端按key复用；429/5xx等错误按重试策略重试
+
+        - use_files_api：参考图像通过 Files API 上传（按key和内容缓存），请求中只引用文件URI；
+          上传在排队之前完成，不占用请求名额
+        - hedge_policy：generate_content 调用超过历史延迟分位数时发送对冲请求，使用先成功的结果。
+          对冲请求另外占用一个key和限速名额（不等待，没有空闲名额时不对冲），每个请求结束后才释放；
+          延迟只统计 generate_content 本身，不包括排队、选择key和上传
+        """
+        sample_options = sample_options or {}
+        priority = int(sample_options.get("priority", 0))
+        use_files_api = bool(sample_options.get("use_files_api", False))
+        policy = sample_options.get("hedge_policy")
+        scheduler = get_scheduler()
+        hedger = get_hedger()
+        upload_cache = get_upload_cache() if use_files_api else None
+
+        def acquire(tried, model, contents, wait):
+            """
+            为一个请求占用key、上传参考图像并占用限速名额，返回 ((api_key, client, 请求内容, 上传的文件), release)；
+            wait 为False时没有空闲名额返回None
+            """
+            api_key = keys.acquire(tried if wait else ())
+            tried.add(api_key)
+            client = get_client(api_key)
+            try:
+                request_contents, uploaded = (upload_cache.resolve(api_key, client, contents) if use_files_api
+                                              else (contents, None))
+            except Exception as e:
+                keys.release(api_key, e)
+                raise
+            try:
+                if wait:
+                    scheduler.acquire(model, priority, api_key=api_key)
+                elif not scheduler.try_acquire(model, priority, api_key=api_key):
+                    keys.cancel(api_key)
+                    return None
+            except BaseException:
+                keys.cancel(api_key)
+                raise
+
+            def release(error=None):
+                scheduler.release(model, api_key)
+                keys.release(api_key, error)
+
+            return (api_key, client, request_contents, uploaded), release
+
+        def send(lease, model, contents, config):
+            api_key, client, request_contents, uploaded = lease
+            try:
+                return client.models.generate_content(model=model, contents=request_contents, config=config)
+            except Exception as e:
+                if not uploaded or not is_missing_file_error(e):
+                    raise
+                # 文件已被删除或提前过期：重新上传后再试一次
+                logger.warning(f"[JM-Gemini] Uploaded reference images are no longer available ({e}), re-uploading")
+                upload_cache.invalidate(uploaded)
+                request_contents, _ = upload_cache.resolve(api_key, client, contents)
+                return client.models.generate_content(model=model, contents=request_contents, config=config)
+
+        def generate_content(model, contents, config):
+            # 遇到429且还有其他可用key时立即换key重试，不等待退避
+            tried = set()
+            while True:
+                try:
+                    return hedger.call(send, model=model, policy=policy, contents=contents, config=config,
+                                       acquire=lambda wait: acquire(tried, model, contents, wait))
+                except Exception as e:
+                    if classify_error(e) == RATE_LIMIT and keys.has_available(tried):
+                        logger.info("[JM-Gemini] Switching to another API key after 429")
+                        continue
+                    raise
+
+        return call_with_retry(generate_content, model=model, contents=contents, config=config,
+                               policy=sample_options.get("retry_policy"), label="generate_content")
+
+    def _request(self, keys, model, contents, config, sample_options=None):
+        """
+        发送请求；启用响应缓存时，相同的请求直接返回磁盘上保存的响应
+        """
+        sample_options = sample_options or {}
+        cache_mode = sample_options.get("cache_mode", "off")
+        if cache_mode not in ("on", "bypass"):
+            return self._generate_content(keys, model, contents, config, sample_options)
+
+        cache = get_response_cache()
+        key = cache.make_key(model, contents, config, int(sample_options.get("seed", 0)))
+        if cache_mode == "on":
+            start = time.perf_counter()
+            response = cache.get(key)
+            if response is not None:
+                logger.info(f"[JM-Gemini] Response cache hit in {(time.perf_counter() - start) * 1000:.1f}ms: {cache.stats()}")
+                return response
+
+        start = time.perf_counter()
+        response = self._generate_content(keys, model, contents, config, sample_options)
+        elapsed = time.perf_counter() - start
+        try:
+            cache.put(key, response, elapsed)
+        except Exception as e:
+            logger.warning(f"[JM-Gemini] Could not save response to cache: {e}")
+        logger.info(f"[JM-Gemini] Response cache {'bypassed' if cache_mode == 'bypass' else 'miss'}: {cache.stats()}")
+        return response
+
+    def _process_response(self, response, model, output_options, mode, return_all_images=False):
+        """
+        处理Gemini API响应，提取图像并在后台保存
+
+        Returns:
+            tuple: (IMAGE tensor, 响应中所有文本部分拼接的字符串)。
+            return_all_images 为True时返回所有图像部分（并行解码，拼接为一个批次），否则只返回第一张
         """
         if not hasattr(response, 'parts') or not response.parts:
             raise RuntimeError("No response parts received from Gemini API")
 
         logger.info(f"[JM-Gemini] Processing {len(response.parts)} response parts")
 
-        generated_image = None
+        texts = []
+        image_parts = []
 
         for idx, part in enumerate(response.parts):
             # 处理文本响应
             if part.text is not None:
                 logger.info(f"[JM-Gemini] Response text: {part.text[:100] if len(part.text) > 100 else part.text}")
-
-            # 尝试提取图像
-            try:
-                image = part.as_image()
-                if image:
-                    # 保存图像
-                    timestamp = int(time.time())
-                    model_prefix = "gemini25flash" if model == GEMINI_2_5_FLASH_MODEL else "gemini3pro"
-                    file_name = f"{model_prefix}_{mode}_{timestamp}.png"
-                    file_path = os.path.join(output_dir, file_name)
-
-                    image.save(file_path)
-                    logger.info(f"[JM-Gemini] Saved image to {file_path}")
-
-                    # 转换为ComfyUI tensor格式
-                    generated_image = pil2tensor(image)
+                texts.append(part.text)
+
+            # part.as_image() 返回的是 types.Image 而非PIL图像，直接使用inline_data
+            inline_data = getattr(part, 'inline_data', None)
+            if inline_data is not None and inline_data.data:
+                image_parts.append((idx, inline_data))
+
+        if return_all_images and len(image_parts) > 1:
+            # 多张图像在线程中并行解码（PIL解码时释放GIL）
+            logger.info(f"[JM-Gemini] Decoding {len(image_parts)} images")
+            with ThreadPoolExecutor(max_workers=min(len(image_parts), DECODE_WORKERS),
+                                    thread_name_prefix="JM-Gemini-Decode") as executor:
+                images = list(executor.map(
+                    lambda item: self._decode_image_part(item[0], item[1], model, output_options, mode),
+                    image_parts))
+        else:
+            images = []
+            for idx, inline_data in image_parts:
+                image = self._decode_image_part(idx, inline_data, model, output_options, mode)
+                if image is not None:
+                    images.append(image)
                     break  # 只取第一张生成的图像
 
-            except AttributeError:
-                # 尝试使用inline_data方式
-                if hasattr(part, 'inline_data') and part.inline_data is not None:
-                    if part.inline_data.data:
-                        # 从字节数据创建PIL Image
-                        image = Image.open(io.BytesIO(part.inline_data.data))
-
-                        # 保存图像
-                        timestamp = int(time.time())
-                        model_prefix = "gemini25flash" if model == GEMINI_2_5_FLASH_MODEL else "gemini3pro"
-                        file_extension = mimetypes.guess_extension(part.inline_data.mime_type) or ".png"
-                        file_name = f"{model_prefix}_{mode}_{timestamp}{file_extension}"
-                        file_path = os.path.join(output_dir, file_name)
-
-                        image.save(file_path)
-                        logger.info(f"[JM-Gemini] Saved image to {file_path}")
-
-                        # 转换为ComfyUI tensor格式
-                        generated_image = pil2tensor(image)
-                        break
-            except Exception as e:
-                logger.warning(f"[JM-Gemini] Could not extract image from part {idx}: {e}")
-                continue
-
-        if generated_image is None:
+        images = [image for image in images if image is not None]
+        if not images:
             raise RuntimeError("No images were generated. Please check your prompt and try again.")
 
-        return generated_image
+        return stack_images(images), "\n".join(texts)
+
+    def _decode_image_part(self, idx, inline_data, model, output_options, mode):
+        """
+        后台保存一个图像部分并解码为tensor，失败时记录警告并返回None
+        """
+        try:
+            # 后台保存图像：original 格式原样写入API返回的字节，其他格式在写入线程中解码后重新编码
+            model_prefix = "gemini25flash" if model == GEMINI_2_5_FLASH_MODEL else "gemini3pro"
+            file_extension = mimetypes.guess_extension(inline_data.mime_type or "") or ".png"
+            save_output(
+                f"{model_prefix}_{mode}",
+                data=inline_data.data,
+                extension=file_extension,
+                **output_options
+            )
+
+            # 直接从字节解码为ComfyUI tensor格式
+            return load_image_tensor(inline_data.data)
+
+        except Exception as e:
+            logger.warning(f"[JM-Gemini] Could not extract image from part {idx}: {e}")
+            return None
 
 
 # 节点类映射
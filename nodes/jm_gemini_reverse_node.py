@@ -3,18 +3,27 @@ ComfyUI-JM-Gemini-API Reverse Engineering Node
 使用 Gemini 网页版逆向工程方式生成图片
 """
 
-import os
-import time
 import base64
 import logging
 from pathlib import Path
-from PIL import Image
-import io
 import re
 import json
 
-from .utils import tensor2pil, pil2tensor, get_output_dir
-from .gemini_reverse.client import GeminiClient, CookieExpiredError
+from .rate_limiter import rate_limit_input_types, rate_limit_stats
+from .utils import (
+    DEFAULT_GENERATED_OUTPUT_FORMAT,
+    DEFAULT_PNG_COMPRESS_LEVEL,
+    DEFAULT_UPLOAD_QUALITY,
+    format_upload_summary,
+    get_encoded_image_cache,
+    iter_upload_frames,
+    load_image_tensor,
+    output_input_types,
+    save_output,
+    upload_input_types,
+    upload_policy,
+)
+from .gemini_reverse.client import GeminiClient, CookieExpiredError, RATE_LIMIT_KEY
 from .gemini_reverse.config import CookieConfig
 
 # 设置日志
@@ -66,6 +75,9 @@ class JMGeminiReverseGenerator:
                 "image8": ("IMAGE",),
                 "image9": ("IMAGE",),
                 "image10": ("IMAGE",),
+                **output_input_types(DEFAULT_GENERATED_OUTPUT_FORMAT),
+                **upload_input_types(),
+                **rate_limit_input_types(),
             }
         }
 
@@ -77,7 +89,12 @@ class JMGeminiReverseGenerator:
     def generate_image(self, prompt, model, seed=0,
                       cookies_raw="",
                       image1=None, image2=None, image3=None, image4=None, image5=None,
-                      image6=None, image7=None, image8=None, image9=None, image10=None):
+                      image6=None, image7=None, image8=None, image9=None, image10=None,
+                      save_to_disk=True, output_format=DEFAULT_GENERATED_OUTPUT_FORMAT,
+                      png_compress_level=DEFAULT_PNG_COMPRESS_LEVEL,
+                      upload_max_megapixels=0.0, upload_format="default",
+                      upload_quality=DEFAULT_UPLOAD_QUALITY, lossless_max_megapixels=0.0,
+                      queue_priority=0):
         """
         主生成函数
 
@@ -87,6 +104,11 @@ class JMGeminiReverseGenerator:
             seed: 随机种子（仅用于 ComfyUI，不传给 Gemini）
             cookies_raw: 完整的 Cookie 字符串（首次使用时填写）
             image1-image10: 可选的输入图片
+            save_to_disk: 是否保存到 output 目录
+            output_format: 输出格式（png / webp_lossless / original）
+            png_compress_level: PNG 压缩级别
+            upload_max_megapixels / upload_format / upload_quality / lossless_max_megapixels: 参考图片上传策略
+            queue_priority: 多个请求排队时的优先级
 
         Returns:
             tuple: (IMAGE tensor,)
@@ -179,7 +201,8 @@ class JMGeminiReverseGenerator:
                 snlm0e=config["snlm0e"],
                 push_id=config["push_id"],
                 model_ids=config.get("model_ids"),
-                debug=False  # 生产环境关闭调试
+                debug=False,  # 生产环境关闭调试
+                priority=queue_priority
             )
         except Exception as e:
             raise RuntimeError(f"创建 Gemini 客户端失败: {e}")
@@ -189,17 +212,24 @@ class JMGeminiReverseGenerator:
             images_data = []
             if input_images:
                 logger.info("[JM-Gemini-Reverse] 转换图片为 base64 格式")
-                for i, img_tensor in enumerate(input_images):
-                    pil_img = tensor2pil(img_tensor)
+                # 展开批次：包含多帧的 IMAGE 输入，每一帧都作为一张图片上传
+                # 按上传策略缩小和编码（默认无损 PNG），编码结果按内容缓存，重复使用的参考图片不会再次编码
+                policy = upload_policy(upload_max_megapixels, upload_format, upload_quality, lossless_max_megapixels)
+                encoded_images = [encoded for img_tensor in input_images
+                                  for encoded in iter_upload_frames(img_tensor, policy, "PNG")]
+                for i, (image_bytes, mime_type, _) in enumerate(encoded_images):
                     # 转换为 base64
-                    buffer = io.BytesIO()
-                    pil_img.save(buffer, format="PNG")
-                    img_b64 = base64.b64encode(buffer.getvalue()).decode()
+                    img_b64 = base64.b64encode(image_bytes).decode()
                     images_data.append({
-                        "mime_type": "image/png",
+                        "mime_type": mime_type,
                         "data": img_b64
                     })
-                    logger.info(f"[JM-Gemini-Reverse] 图片 {i+1}/{len(input_images)} 转换完成")
+                    logger.info(f"[JM-Gemini-Reverse] 图片 {i+1}/{len(encoded_images)} 转换完成")
+                upload_stats = [stats for _, _, stats in encoded_images]
+                base64_bytes = sum(len(item["data"]) for item in images_data)
+                logger.info(f"[JM-Gemini-Reverse] 上传大小: {format_upload_summary(upload_stats)}, "
+                            f"base64 后 {base64_bytes / 1048576:.2f} MB")
+                logger.info(f"[JM-Gemini-Reverse] 参考图片编码缓存: {get_encoded_image_cache().stats()}")
 
             # 7. 构建 OpenAI 格式的消息内容
             content = [{"type": "text", "text": prompt}]
@@ -226,6 +256,7 @@ class JMGeminiReverseGenerator:
             # 9. 解析响应文本，提取图片 URL
             reply_text = response.choices[0].message.content
             logger.info(f"[JM-Gemini-Reverse] 收到响应，长度: {len(reply_text)}")
+            logger.info(f"[JM-Gemini-Reverse] 限速队列: {rate_limit_stats(RATE_LIMIT_KEY)}")
 
             # 从响应中提取图片（格式: ![alt](/media/gen_xxxxx)）
             media_pattern = r'!\[.*?\]\((/media/[^\)]+)\)'
@@ -272,21 +303,20 @@ class JMGeminiReverseGenerator:
                     f"3. 磁盘空间不足"
                 )
 
-            # 11. 读取图片
-            logger.info(f"[JM-Gemini-Reverse] 加载图片: {found_file}")
-            pil_image = Image.open(found_file)
-
-            # 12. 保存到 ComfyUI output 目录
-            output_dir = get_output_dir()
-            timestamp = int(time.time())
+            # 11. 后台保存到 ComfyUI output 目录（original 格式直接硬链接/复制缓存文件）
             model_prefix = model.replace(".", "").replace("-", "")
-            output_filename = f"gemini_reverse_{model_prefix}_{timestamp}.png"
-            output_path = os.path.join(output_dir, output_filename)
-            pil_image.save(output_path)
-            logger.info(f"[JM-Gemini-Reverse] 图片已保存: {output_path}")
+            save_output(
+                f"gemini_reverse_{model_prefix}",
+                source_path=str(found_file),
+                extension=found_file.suffix,
+                save_to_disk=save_to_disk,
+                output_format=output_format,
+                compress_level=png_compress_level,
+            )
 
-            # 13. 转换为 ComfyUI tensor
-            image_tensor = pil2tensor(pil_image)
+            # 12. 直接从缓存文件解码为 ComfyUI tensor
+            logger.info(f"[JM-Gemini-Reverse] 加载图片: {found_file}")
+            image_tensor = load_image_tensor(str(found_file))
             logger.info(f"[JM-Gemini-Reverse] 生成完成，tensor shape: {image_tensor.shape}")
 
             return (image_tensor,)
@@ -3,15 +3,32 @@ ComfyUI-JM-Gemini-API Video Node
 A custom node for ComfyUI that generates videos using Google's Gemini Veo API
 """
 
-import os
-import time
 import logging
-import io
-import tempfile
-from google import genai
 from google.genai import types
 
-from .utils import tensor2pil, get_output_dir
+from .genai_clients import get_client
+from .key_pool import key_pool_input_types, resolve_keys
+from .operation_polling import DEFAULT_POLL_DEADLINE, get_poller, polling_stats
+from .rate_limiter import get_scheduler, rate_limit_input_types, rate_limit_stats
+from .resilience import (
+    DEFAULT_DEADLINE,
+    DEFAULT_MAX_RETRIES,
+    NON_IDEMPOTENT_RETRYABLE_ERRORS,
+    RetryPolicy,
+    call_with_retry,
+    resilience_stats,
+    retry_input_types,
+)
+from .utils import (
+    DEFAULT_UPLOAD_QUALITY,
+    encode_for_upload,
+    format_upload_summary,
+    get_encoded_image_cache,
+    get_output_dir,
+    upload_input_types,
+    upload_policy,
+    write_output_file,
+)
 
 # 设置日志
 logger = logging.getLogger(__name__)
@@ -23,49 +40,17 @@ VEO_3_0_GENERATE = "veo-3.0-generate-001"
 VEO_3_0_FAST_GENERATE = "veo-3.0-fast-generate-001"
 
 
-def pil_to_image(pil_image):
+def tensor_to_image(image_tensor, policy=None):
     """
-    将PIL Image转换为API可接受的Image格式
-    使用types.Image直接构造（适用于图生视频）
+    将ComfyUI的IMAGE（取第一帧）转换为API可接受的Image格式
+    按上传策略缩小和编码（默认无损PNG），编码结果按内容缓存，同一张参考图像只编码一次
     """
-    # 确保图片是RGB模式（API可能不支持RGBA等格式）
-    if pil_image.mode != 'RGB':
-        pil_image = pil_image.convert('RGB')
-
-    # 将PIL Image转换为bytes
-    image_bytes_io = io.BytesIO()
-    pil_image.save(image_bytes_io, format='PNG')
-    image_bytes = image_bytes_io.getvalue()
-
-    # 使用types.Image创建Image对象
-    return types.Image(
-        image_bytes=image_bytes,
-        mime_type="image/png"  # 修复：MIME type 应该是 "image/png" 而不是 "PNG"
+    image_bytes, mime_type, stats = encode_for_upload(
+        image_tensor[0] if image_tensor.dim() == 4 else image_tensor, policy, "PNG"
     )
-
-
-def pil_to_image_via_file(pil_image):
-    """
-    将PIL Image转换为API可接受的Image格式
-    通过临时文件方式（与工作脚本保持一致）
-    """
-    # 确保图片是RGB模式
-    if pil_image.mode != 'RGB':
-        pil_image = pil_image.convert('RGB')
-
-    # 创建临时文件
-    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
-        tmp_path = tmp_file.name
-        pil_image.save(tmp_path, format='PNG')
-
-    try:
-        # 使用 types.Image.from_file() 加载（与工作脚本一致）
-        image = types.Image.from_file(location=tmp_path)
-        return image
-    finally:
-        # 清理临时文件
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
+    logger.info(f"[JM-Gemini] Upload payload: {format_upload_summary([stats])}")
+    logger.info(f"[JM-Gemini] Reference image cache: {get_encoded_image_cache().stats()}")
+    return types.Image(image_bytes=image_bytes, mime_type=mime_type)
 
 
 class JMGeminiVideoGenerator:
@@ -119,6 +104,17 @@ class JMGeminiVideoGenerator:
                 }),
                 "first_image": ("IMAGE",),
                 "last_image": ("IMAGE",),
+                **upload_input_types(),
+                "video_timeout": ("INT", {
+                    "default": DEFAULT_POLL_DEADLINE,
+                    "min": 60,
+                    "max": 3600,
+                    "step": 60,
+                    "tooltip": "Give up waiting for the video after this many seconds"
+                }),
+                **retry_input_types(),
+                **key_pool_input_types(),
+                **rate_limit_input_types(),
             }
         }
 
@@ -130,15 +126,18 @@ class JMGeminiVideoGenerator:
     def generate_video(self, gemini_api_key, prompt, seed=0, negative_prompt="",
                       model=VEO_3_1_GENERATE, aspect_ratio="16:9",
                       resolution="720p", duration="8",
-                      first_image=None, last_image=None):
+                      first_image=None, last_image=None,
+                      upload_max_megapixels=0.0, upload_format="default",
+                      upload_quality=DEFAULT_UPLOAD_QUALITY, lossless_max_megapixels=0.0,
+                      video_timeout=DEFAULT_POLL_DEADLINE, max_retries=DEFAULT_MAX_RETRIES, retry_deadline=int(DEFAULT_DEADLINE), key_pool="",
+                      queue_priority=0):
         """
         主函数：调用Gemini Veo API生成视频
         """
         # seed参数仅用于ComfyUI重新执行，不传递给API
 
-        # 验证API key
-        if not gemini_api_key or not gemini_api_key.strip():
-            raise ValueError("Gemini API key is required")
+        # 验证API key（设置了key_pool时使用key池）
+        keys = resolve_keys(gemini_api_key, key_pool)
 
         # 验证prompt
         if not prompt or not prompt.strip():
@@ -147,29 +146,35 @@ class JMGeminiVideoGenerator:
         # 设置输出目录
         output_dir = get_output_dir()
 
-        try:
-            # 创建客户端
-            client = genai.Client(api_key=gemini_api_key)
+        # 参考图像上传策略
+        policy = upload_policy(upload_max_megapixels, upload_format, upload_quality, lossless_max_megapixels)
+
+        # 429/5xx等错误的重试策略
+        retry_policy = RetryPolicy(max_retries=max_retries, deadline=retry_deadline)
 
+        try:
             # 根据输入图像判断生成模式
             if first_image is None and last_image is None:
                 # 文生视频模式
                 logger.info("[JM-Gemini] Text-to-Video mode")
                 video_path = self._generate_text_to_video(
-                    client=client,
+                    keys=keys,
                     prompt=prompt,
                     negative_prompt=negative_prompt,
                     model=model,
                     aspect_ratio=aspect_ratio,
                     resolution=resolution,
                     duration=duration,
-                    output_dir=output_dir
+                    output_dir=output_dir,
+                    retry_policy=retry_policy,
+                    priority=queue_priority,
+                    deadline=video_timeout
                 )
             elif first_image is not None and last_image is None:
                 # 图生视频模式
                 logger.info("[JM-Gemini] Image-to-Video mode")
                 video_path = self._generate_image_to_video(
-                    client=client,
+                    keys=keys,
                     prompt=prompt,
                     negative_prompt=negative_prompt,
                     model=model,
@@ -177,7 +182,11 @@ class JMGeminiVideoGenerator:
                     resolution=resolution,
                     duration=duration,
                     first_image=first_image,
-                    output_dir=output_dir
+                    output_dir=output_dir,
+                    upload_options=policy,
+                    retry_policy=retry_policy,
+                    priority=queue_priority,
+                    deadline=video_timeout
                 )
             elif first_image is not None and last_image is not None:
                 # 首尾帧生成视频模式
@@ -186,7 +195,7 @@ class JMGeminiVideoGenerator:
                     raise ValueError("First and last frame interpolation is only supported by Veo 3.1 models")
                 logger.info("[JM-Gemini] First-Last Frame Interpolation mode")
                 video_path = self._generate_interpolation_video(
-                    client=client,
+                    keys=keys,
                     prompt=prompt,
                     negative_prompt=negative_prompt,
                     model=model,
@@ -195,19 +204,29 @@ class JMGeminiVideoGenerator:
                     duration=duration,
                     first_image=first_image,
                     last_image=last_image,
-                    output_dir=output_dir
+                    output_dir=output_dir,
+                    upload_options=policy,
+                    retry_policy=retry_policy,
+                    priority=queue_priority,
+                    deadline=video_timeout
                 )
             else:
                 raise ValueError("Invalid image configuration: last_image provided without first_image")
 
+            logger.info(f"[JM-Gemini] Retry metrics for {model}: {resilience_stats(model)}")
+            logger.info(f"[JM-Gemini] Rate-limit queue for {model}: {rate_limit_stats(model)}")
+            logger.info(f"[JM-Gemini] Status polling for {model}: {polling_stats(model)}")
+            if keys.stats() is not None:
+                logger.info(f"[JM-Gemini] Key pool usage: {keys.stats()}")
             return (video_path,)
 
         except Exception as e:
             logger.exception(f"[JM-Gemini] Error generating video: {e}")
             raise RuntimeError(f"Failed to generate video: {str(e)}")
 
-    def _generate_text_to_video(self, client, prompt, negative_prompt, model,
-                                aspect_ratio, resolution, duration, output_dir):
+    def _generate_text_to_video(self, keys, prompt, negative_prompt, model,
+                                aspect_ratio, resolution, duration, output_dir, retry_policy=None,
+                                priority=0, deadline=DEFAULT_POLL_DEADLINE):
         """
         文生视频模式
         """
@@ -225,8 +244,11 @@ class JMGeminiVideoGenerator:
 
         config = types.GenerateVideosConfig(**config_params)
 
-        # 调用API生成视频
-        operation = client.models.generate_videos(
+        # 调用API生成视频（429/5xx时重试；超时可能已创建任务，不重试）
+        client, operation = self._create_operation(
+            keys,
+            retry_policy,
+            priority,
             model=model,
             prompt=prompt,
             config=config
@@ -237,22 +259,25 @@ class JMGeminiVideoGenerator:
             client=client,
             operation=operation,
             output_dir=output_dir,
+            model=model,
+            retry_policy=retry_policy,
+            deadline=deadline,
             prefix=f"{model.replace('.', '_')}_text2video"
         )
 
         return video_path
 
-    def _generate_image_to_video(self, client, prompt, negative_prompt, model,
+    def _generate_image_to_video(self, keys, prompt, negative_prompt, model,
                                  aspect_ratio, resolution, duration,
-                                 first_image, output_dir):
+                                 first_image, output_dir, upload_options=None,
+                                 retry_policy=None, priority=0, deadline=DEFAULT_POLL_DEADLINE):
         """
         图生视频模式
         """
         logger.info(f"[JM-Gemini] Generating image-to-video with model={model}, duration={duration}s")
 
-        # 转换图像为PIL格式，再转为Image格式
-        pil_image = tensor2pil(first_image)
-        image = pil_to_image(pil_image)
+        # 转换图像为Image格式（PNG编码结果有缓存）
+        image = tensor_to_image(first_image, upload_options)
 
         # 构建配置
         config_params = {
@@ -266,8 +291,11 @@ class JMGeminiVideoGenerator:
 
         config = types.GenerateVideosConfig(**config_params)
 
-        # 调用API生成视频
-        operation = client.models.generate_videos(
+        # 调用API生成视频（429/5xx时重试；超时可能已创建任务，不重试）
+        client, operation = self._create_operation(
+            keys,
+            retry_policy,
+            priority,
             model=model,
             prompt=prompt,
             image=image,
@@ -279,14 +307,18 @@ class JMGeminiVideoGenerator:
             client=client,
             operation=operation,
             output_dir=output_dir,
+            model=model,
+            retry_policy=retry_policy,
+            deadline=deadline,
             prefix=f"{model.replace('.', '_')}_image2video"
         )
 
         return video_path
 
-    def _generate_interpolation_video(self, client, prompt, negative_prompt, model,
+    def _generate_interpolation_video(self, keys, prompt, negative_prompt, model,
                                       aspect_ratio, resolution, duration,
-                                      first_image, last_image, output_dir):
+                                      first_image, last_image, output_dir, upload_options=None,
+                                      retry_policy=None, priority=0, deadline=DEFAULT_POLL_DEADLINE):
         """
         首尾帧生成视频模式（仅支持Veo 3.1）
         注意：在 last_frame 插值模式下，aspect_ratio 和 resolution 参数会导致 INVALID_ARGUMENT 错误
@@ -294,13 +326,9 @@ class JMGeminiVideoGenerator:
         """
         logger.info(f"[JM-Gemini] Generating interpolation video with model={model}, duration={duration}s")
 
-        # 转换图像为PIL格式，再转为Image格式
-        # 使用临时文件方式以确保与工作脚本完全一致
-        first_pil = tensor2pil(first_image)
-        last_pil = tensor2pil(last_image)
-
-        first_img = pil_to_image_via_file(first_pil)
-        last_img = pil_to_image_via_file(last_pil)
+        # 转换图像为Image格式（与临时文件方式得到的PNG字节和MIME类型相同，编码结果有缓存）
+        first_img = tensor_to_image(first_image, upload_options)
+        last_img = tensor_to_image(last_image, upload_options)
 
         # 构建配置 - 首尾帧插值模式
         # 测试是否支持 aspect_ratio 和 resolution 参数
@@ -315,8 +343,11 @@ class JMGeminiVideoGenerator:
 
         config = types.GenerateVideosConfig(**config_params)
 
-        # 调用API生成视频
-        operation = client.models.generate_videos(
+        # 调用API生成视频（429/5xx时重试；超时可能已创建任务，不重试）
+        client, operation = self._create_operation(
+            keys,
+            retry_policy,
+            priority,
             model=model,
             prompt=prompt,
             image=first_img,
@@ -328,30 +359,52 @@ class JMGeminiVideoGenerator:
             client=client,
             operation=operation,
             output_dir=output_dir,
+            model=model,
+            retry_policy=retry_policy,
+            deadline=deadline,
             prefix=f"{model.replace('.', '_')}_interpolation"
         )
 
         return video_path
 
-    def _wait_and_download_video(self, client, operation, output_dir, prefix):
+    def _create_operation(self, keys, retry_policy=None, priority=0, **kwargs):
+        """
+        调用 generate_videos 创建生成任务，只重试不会重复创建任务的错误
+
+        每次调用使用key池中负载最低的key，再在共享调度器中按该key和模型的限额排队；任务属于创建它的key，
+        返回该key的客户端，之后查询状态和下载都使用它。
+
+        Returns:
+            tuple: (genai.Client, operation)
+        """
+        scheduler = get_scheduler()
+
+        def generate_videos(model, **kwargs):
+            def create(api_key):
+                client = get_client(api_key)
+                with scheduler.slot(model, priority, api_key=api_key):
+                    return client, client.models.generate_videos(model=model, **kwargs)
+            return keys.call(create)
+
+        policy = (retry_policy or RetryPolicy()).replace(retry_on=NON_IDEMPOTENT_RETRYABLE_ERRORS)
+        return call_with_retry(generate_videos, policy=policy, **kwargs)
+
+    def _wait_and_download_video(self, client, operation, output_dir, prefix, model=None, retry_policy=None,
+                                 deadline=DEFAULT_POLL_DEADLINE):
         """
         等待视频生成完成并下载
+
+        按该模型的历史完成时间自适应轮询（见 operation_polling），超过 deadline 秒仍未完成时报错
         """
-        # 轮询操作状态直到视频生成完成
         logger.info("[JM-Gemini] Waiting for video generation to complete...")
-        poll_count = 0
-        max_polls = 120  # 最多等待20分钟 (120 * 10秒)
-
-        while not operation.done:
-            if poll_count >= max_polls:
-                raise TimeoutError("Video generation timeout after 20 minutes")
 
-            logger.info(f"[JM-Gemini] Polling operation status... ({poll_count + 1}/{max_polls})")
-            time.sleep(10)
-            operation = client.operations.get(operation)
-            poll_count += 1
+        def refresh(operation):
+            # 查询状态是只读请求，出错时按同样的策略重试
+            return call_with_retry(lambda model: client.operations.get(operation), model=model,
+                                   policy=retry_policy, label="operations.get")
 
-        logger.info("[JM-Gemini] Video generation completed")
+        operation, poll_run = get_poller().wait(operation, refresh, model, deadline=deadline)
+        logger.info(f"[JM-Gemini] Video generation completed: {poll_run}")
 
         # 检查是否有错误
         if hasattr(operation, 'error') and operation.error:
@@ -379,12 +432,14 @@ class JMGeminiVideoGenerator:
         logger.info("[JM-Gemini] Downloading generated video...")
         client.files.download(file=generated_video.video)
 
-        # 保存视频文件
-        timestamp = int(time.time())
-        file_name = f"{prefix}_{timestamp}.mp4"
-        file_path = os.path.join(output_dir, file_name)
-
-        generated_video.video.save(file_path)
+        # 保存视频文件（按内容哈希命名，同一秒内的多个结果不会互相覆盖）
+        file_path = write_output_file(
+            prefix,
+            data=generated_video.video.video_bytes,
+            extension=".mp4",
+            output_format="original",
+            output_dir=output_dir,
+        )
         logger.info(f"[JM-Gemini] Video saved to {file_path}")
 
         return file_path
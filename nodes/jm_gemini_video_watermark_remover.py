@@ -0,0 +1,363 @@
+"""
+ComfyUI-JM-Gemini-API Video Watermark Remover Node
+A custom node for ComfyUI that removes watermarks from Gemini generated MP4 videos
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import tempfile
+import subprocess
+import numpy as np
+import torch
+
+from .utils import commit_output_file, get_output_dir
+from .jm_gemini_watermark_remover import (
+    ASSETS_DIR,
+    DETECTION_SEARCH_RADIUS,
+    DETECTION_THRESHOLD,
+    WATERMARK_CONFIGS,
+    calculate_watermark_position,
+    detect_watermark_config,
+    detect_watermarks,
+    load_alpha_map,
+    remove_watermark,
+)
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 每次从管道读取并处理的帧数（内存占用只与该值和分辨率有关，与视频长度无关）
+DEFAULT_CHUNK_FRAMES = 32
+
+
+def find_ffmpeg():
+    """
+    查找 ffmpeg 可执行文件
+
+    优先使用 PATH 中的 ffmpeg，其次使用 imageio-ffmpeg 自带的二进制文件（如果已安装）
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg:
+        return ffmpeg
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        pass
+    raise RuntimeError("ffmpeg not found. Please install ffmpeg and make sure it is on PATH.")
+
+
+def find_ffprobe(ffmpeg):
+    """
+    查找与 ffmpeg 配套的 ffprobe：PATH 中的 ffprobe，或 ffmpeg 所在目录中的 ffprobe；没有时返回None
+    （imageio-ffmpeg 不带 ffprobe）
+    """
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe:
+        return ffprobe
+    sibling = os.path.join(os.path.dirname(ffmpeg), "ffprobe" + (".exe" if os.name == "nt" else ""))
+    return sibling if os.path.isfile(sibling) else None
+
+
+def _parse_frame_rate(value):
+    """ffprobe 的 "30000/1001" 或 ffmpeg 的 "29.97" 格式帧率；无效（0、0/0、N/A）时返回None"""
+    numerator, _, denominator = str(value or "").partition("/")
+    try:
+        rate = float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return value if rate > 0 else None
+
+
+def _display_size(width, height, rotation):
+    """旋转90°或270°的视频解码时会被 ffmpeg 自动旋转，帧的宽高互换"""
+    if round(float(rotation or 0)) % 180 != 0:
+        return height, width
+    return width, height
+
+
+def _probe_with_ffprobe(ffprobe, video_path):
+    result = subprocess.run(
+        [ffprobe, "-v", "error", "-print_format", "json", "-show_streams", video_path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace"
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed on {video_path}: {result.stderr.strip()}")
+    streams = json.loads(result.stdout or "{}").get("streams", [])
+    video = next((stream for stream in streams if stream.get("codec_type") == "video"), None)
+    if video is None:
+        raise RuntimeError(f"No video stream found in {video_path}")
+
+    # 旋转信息：新版本在 Display Matrix 附加数据中，旧版本在 rotate 标签中
+    rotation = video.get("tags", {}).get("rotate", 0)
+    for side_data in video.get("side_data_list", []):
+        if "rotation" in side_data:
+            rotation = side_data["rotation"]
+    width, height = _display_size(int(video["width"]), int(video["height"]), rotation)
+    return {
+        "width": width,
+        "height": height,
+        "fps": _parse_frame_rate(video.get("avg_frame_rate")) or _parse_frame_rate(video.get("r_frame_rate")),
+        "has_audio": any(stream.get("codec_type") == "audio" for stream in streams),
+        "rotation": float(rotation or 0),
+    }
+
+
+def _probe_with_ffmpeg(ffmpeg, video_path):
+    result = subprocess.run(
+        [ffmpeg, "-hide_banner", "-i", video_path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace"
+    )
+    info = result.stderr
+
+    video_match = re.search(r"Stream #\S+.*?: Video: .*?, (\d{2,5})x(\d{2,5})", info)
+    if not video_match:
+        raise RuntimeError(f"No video stream found in {video_path}")
+
+    fps_match = re.search(r"Stream #\S+.*?: Video: .*?, ([\d.]+) fps", info) or \
+        re.search(r"Stream #\S+.*?: Video: .*?, ([\d.]+) tbr", info)
+    rotation_match = re.search(r"displaymatrix: rotation of (-?[\d.]+) degrees", info) or \
+        re.search(r"^\s*rotate\s*:\s*(-?[\d.]+)", info, re.MULTILINE)
+    rotation = rotation_match.group(1) if rotation_match else 0
+    width, height = _display_size(int(video_match.group(1)), int(video_match.group(2)), rotation)
+    return {
+        "width": width,
+        "height": height,
+        "fps": _parse_frame_rate(fps_match.group(1)) if fps_match else None,
+        "has_audio": re.search(r"Stream #\S+.*?: Audio:", info) is not None,
+        "rotation": float(rotation),
+    }
+
+
+def probe_video(ffmpeg, video_path):
+    """
+    读取视频解码后的帧尺寸（已按旋转信息交换宽高）、帧率以及是否包含音频
+
+    优先使用 ffprobe 的JSON输出；没有 ffprobe 时解析 ffmpeg 的输出
+
+    Returns:
+        dict: {width, height, fps, has_audio, rotation}，fps 为ffmpeg可以直接使用的字符串
+
+    Raises:
+        RuntimeError: 没有视频流，或无法确定帧率
+    """
+    ffprobe = find_ffprobe(ffmpeg)
+    info = _probe_with_ffprobe(ffprobe, video_path) if ffprobe else _probe_with_ffmpeg(ffmpeg, video_path)
+    if info["fps"] is None:
+        raise RuntimeError(f"Could not determine the frame rate of {video_path}")
+    return info
+
+
+def _read_frames(stream, buffer):
+    """从管道读取最多 len(buffer) 帧到预分配的缓冲区，返回实际读取的帧数"""
+    view = memoryview(buffer.reshape(-1))
+    frame_bytes = buffer[0].nbytes
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    return filled // frame_bytes
+
+
+def remove_video_watermark(input_path, output_path, chunk_frames=DEFAULT_CHUNK_FRAMES, detect=False,
+                           threshold=DETECTION_THRESHOLD, search_radius=DETECTION_SEARCH_RADIUS, crf=18):
+    """
+    流式去除MP4视频中的水印
+
+    通过管道分块解码原始RGB帧，对每一块帧的水印区域做向量化修正，
+    再编码为H.264，音频流直接复制。内存占用固定为一个块的大小。
+
+    Args:
+        input_path: 输入视频路径
+        output_path: 输出视频路径
+        chunk_frames: 每块的帧数
+        detect: 是否用第一块帧检测水印位置和尺寸，无水印时直接复制原视频
+        threshold: 检测置信度阈值
+        search_radius: 检测搜索范围（像素）
+        crf: H.264 编码质量
+
+    Returns:
+        dict: 统计信息 {frames, seconds, frames_per_second, watermarked, logo_size, x, y}
+    """
+    ffmpeg = find_ffmpeg()
+    info = probe_video(ffmpeg, input_path)
+    width, height = info["width"], info["height"]
+
+    alpha_maps = {size: load_alpha_map(os.path.join(ASSETS_DIR, f"bg_{size}.png")) for size in WATERMARK_CONFIGS}
+    config = detect_watermark_config(width, height)
+    position = calculate_watermark_position(width, height, config)
+
+    decoder = subprocess.Popen(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", input_path,
+         "-f", "rawvideo", "-pix_fmt", "rgb24", "-"],
+        stdout=subprocess.PIPE
+    )
+
+    buffer = np.empty((chunk_frames, height, width, 3), dtype=np.uint8)
+    start = time.perf_counter()
+    frame_count = 0
+    watermarked = True
+    encoder = None
+
+    try:
+        count = _read_frames(decoder.stdout, buffer)
+
+        if detect and count:
+            detections = detect_watermarks(
+                torch.from_numpy(buffer[:count]), alpha_maps,
+                search_radius=search_radius, threshold=threshold
+            )
+            best = max(detections, key=lambda d: d["confidence"])
+            watermarked = best["watermarked"]
+            if watermarked:
+                config = dict(WATERMARK_CONFIGS[best["logo_size"]])
+                position = {"x": best["x"], "y": best["y"],
+                            "width": best["logo_size"], "height": best["logo_size"]}
+            logger.info(f"[JM-Gemini] Video watermark detection: {best}")
+
+        if not watermarked:
+            decoder.kill()
+            shutil.copyfile(input_path, output_path)
+            return {"frames": 0, "seconds": round(time.perf_counter() - start, 3),
+                    "frames_per_second": 0.0, "watermarked": False}
+
+        alpha_map = alpha_maps[config["logo_size"]]
+
+        encode_cmd = [
+            ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", info["fps"], "-i", "-",
+        ]
+        if info["has_audio"]:
+            encode_cmd += ["-i", input_path, "-map", "0:v", "-map", "1:a", "-c:a", "copy"]
+        encode_cmd += ["-c:v", "libx264", "-crf", str(crf), "-pix_fmt", "yuv420p",
+                       "-movflags", "+faststart", output_path]
+        encoder = subprocess.Popen(encode_cmd, stdin=subprocess.PIPE)
+
+        while count:
+            frames = buffer[:count]
+            remove_watermark(frames, alpha_map, position)
+            encoder.stdin.write(frames.data)
+            frame_count += count
+            count = _read_frames(decoder.stdout, buffer)
+
+        encoder.stdin.close()
+        if encoder.wait() != 0:
+            raise RuntimeError(f"ffmpeg encoder exited with code {encoder.returncode}")
+        if decoder.wait() != 0:
+            raise RuntimeError(f"ffmpeg decoder exited with code {decoder.returncode}")
+
+    finally:
+        if decoder.poll() is None:
+            decoder.kill()
+        if encoder is not None and encoder.poll() is None:
+            encoder.kill()
+
+    elapsed = time.perf_counter() - start
+    return {
+        "frames": frame_count,
+        "seconds": round(elapsed, 3),
+        "frames_per_second": round(frame_count / elapsed, 2) if elapsed > 0 else 0.0,
+        "watermarked": True,
+        "logo_size": config["logo_size"],
+        "x": position["x"],
+        "y": position["y"],
+    }
+
+
+class JMGeminiVideoWatermarkRemover:
+    """
+    ComfyUI自定义节点，用于去除Gemini生成视频（MP4）上的水印
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "video_path": ("STRING", {
+                    "default": "",
+                    "placeholder": "Path to the MP4 video"
+                }),
+            },
+            "optional": {
+                "detect_watermark": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "用前几帧检测水印位置和尺寸，无水印时直接复制原视频"
+                }),
+                "chunk_frames": ("INT", {
+                    "default": DEFAULT_CHUNK_FRAMES,
+                    "min": 1,
+                    "max": 1024,
+                    "tooltip": "每次解码和处理的帧数，决定内存占用"
+                }),
+                "crf": ("INT", {
+                    "default": 18,
+                    "min": 0,
+                    "max": 51,
+                    "tooltip": "H.264 编码质量（越小质量越高）"
+                }),
+            }
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("video_path",)
+    FUNCTION = "remove_watermark_from_video"
+    CATEGORY = "JM-Gemini"
+
+    def remove_watermark_from_video(self, video_path, detect_watermark=False,
+                                    chunk_frames=DEFAULT_CHUNK_FRAMES, crf=18):
+        """
+        主函数：去除视频上的Gemini水印
+
+        Args:
+            video_path: 输入视频路径
+            detect_watermark: 是否先检测水印
+            chunk_frames: 每块的帧数
+            crf: H.264 编码质量
+
+        Returns:
+            tuple: (去除水印后的视频路径,)
+        """
+        if not video_path or not os.path.exists(video_path):
+            raise ValueError(f"Video not found: {video_path}")
+
+        try:
+            # 先写入临时文件，完成后按内容哈希重命名
+            output_dir = get_output_dir()
+            fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".mp4", dir=output_dir)
+            os.close(fd)
+            try:
+                stats = remove_video_watermark(
+                    video_path, tmp_path,
+                    chunk_frames=chunk_frames,
+                    detect=detect_watermark,
+                    crf=crf,
+                )
+                file_path = commit_output_file(tmp_path, "gemini_watermark_removed", ".mp4")
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+            logger.info(f"[JM-Gemini] Video watermark removal: {stats}")
+            logger.info(f"[JM-Gemini] Saved watermark-removed video to {file_path}")
+
+            return (file_path,)
+
+        except Exception as e:
+            logger.exception(f"[JM-Gemini] Error removing video watermark: {e}")
+            raise RuntimeError(f"Failed to remove video watermark: {str(e)}")
+
+
+# 节点类映射
+NODE_CLASS_MAPPINGS = {
+    "JMGeminiVideoWatermarkRemover": JMGeminiVideoWatermarkRemover
+}
+
+# 节点显示名称映射
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "JMGeminiVideoWatermarkRemover": "JM Gemini Video Watermark Remover"
+}
@@ -4,12 +4,25 @@ A custom node for ComfyUI that removes watermarks from Gemini generated images
 """
 
 import os
-import time
+import io
+import json
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 import numpy as np
+import torch
+import torch.nn.functional as F
 from PIL import Image
 
-from .utils import tensor2pil, pil2tensor, get_output_dir
+from .utils import (
+    DEFAULT_OUTPUT_FORMAT,
+    DEFAULT_PNG_COMPRESS_LEVEL,
+    tensor2pil,
+    pil2tensor,
+    output_input_types,
+    save_output,
+)
 
 # 设置日志
 logger = logging.getLogger(__name__)
@@ -19,8 +32,55 @@ ALPHA_THRESHOLD = 0.002  # 忽略极小的alpha值（噪声）
 MAX_ALPHA = 0.99  # 避免除以接近零的值
 LOGO_VALUE = 255  # 白色水印的颜色值
 
+# 水印检测参数
+DETECTION_THRESHOLD = 0.25  # 归一化互相关低于该值视为无水印
+DETECTION_SEARCH_RADIUS = 8  # 在预期位置周围搜索的像素范围
+HIGHPASS_KERNEL = 7  # 互相关前去除背景低频成分的均值滤波核大小
 
-def detect_watermark_config(image_width, image_height):
+# Gemini的水印配置（按logo尺寸）
+WATERMARK_CONFIGS = {
+    48: {"logo_size": 48, "margin_right": 32, "margin_bottom": 32},
+    96: {"logo_size": 96, "margin_right": 64, "margin_bottom": 64},
+}
+
+# 多尺度alpha映射库
+ALPHA_MAP_BANK_SIZE = 16  # 最多缓存的重采样alpha映射数量
+ALPHA_MAP_INTERPOLATIONS = ["bicubic", "bilinear", "area"]
+
+# 背景捕获图片所在目录
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets")
+
+# 进程内alpha映射缓存: {png路径: (mtime_ns, size, alpha_map)}
+_ALPHA_MAP_CACHE = {}
+
+# 进程内共享的多尺度alpha映射库
+_ALPHA_MAP_BANK = None
+
+
+def watermark_config_for_size(logo_size):
+    """
+    获取任意logo尺寸的水印配置
+
+    Gemini原生的48和96尺寸直接使用固定配置；其他尺寸（图像生成后被缩放）
+    按相同比例缩放边距（边距为logo尺寸的2/3）。
+
+    Args:
+        logo_size: logo尺寸（像素）
+
+    Returns:
+        dict: 水印配置 {logo_size, margin_right, margin_bottom}
+    """
+    if logo_size in WATERMARK_CONFIGS:
+        return dict(WATERMARK_CONFIGS[logo_size])
+    margin = int(round(logo_size * 2 / 3))
+    return {
+        "logo_size": logo_size,
+        "margin_right": margin,
+        "margin_bottom": margin
+    }
+
+
+def detect_watermark_config(image_width, image_height, scale=1.0):
     """
     根据图像尺寸检测水印配置
 
@@ -31,22 +91,19 @@ def detect_watermark_config(image_width, image_height):
     Args:
         image_width: 图像宽度
         image_height: 图像高度
+        scale: 图像生成后被缩放的比例（1.0 表示原始尺寸）
 
     Returns:
         dict: 水印配置 {logo_size, margin_right, margin_bottom}
     """
-    if image_width > 1024 and image_height > 1024:
-        return {
-            "logo_size": 96,
-            "margin_right": 64,
-            "margin_bottom": 64
-        }
+    if image_width / scale > 1024 and image_height / scale > 1024:
+        logo_size = 96
     else:
-        return {
-            "logo_size": 48,
-            "margin_right": 32,
-            "margin_bottom": 32
-        }
+        logo_size = 48
+
+    if scale == 1.0:
+        return dict(WATERMARK_CONFIGS[logo_size])
+    return watermark_config_for_size(max(1, int(round(logo_size * scale))))
 
 
 def calculate_watermark_position(image_width, image_height, config):
@@ -83,25 +140,134 @@ def calculate_alpha_map(bg_image_data):
     Returns:
         numpy.ndarray: Alpha映射 (值范围0.0-1.0)
     """
-    height, width = bg_image_data.shape[:2]
-    alpha_map = np.zeros((height, width), dtype=np.float32)
+    # 对于每个像素，取RGB三个通道的最大值作为亮度值，并归一化到[0, 1]范围
+    max_channel = bg_image_data[:, :, :3].max(axis=2)
+    return (max_channel / 255.0).astype(np.float32)
 
-    # 对于每个像素，取RGB三个通道的最大值并归一化到[0, 1]
-    for i in range(height):
-        for j in range(width):
-            r = bg_image_data[i, j, 0]
-            g = bg_image_data[i, j, 1]
-            b = bg_image_data[i, j, 2]
 
-            # 取RGB三个通道的最大值作为亮度值
-            max_channel = max(r, g, b)
+def load_alpha_map(png_path):
+    """
+    加载背景捕获图片对应的alpha映射
 
-            # 归一化到[0, 1]范围
-            alpha_map[i, j] = max_channel / 255.0
+    alpha映射在进程内缓存，并以PNG内容哈希为键持久化为同目录下的 .npy 文件，
+    之后的节点实例和进程直接以内存映射方式读取，无需重新计算。
 
+    Args:
+        png_path: 背景捕获图片路径 (bg_48.png / bg_96.png)
+
+    Returns:
+        numpy.ndarray: 只读的Alpha映射 (float32)
+    """
+    stat = os.stat(png_path)
+    cached = _ALPHA_MAP_CACHE.get(png_path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    with open(png_path, "rb") as f:
+        png_bytes = f.read()
+    digest = hashlib.sha256(png_bytes).hexdigest()[:16]
+    base_name = os.path.splitext(os.path.basename(png_path))[0]
+    npy_path = os.path.join(os.path.dirname(png_path), f"{base_name}_alpha_{digest}.npy")
+
+    alpha_map = None
+    if os.path.exists(npy_path):
+        try:
+            alpha_map = np.load(npy_path, mmap_mode="r")
+        except Exception as e:
+            logger.warning(f"[JM-Gemini] Failed to load cached alpha map {npy_path}: {e}")
+
+    if alpha_map is None:
+        bg_array = np.array(Image.open(io.BytesIO(png_bytes)).convert('RGB'))
+        alpha_map = calculate_alpha_map(bg_array)
+        alpha_map.setflags(write=False)
+        # 先写临时文件再替换，避免并发进程读到半写入的文件
+        tmp_path = f"{npy_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, alpha_map)
+            os.replace(tmp_path, npy_path)
+        except OSError as e:
+            logger.warning(f"[JM-Gemini] Could not persist alpha map to {npy_path}: {e}")
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    _ALPHA_MAP_CACHE[png_path] = (stat.st_mtime_ns, stat.st_size, alpha_map)
     return alpha_map
 
 
+class AlphaMapBank:
+    """
+    多尺度alpha映射库
+
+    从96×96主alpha映射按需重采样出任意尺寸的alpha映射，
+    以 (尺寸, 插值方式) 为键进行LRU缓存。
+    """
+
+    def __init__(self, master_path=None, max_entries=ALPHA_MAP_BANK_SIZE):
+        self.master_path = master_path or os.path.join(ASSETS_DIR, "bg_96.png")
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, logo_size, interpolation="bicubic"):
+        """
+        获取指定尺寸的alpha映射
+
+        Args:
+            logo_size: logo尺寸（像素）
+            interpolation: 重采样插值方式 (bicubic / bilinear / area)
+
+        Returns:
+            numpy.ndarray: 只读的Alpha映射 (float32)
+        """
+        if interpolation not in ALPHA_MAP_INTERPOLATIONS:
+            raise ValueError(f"Unsupported interpolation: {interpolation}")
+
+        key = (logo_size, interpolation)
+        with self._lock:
+            alpha_map = self._entries.get(key)
+            if alpha_map is not None:
+                self._entries.move_to_end(key)
+                return alpha_map
+
+        alpha_map = self._resample(logo_size, interpolation)
+
+        with self._lock:
+            self._entries[key] = alpha_map
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return alpha_map
+
+    def _resample(self, logo_size, interpolation):
+        """从主alpha映射重采样到指定尺寸"""
+        master = load_alpha_map(self.master_path)
+        if master.shape[0] == logo_size and master.shape[1] == logo_size:
+            return master
+
+        source = torch.tensor(np.asarray(master))[None, None]
+        if interpolation == "area":
+            resized = F.interpolate(source, size=(logo_size, logo_size), mode="area")
+        else:
+            resized = F.interpolate(source, size=(logo_size, logo_size), mode=interpolation,
+                                    align_corners=False, antialias=True)
+
+        alpha_map = resized[0, 0].clamp_(0.0, 1.0).numpy().astype(np.float32)
+        alpha_map.setflags(write=False)
+        return alpha_map
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_alpha_map_bank():
+    """获取进程内共享的多尺度alpha映射库"""
+    global _ALPHA_MAP_BANK
+    if _ALPHA_MAP_BANK is None:
+        _ALPHA_MAP_BANK = AlphaMapBank()
+    return _ALPHA_MAP_BANK
+
+
 def remove_watermark(image_data, alpha_map, position):
     """
     使用反向alpha混合去除水印
@@ -110,8 +276,12 @@ def remove_watermark(image_data, alpha_map, position):
     - Gemini添加水印: watermarked = α × logo + (1 - α) × original
     - 反向求解: original = (watermarked - α × logo) / (1 - α)
 
+    整个水印区域以数组运算一次完成，结果与逐像素计算逐位一致：
+    未被截断的alpha按float32计算，截断为MAX_ALPHA的像素按float64计算。
+
     Args:
-        image_data: 要处理的图像numpy数组 (height, width, channels)
+        image_data: 要处理的图像numpy数组 (height, width, channels)，也可以是
+            (frames, height, width, channels) 的uint8帧批次，原地修改
         alpha_map: Alpha通道数据
         position: 水印位置 {x, y, width, height}
     """
@@ -120,33 +290,214 @@ def remove_watermark(image_data, alpha_map, position):
     width = position["width"]
     height = position["height"]
 
-    # 处理水印区域的每个像素
-    for row in range(height):
-        for col in range(width):
-            # 计算在原始图像中的索引
-            img_row = y + row
-            img_col = x + col
+    # 水印区域视图（原地写回）
+    roi = image_data[..., y:y + height, x:x + width, :3]
+    alpha = alpha_map[:height, :width, np.newaxis]
 
-            # 获取alpha值
-            alpha = alpha_map[row, col]
+    # 反向alpha混合公式（被截断的分支中alpha可能为1.0，忽略其除零警告）
+    with np.errstate(divide="ignore", invalid="ignore"):
+        restored = np.where(
+            alpha > MAX_ALPHA,
+            # 限制alpha值以避免除以接近零的值
+            (roi - MAX_ALPHA * LOGO_VALUE) / (1.0 - MAX_ALPHA),
+            (roi - alpha * LOGO_VALUE) / (1.0 - alpha),
+        )
 
-            # 跳过极小的alpha值（噪声）
-            if alpha < ALPHA_THRESHOLD:
-                continue
+    # 限制在[0, 255]范围内，并跳过极小的alpha值（噪声）
+    np.copyto(
+        roi,
+        np.clip(np.round(restored), 0, 255).astype(np.uint8),
+        where=alpha >= ALPHA_THRESHOLD,
+    )
 
-            # 限制alpha值以避免除以接近零的值
-            alpha = min(alpha, MAX_ALPHA)
-            one_minus_alpha = 1.0 - alpha
 
-            # 对每个RGB通道应用反向alpha混合
-            for c in range(3):
-                watermarked = image_data[img_row, img_col, c]
+def _restore_region(region, alpha_map):
+    """
+    对一批水印区域 (batch, height, width, 3) 应用反向alpha混合，返回新的区域tensor
+
+    水印区域内的像素先按 tensor2pil 的方式量化为0-255整数，
+    截断为MAX_ALPHA的像素按float64计算（与 remove_watermark 一致）。
+    """
+    height, width = region.shape[1:3]
+    alpha = torch.tensor(np.asarray(alpha_map[:height, :width]), device=region.device)
+    alpha = alpha[None, :, :, None]
+
+    # 量化为0-255整数（与 tensor2pil 一致）
+    watermarked = (region.float() * 255).to(torch.uint8)
+
+    # 反向alpha混合公式
+    restored = torch.where(
+        alpha > MAX_ALPHA,
+        (watermarked.double() - MAX_ALPHA * LOGO_VALUE) / (1.0 - MAX_ALPHA),
+        ((watermarked.float() - alpha * LOGO_VALUE) / (1.0 - alpha)).double(),
+    )
+    restored = torch.round(restored).clamp_(0, 255).to(torch.uint8)
+
+    # 跳过极小的alpha值（噪声）
+    return torch.where(alpha >= ALPHA_THRESHOLD, restored.to(region.dtype) / 255.0, region)
+
+
+def remove_watermark_batch(images, alpha_map, position, frame_indices=None):
+    """
+    直接在ComfyUI IMAGE批次上去除水印
+
+    只克隆一次输入tensor，并用一次批量torch运算修正所有帧的水印区域，
+    水印区域外的像素保持不变。
+
+    Args:
+        images: ComfyUI的tensor格式图像 (batch, height, width, channels) 值范围0-1
+        alpha_map: Alpha通道数据
+        position: 水印位置 {x, y, width, height}
+        frame_indices: 只处理这些帧（默认处理全部帧）
+
+    Returns:
+        torch.Tensor: 去除水印后的图像批次
+    """
+    output = images.clone()
+    remove_watermark_batch_(output, alpha_map, position, frame_indices)
+    return output
+
+
+def remove_watermark_batch_(images, alpha_map, position, frame_indices=None):
+    """
+    remove_watermark_batch 的原地版本
+
+    Args:
+        images: ComfyUI的tensor格式图像 (batch, height, width, channels)，原地修改
+        alpha_map: Alpha通道数据
+        position: 水印位置 {x, y, width, height}
+        frame_indices: 只处理这些帧（默认处理全部帧）
+    """
+    rows = slice(position["y"], position["y"] + position["height"])
+    cols = slice(position["x"], position["x"] + position["width"])
+
+    if frame_indices is None:
+        region = images[:, rows, cols, :3]
+        region.copy_(_restore_region(region, alpha_map))
+    else:
+        frames = torch.as_tensor(frame_indices, dtype=torch.long, device=images.device)
+        images[frames, rows, cols, :3] = _restore_region(images[frames, rows, cols, :3], alpha_map)
+
+
+def _window_sums(x, height, width):
+    """
+    每个 height x width 窗口内的和 (N, 1, H-height+1, W-width+1)，用积分图计算，
+    代价与窗口大小无关（float64累加，避免方差计算时的抵消误差）
+    """
+    integral = F.pad(x.double().cumsum(dim=-1).cumsum(dim=-2), (1, 0, 1, 0))
+    return (integral[..., height:, width:] - integral[..., height:, :-width]
+            - integral[..., :-height, width:] + integral[..., :-height, :-width])
+
+
+def _highpass(x):
+    """减去局部均值，去除背景的低频成分 (N, 1, H, W)"""
+    pad = HIGHPASS_KERNEL // 2
+    padded = F.pad(x, (pad, pad, pad, pad), mode="replicate")
+    local_mean = _window_sums(padded, HIGHPASS_KERNEL, HIGHPASS_KERNEL) / (HIGHPASS_KERNEL * HIGHPASS_KERNEL)
+    return x - local_mean.to(x.dtype)
+
+
+def _match_template(images, alpha_map, position, search_radius):
+    """
+    在预期水印位置周围的搜索窗口内，计算图像亮度与alpha映射的归一化互相关
+
+    整个批次只裁剪搜索窗口，分子用一次 conv2d 计算，局部能量用积分图计算。
+
+    Returns:
+        tuple: (scores, offset_x, offset_y)，均为 (batch,) 的tensor
+    """
+    image_height, image_width = images.shape[1:3]
+    logo_size = position["width"]
+    x, y = position["x"], position["y"]
+
+    # 搜索窗口不超出图像边界
+    left = max(0, min(search_radius, x))
+    right = max(0, min(search_radius, image_width - x - logo_size))
+    top = max(0, min(search_radius, y))
+    bottom = max(0, min(search_radius, image_height - y - logo_size))
+    if x - left < 0 or y - top < 0 or x + logo_size + right > image_width or y + logo_size + bottom > image_height:
+        zeros = torch.zeros(images.shape[0])
+        return zeros, zeros.long(), zeros.long()
+
+    crop = images[:, y - top:y + logo_size + bottom, x - left:x + logo_size + right, :3]
+    gray = _highpass(crop.float().mean(dim=-1).unsqueeze(1))
+
+    template = torch.tensor(np.asarray(alpha_map[:logo_size, :logo_size]), dtype=torch.float64, device=images.device)
+    template = _highpass(template[None, None])
+    template = template - template.mean()
+    template = (template / template.norm().clamp_min(1e-12)).float()
+
+    # 模板零均值，互相关分子无需减去图像局部均值
+    numerator = F.conv2d(gray, template)
+    local_sum = _window_sums(gray, logo_size, logo_size)
+    local_sq_sum = _window_sums(gray * gray, logo_size, logo_size)
+    variance = (local_sq_sum - local_sum * local_sum / template.numel()).clamp_min(0).float()
+    ncc = (numerator / (variance.sqrt() + 1e-6)).flatten(1)
+
+    scores, best = ncc.max(dim=1)
+    window_width = left + right + 1
+    offset_x = best % window_width - left
+    offset_y = best // window_width - top
+    return scores.cpu(), offset_x.cpu(), offset_y.cpu()
+
+
+def detect_watermarks(images, alpha_maps, search_radius=DETECTION_SEARCH_RADIUS, threshold=DETECTION_THRESHOLD):
+    """
+    用模板匹配检测每一帧是否带有Gemini水印，以及水印的实际位置和尺寸
 
-                # 反向alpha混合公式
-                original = (watermarked - alpha * LOGO_VALUE) / one_minus_alpha
+    对每种logo尺寸，在其预期位置周围的小窗口内计算高通滤波后的图像亮度与
+    alpha映射的归一化互相关，整个批次一次完成；各尺寸的得分在批次上一次比较，取得分最高的尺寸和偏移。
 
-                # 限制在[0, 255]范围内
-                image_data[img_row, img_col, c] = np.clip(np.round(original), 0, 255).astype(np.uint8)
+    Args:
+        images: ComfyUI的tensor格式图像 (batch, height, width, channels)
+        alpha_maps: 可用的alpha映射 {logo_size: alpha_map}
+        search_radius: 在预期位置周围搜索的像素范围
+        threshold: 置信度阈值，低于该值视为无水印
+
+    Returns:
+        list: 每帧的检测结果 {watermarked, confidence, logo_size, x, y, offset_x, offset_y}
+    """
+    batch_size, image_height, image_width = images.shape[:3]
+    sizes, positions, scores, offsets_x, offsets_y = [], [], [], [], []
+
+    with torch.no_grad():
+        for logo_size, alpha_map in alpha_maps.items():
+            if alpha_map is None:
+                continue
+            config = watermark_config_for_size(logo_size)
+            position = calculate_watermark_position(image_width, image_height, config)
+            size_scores, offset_x, offset_y = _match_template(images, alpha_map, position, search_radius)
+            sizes.append(logo_size)
+            positions.append((position["x"], position["y"]))
+            scores.append(size_scores)
+            offsets_x.append(offset_x)
+            offsets_y.append(offset_y)
+
+    if not sizes:
+        return [{"watermarked": False, "confidence": 0.0, "logo_size": None, "x": None, "y": None,
+                 "offset_x": 0, "offset_y": 0} for _ in range(batch_size)]
+
+    # (尺寸数, batch)：每帧取得分最高的尺寸，得分相同时取先出现的尺寸
+    best_scores, best = torch.stack(scores).max(dim=0)
+    frames = torch.arange(batch_size)
+    offset_x = torch.stack(offsets_x)[best, frames]
+    offset_y = torch.stack(offsets_y)[best, frames]
+    base = torch.tensor(positions, dtype=torch.long)[best]
+    confidence = best_scores.clamp_min(0.0)
+
+    return [
+        {
+            "watermarked": conf >= threshold,
+            "confidence": round(conf, 4),
+            "logo_size": sizes[index],
+            "x": base_x + dx,
+            "y": base_y + dy,
+            "offset_x": dx,
+            "offset_y": dy,
+        }
+        for conf, index, (base_x, base_y), dx, dy in zip(
+            confidence.tolist(), best.tolist(), base.tolist(), offset_x.tolist(), offset_y.tolist())
+    ]
 
 
 class JMGeminiWatermarkRemover:
@@ -155,38 +506,28 @@ class JMGeminiWatermarkRemover:
     """
 
     def __init__(self):
-        # 预加载背景图片
-        self.bg_48 = None
-        self.bg_96 = None
+        # 预加载alpha映射
         self.alpha_map_48 = None
         self.alpha_map_96 = None
         self._load_background_images()
 
     def _load_background_images(self):
-        """加载背景图片并计算alpha映射"""
+        """加载背景图片对应的alpha映射（进程内及磁盘缓存）"""
         try:
-            # 获取assets目录路径
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            assets_dir = os.path.join(os.path.dirname(current_dir), "assets")
-
-            bg_48_path = os.path.join(assets_dir, "bg_48.png")
-            bg_96_path = os.path.join(assets_dir, "bg_96.png")
+            bg_48_path = os.path.join(ASSETS_DIR, "bg_48.png")
+            bg_96_path = os.path.join(ASSETS_DIR, "bg_96.png")
 
             # 加载48x48背景图
             if os.path.exists(bg_48_path):
-                self.bg_48 = Image.open(bg_48_path).convert('RGB')
-                bg_48_array = np.array(self.bg_48)
-                self.alpha_map_48 = calculate_alpha_map(bg_48_array)
-                logger.info("[JM-Gemini] Loaded bg_48.png and calculated alpha map")
+                self.alpha_map_48 = load_alpha_map(bg_48_path)
+                logger.info("[JM-Gemini] Loaded bg_48.png alpha map")
             else:
                 logger.warning(f"[JM-Gemini] bg_48.png not found at {bg_48_path}")
 
             # 加载96x96背景图
             if os.path.exists(bg_96_path):
-                self.bg_96 = Image.open(bg_96_path).convert('RGB')
-                bg_96_array = np.array(self.bg_96)
-                self.alpha_map_96 = calculate_alpha_map(bg_96_array)
-                logger.info("[JM-Gemini] Loaded bg_96.png and calculated alpha map")
+                self.alpha_map_96 = load_alpha_map(bg_96_path)
+                logger.info("[JM-Gemini] Loaded bg_96.png alpha map")
             else:
                 logger.warning(f"[JM-Gemini] bg_96.png not found at {bg_96_path}")
 
@@ -198,47 +539,160 @@ class JMGeminiWatermarkRemover:
         return {
             "required": {
                 "image": ("IMAGE",),
+            },
+            "optional": {
+                "batch_mode": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "直接在IMAGE批次上处理任意数量的帧，只修正水印区域，不保存文件"
+                }),
+                "detect_watermark": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "先用模板匹配检测水印，跳过无水印的帧，并定位偏离默认位置的水印"
+                }),
+                "detection_threshold": ("FLOAT", {
+                    "default": DETECTION_THRESHOLD,
+                    "min": 0.0,
+                    "max": 1.0,
+                    "step": 0.01,
+                    "tooltip": "归一化互相关置信度阈值，低于该值视为无水印"
+                }),
+                "search_radius": ("INT", {
+                    "default": DETECTION_SEARCH_RADIUS,
+                    "min": 0,
+                    "max": 64,
+                    "tooltip": "在默认水印位置周围搜索的像素范围"
+                }),
+                "resize_scale": ("FLOAT", {
+                    "default": 1.0,
+                    "min": 0.1,
+                    "max": 4.0,
+                    "step": 0.01,
+                    "tooltip": "图像生成后被缩放的比例，水印尺寸和边距按该比例从96×96主alpha映射重采样"
+                }),
+                "alpha_interpolation": (ALPHA_MAP_INTERPOLATIONS, {
+                    "default": "bicubic",
+                    "tooltip": "重采样alpha映射时使用的插值方式"
+                }),
+                **output_input_types(),
             }
         }
 
-    RETURN_TYPES = ("IMAGE",)
-    RETURN_NAMES = ("image",)
+    RETURN_TYPES = ("IMAGE", "STRING")
+    RETURN_NAMES = ("image", "detection")
     FUNCTION = "remove_watermark_from_image"
     CATEGORY = "JM-Gemini"
 
-    def remove_watermark_from_image(self, image):
+    def _get_alpha_map(self, config, interpolation="bicubic"):
+        """根据水印配置获取对应的alpha映射，非原生尺寸从多尺度alpha映射库获取"""
+        if config["logo_size"] == 48:
+            if self.alpha_map_48 is None:
+                raise RuntimeError("bg_48.png not loaded. Cannot remove watermark.")
+            return self.alpha_map_48
+        if config["logo_size"] == 96:
+            if self.alpha_map_96 is None:
+                raise RuntimeError("bg_96.png not loaded. Cannot remove watermark.")
+            return self.alpha_map_96
+        if self.alpha_map_96 is None:
+            raise RuntimeError("bg_96.png not loaded. Cannot resample alpha map.")
+        return get_alpha_map_bank().get(config["logo_size"], interpolation)
+
+    def _locate_watermarks(self, images, detect_watermark, detection_threshold, search_radius,
+                           resize_scale=1.0, alpha_interpolation="bicubic"):
+        """
+        确定每一帧的水印位置
+
+        不检测时按图像尺寸推断默认配置；检测时返回模板匹配的结果。
+
+        Returns:
+            list: 每帧的检测结果 {watermarked, confidence, logo_size, x, y, offset_x, offset_y}
+        """
+        batch_size, height, width = images.shape[:3]
+
+        if detect_watermark:
+            # 候选尺寸：两种原生水印尺寸按缩放比例换算
+            logo_sizes = {max(1, int(round(size * resize_scale))) for size in WATERMARK_CONFIGS}
+            detections = detect_watermarks(
+                images,
+                {size: self._get_alpha_map(watermark_config_for_size(size), alpha_interpolation)
+                 for size in logo_sizes},
+                search_radius=search_radius,
+                threshold=detection_threshold,
+            )
+            found = sum(1 for d in detections if d["watermarked"])
+            logger.info(f"[JM-Gemini] Detected watermarks in {found}/{batch_size} images")
+            return detections
+
+        config = detect_watermark_config(width, height, resize_scale)
+        position = calculate_watermark_position(width, height, config)
+        return [{
+            "watermarked": True,
+            "confidence": None,
+            "logo_size": config["logo_size"],
+            "x": position["x"],
+            "y": position["y"],
+            "offset_x": 0,
+            "offset_y": 0,
+        } for _ in range(batch_size)]
+
+    def remove_watermark_from_image(self, image, batch_mode=False, detect_watermark=False,
+                                    detection_threshold=DETECTION_THRESHOLD,
+                                    search_radius=DETECTION_SEARCH_RADIUS,
+                                    resize_scale=1.0, alpha_interpolation="bicubic",
+                                    save_to_disk=True, output_format=DEFAULT_OUTPUT_FORMAT,
+                                    png_compress_level=DEFAULT_PNG_COMPRESS_LEVEL):
         """
         主函数：去除图像上的Gemini水印
 
         Args:
             image: ComfyUI的tensor格式图像
+            batch_mode: 是否直接在IMAGE批次上处理
+            detect_watermark: 是否先检测水印，跳过无水印的帧
+            detection_threshold: 检测置信度阈值
+            search_radius: 检测时的搜索范围（像素）
+            resize_scale: 图像生成后被缩放的比例
+            alpha_interpolation: 重采样alpha映射时使用的插值方式
+            save_to_disk: 是否保存到output目录（批次模式不保存）
+            output_format: 输出格式（original 没有原始字节，按PNG保存）
+            png_compress_level: PNG压缩级别
 
         Returns:
-            tuple: 去除水印后的图像tensor
+            tuple: (去除水印后的图像tensor, 每帧检测结果的JSON字符串)
         """
+        # 确保是4D tensor
+        if len(image.shape) == 3:
+            image = image.unsqueeze(0)
+
+        if batch_mode:
+            return self._remove_watermark_from_batch(image, detect_watermark, detection_threshold, search_radius,
+                                                     resize_scale, alpha_interpolation)
+
         try:
+            detection = self._locate_watermarks(image[:1], detect_watermark, detection_threshold, search_radius,
+                                                resize_scale, alpha_interpolation)[0]
+            if not detection["watermarked"]:
+                logger.info(f"[JM-Gemini] No watermark detected (confidence {detection['confidence']}), skipping")
+                return (image, json.dumps([detection]))
+
             # 转换为PIL图像
             pil_image = tensor2pil(image)
 
             # 获取图像尺寸
             width, height = pil_image.size
 
-            # 检测水印配置
-            config = detect_watermark_config(width, height)
-            position = calculate_watermark_position(width, height, config)
+            # 水印配置与位置
+            config = watermark_config_for_size(detection["logo_size"])
+            position = {
+                "x": detection["x"],
+                "y": detection["y"],
+                "width": config["logo_size"],
+                "height": config["logo_size"]
+            }
 
             logger.info(f"[JM-Gemini] Image size: {width}x{height}, Watermark size: {config['logo_size']}x{config['logo_size']}")
             logger.info(f"[JM-Gemini] Watermark position: ({position['x']}, {position['y']})")
 
             # 获取对应的alpha映射
-            if config["logo_size"] == 48:
-                if self.alpha_map_48 is None:
-                    raise RuntimeError("bg_48.png not loaded. Cannot remove watermark.")
-                alpha_map = self.alpha_map_48
-            else:
-                if self.alpha_map_96 is None:
-                    raise RuntimeError("bg_96.png not loaded. Cannot remove watermark.")
-                alpha_map = self.alpha_map_96
+            alpha_map = self._get_alpha_map(config, alpha_interpolation)
 
             # 转换为numpy数组
             image_array = np.array(pil_image)
@@ -249,18 +703,56 @@ class JMGeminiWatermarkRemover:
             # 转换回PIL图像
             processed_image = Image.fromarray(image_array)
 
-            # 保存到output目录
-            output_dir = get_output_dir()
-            timestamp = int(time.time())
-            file_name = f"gemini_watermark_removed_{timestamp}.png"
-            file_path = os.path.join(output_dir, file_name)
-            processed_image.save(file_path)
-            logger.info(f"[JM-Gemini] Saved watermark-removed image to {file_path}")
+            # 后台保存到output目录
+            save_output(
+                "gemini_watermark_removed",
+                image=processed_image,
+                save_to_disk=save_to_disk,
+                output_format=output_format,
+                compress_level=png_compress_level,
+            )
 
             # 转换为ComfyUI tensor格式
             output_tensor = pil2tensor(processed_image)
 
-            return (output_tensor,)
+            return (output_tensor, json.dumps([detection]))
+
+        except Exception as e:
+            logger.exception(f"[JM-Gemini] Error removing watermark: {e}")
+            raise RuntimeError(f"Failed to remove watermark: {str(e)}")
+
+    def _remove_watermark_from_batch(self, images, detect_watermark, detection_threshold, search_radius,
+                                     resize_scale=1.0, alpha_interpolation="bicubic"):
+        """
+        批次模式：直接在tensor上修正每一帧的水印区域
+        """
+        try:
+            batch_size, height, width = images.shape[:3]
+            logger.info(f"[JM-Gemini] Batch of {batch_size} images: {width}x{height}")
+
+            detections = self._locate_watermarks(images, detect_watermark, detection_threshold, search_radius,
+                                                 resize_scale, alpha_interpolation)
+
+            # 按水印尺寸和位置分组，每组一次批量运算
+            groups = {}
+            for i, detection in enumerate(detections):
+                if detection["watermarked"]:
+                    key = (detection["logo_size"], detection["x"], detection["y"])
+                    groups.setdefault(key, []).append(i)
+
+            if not groups:
+                return (images, json.dumps(detections))
+
+            output_tensor = images.clone()
+            for (logo_size, x, y), frame_indices in groups.items():
+                logger.info(f"[JM-Gemini] Watermark size: {logo_size}x{logo_size}, position: ({x}, {y}), frames: {len(frame_indices)}")
+                alpha_map = self._get_alpha_map(watermark_config_for_size(logo_size), alpha_interpolation)
+                position = {"x": x, "y": y, "width": logo_size, "height": logo_size}
+                if len(frame_indices) == batch_size:
+                    frame_indices = None
+                remove_watermark_batch_(output_tensor, alpha_map, position, frame_indices)
+
+            return (output_tensor, json.dumps(detections))
 
         except Exception as e:
             logger.exception(f"[JM-Gemini] Error removing watermark: {e}")
@@ -0,0 +1,353 @@
+"""
+ComfyUI-JM-Gemini-API Key Pool
+多个API key的负载均衡
+
+从文件或环境变量读取多个API key，记录每个key的进行中请求数、最近的429次数和冷却时间，
+每次调用选择负载最低的可用key：
+- 429（限流）后该key进入冷却：服务端给出 Retry-After 时按其等待，否则从30秒开始逐次翻倍，最长10分钟
+- 401/403（key无效或无权限）后该key停用1小时
+- 请求遇到429且还有其他可用key时，立即换一个key重试，不等待退避
+- 所有key都在冷却时不在池中等待，抛出 RetryLaterError（最早结束冷却的时间作为 Retry-After），
+  由 call_with_retry 按重试策略和截止时间决定是否等待
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from google.genai import errors
+
+from .resilience import RATE_LIMIT, RetryLaterError, classify_error, retry_after_seconds
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# key_pool 输入为 "env" 时读取的环境变量（多个key用逗号、空白或换行分隔）
+KEY_POOL_ENV = "JM_GEMINI_API_KEYS"
+
+# 冷却时间
+RATE_LIMIT_COOLDOWN = 30.0
+MAX_RATE_LIMIT_COOLDOWN = 600.0
+INVALID_KEY_COOLDOWN = 3600.0
+
+# 统计最近429次数和吞吐量的时间窗口（秒）
+RECENT_WINDOW = 300.0
+THROUGHPUT_WINDOW = 60.0
+
+
+def parse_keys(text):
+    """解析key列表：逗号、空白或换行分隔，忽略空行和 # 开头的注释行，去重并保持顺序"""
+    keys = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        keys.extend(key for key in line.replace(",", " ").split() if key)
+    return list(dict.fromkeys(keys))
+
+
+def mask_key(api_key):
+    """日志和统计中只显示key的最后4位"""
+    return f"…{api_key[-4:]}" if len(api_key) > 4 else "…"
+
+
+class KeyState:
+    """单个key的状态和计数"""
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.in_flight = 0
+        self.requests = 0
+        self.succeeded = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.consecutive_rate_limits = 0
+        self.cooldown_until = 0.0
+        self.recent_rate_limits = deque()
+        self.recent_successes = deque()
+
+    def prune(self, now):
+        while self.recent_rate_limits and now - self.recent_rate_limits[0] > RECENT_WINDOW:
+            self.recent_rate_limits.popleft()
+        while self.recent_successes and now - self.recent_successes[0] > THROUGHPUT_WINDOW:
+            self.recent_successes.popleft()
+
+
+class KeyPool:
+    """
+    API key池，线程安全
+
+    acquire / release 成对使用（或使用 lease 上下文、call），release 时传入异常，
+    用于判断是否需要冷却该key。
+    """
+
+    def __init__(self, keys):
+        if not keys:
+            raise ValueError("Key pool is empty")
+        self._states = {key: KeyState(key) for key in keys}
+        self._order = list(keys)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._order)
+
+    def update_keys(self, keys):
+        """替换key列表（保留仍在列表中的key的状态）"""
+        if not keys:
+            raise ValueError("Key pool is empty")
+        with self._lock:
+            self._states = {key: self._states.get(key) or KeyState(key) for key in keys}
+            self._order = list(keys)
+
+    def _pick(self, now, exclude):
+        """负载最低的可用key：进行中请求最少，其次最近429最少、最近一分钟请求最少，再按轮转顺序"""
+        count = len(self._order)
+        candidates = []
+        for position, key in enumerate(self._order):
+            state = self._states[key]
+            if key in exclude or state.cooldown_until > now:
+                continue
+            state.prune(now)
+            candidates.append(((state.in_flight, len(state.recent_rate_limits), len(state.recent_successes),
+                                (position - self._next) % count), key))
+        if not candidates:
+            return None
+        key = min(candidates)[1]
+        self._next = (self._order.index(key) + 1) % count
+        return key
+
+    def acquire(self, exclude=()):
+        """
+        取出负载最低的可用key并计入进行中请求
+
+        Raises:
+            RetryLaterError: 所有key都在冷却，retry_after 为最早结束冷却的剩余秒数
+            RuntimeError: 没有可用的key
+        """
+        with self._lock:
+            now = time.monotonic()
+            key = self._pick(now, exclude)
+            if key is not None:
+                state = self._states[key]
+                state.in_flight += 1
+                state.requests += 1
+                return key
+            cooling = [state.cooldown_until for key, state in self._states.items() if key not in exclude]
+        if not cooling:
+            raise RuntimeError("No API key left to try in the key pool")
+        wait = max(0.0, min(cooling) - now)
+        raise RetryLaterError(f"All {len(cooling)} API keys in the pool are cooling down "
+                              f"for at least {wait:.0f}s more", retry_after=wait)
+
+    def release(self, api_key, error=None):
+        """
+        归还key；error 为调用抛出的异常（成功时为None）
+        """
+        with self._lock:
+            state = self._states.get(api_key)
+            if state is None:
+                return
+            state.in_flight -= 1
+            now = time.monotonic()
+
+            if error is None:
+                state.succeeded += 1
+                state.consecutive_rate_limits = 0
+                state.recent_successes.append(now)
+                return
+
+            state.errors += 1
+            if classify_error(error) == RATE_LIMIT:
+                state.rate_limited += 1
+                state.consecutive_rate_limits += 1
+                state.recent_rate_limits.append(now)
+                cooldown = retry_after_seconds(error)
+                if cooldown is None:
+                    cooldown = min(MAX_RATE_LIMIT_COOLDOWN,
+                                   RATE_LIMIT_COOLDOWN * 2 ** (state.consecutive_rate_limits - 1))
+                state.cooldown_until = max(state.cooldown_until, now + cooldown)
+                logger.warning(f"[JM-Gemini] API key {mask_key(api_key)} rate limited, cooling down {cooldown:.0f}s")
+            elif isinstance(error, errors.APIError) and error.code in (401, 403):
+                state.cooldown_until = now + INVALID_KEY_COOLDOWN
+                logger.warning(f"[JM-Gemini] API key {mask_key(api_key)} rejected ({error.code}), "
+                               f"disabled for {INVALID_KEY_COOLDOWN / 60:.0f} minutes")
+
+    def cancel(self, api_key):
+        """撤销 acquire：请求没有发出（例如没有限速名额），不计入统计"""
+        with self._lock:
+            state = self._states.get(api_key)
+            if state is not None:
+                state.in_flight -= 1
+                state.requests -= 1
+
+    def has_available(self, exclude=()):
+        """是否还有不在冷却中的key"""
+        with self._lock:
+            now = time.monotonic()
+            return any(key not in exclude and state.cooldown_until <= now for key, state in self._states.items())
+
+    @contextmanager
+    def lease(self, exclude=()):
+        """在 with 块中使用一个key，退出时归还（异常会传给 release）"""
+        api_key = self.acquire(exclude)
+        try:
+            yield api_key
+        except Exception as e:
+            self.release(api_key, e)
+            raise
+        self.release(api_key)
+
+    def call(self, func):
+        """
+        用负载最低的key调用 func(api_key)；遇到429且还有其他可用key时立即换key重试
+        """
+        tried = set()
+        while True:
+            api_key = self.acquire(tried)
+            try:
+                result = func(api_key)
+            except Exception as e:
+                self.release(api_key, e)
+                tried.add(api_key)
+                if classify_error(e) == RATE_LIMIT and self.has_available(tried):
+                    logger.info(f"[JM-Gemini] Switching to another API key after 429 on {mask_key(api_key)}")
+                    continue
+                raise
+            self.release(api_key)
+            return result
+
+    def stats(self):
+        """
+        每个key（只显示最后4位）的进行中请求数、请求/成功/429/错误次数、最近一分钟成功次数和剩余冷却秒数，
+        以及池的合计
+        """
+        with self._lock:
+            now = time.monotonic()
+            keys = []
+            for key in self._order:
+                state = self._states[key]
+                state.prune(now)
+                keys.append({
+                    "key": mask_key(key),
+                    "in_flight": state.in_flight,
+                    "requests": state.requests,
+                    "succeeded": state.succeeded,
+                    "rate_limited": state.rate_limited,
+                    "errors": state.errors,
+                    "succeeded_last_minute": len(state.recent_successes),
+                    "cooldown_seconds": round(max(0.0, state.cooldown_until - now), 1),
+                })
+        return {
+            "keys": keys,
+            "available": sum(1 for key in keys if key["cooldown_seconds"] == 0),
+            "in_flight": sum(key["in_flight"] for key in keys),
+            "requests": sum(key["requests"] for key in keys),
+            "succeeded_last_minute": sum(key["succeeded_last_minute"] for key in keys),
+        }
+
+
+class SingleKey:
+    """单个API key，接口与 KeyPool 相同（不做统计）"""
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def __len__(self):
+        return 1
+
+    def acquire(self, exclude=()):
+        return self.api_key
+
+    def release(self, api_key, error=None):
+        pass
+
+    def cancel(self, api_key):
+        pass
+
+    def has_available(self, exclude=()):
+        return self.api_key not in exclude
+
+    @contextmanager
+    def lease(self, exclude=()):
+        yield self.api_key
+
+    def call(self, func):
+        return func(self.api_key)
+
+    def stats(self):
+        return None
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def _read_source(source):
+    """读取key来源：env / env:变量名 / 文件路径"""
+    if source == "env" or source.startswith("env:"):
+        name = source[4:].strip() or KEY_POOL_ENV
+        return parse_keys(os.environ.get(name, ""))
+    path = os.path.expanduser(source)
+    if not os.path.isfile(path):
+        raise ValueError(f"Key pool file not found: {source}")
+    with open(path, "r", encoding="utf-8") as f:
+        return parse_keys(f.read())
+
+
+def get_key_pool(source):
+    """
+    获取key来源对应的共享 KeyPool（同一来源在整个进程中共享状态）
+
+    Args:
+        source: "env"（读取 JM_GEMINI_API_KEYS）、"env:变量名" 或key文件路径（每行一个key）
+    """
+    source = source.strip()
+    keys = _read_source(source)
+    if not keys:
+        raise ValueError(f"No API keys found in key pool source {source!r}")
+    with _POOLS_LOCK:
+        entry = _POOLS.get(source)
+        if entry is None:
+            pool = KeyPool(keys)
+            _POOLS[source] = [pool, keys]
+            logger.info(f"[JM-Gemini] Loaded key pool with {len(keys)} keys from {source}")
+            return pool
+        pool, last_keys = entry
+        if keys != last_keys:
+            # 文件或环境变量中的key有变化：更新列表，保留已有key的状态
+            pool.update_keys(keys)
+            entry[1] = keys
+            logger.info(f"[JM-Gemini] Reloaded key pool with {len(keys)} keys from {source}")
+        return pool
+
+
+def resolve_keys(api_key="", key_pool=""):
+    """
+    节点使用的key来源：设置了 key_pool 时返回共享的 KeyPool，否则返回 SingleKey
+
+    Raises:
+        ValueError: 两者都没有提供
+    """
+    if key_pool and key_pool.strip():
+        return get_key_pool(key_pool)
+    if not api_key or not api_key.strip():
+        raise ValueError("Gemini API key is required (or set key_pool)")
+    return SingleKey(api_key.strip())
+
+
+def key_pool_input_types():
+    """
+    节点共用的key池选项（放在节点的 optional 输入中）
+    """
+    return {
+        "key_pool": ("STRING", {
+            "multiline": False,
+            "default": "",
+            "placeholder": "env | env:VAR_NAME | /path/to/keys.txt (optional)",
+            "tooltip": "Use a pool of API keys instead of gemini_api_key; each request goes to the least-loaded key"
+        }),
+    }
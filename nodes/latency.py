@@ -0,0 +1,45 @@
+"""
+ComfyUI-JM-Gemini-API Latency History
+按模型记录最近的耗时样本并计算分位数
+
+对冲（hedging）用它记录请求延迟，任务轮询（operation_polling）用它记录任务完成时间。
+"""
+
+import threading
+from collections import defaultdict, deque
+
+# 每个模型保留的最近样本数
+LATENCY_SAMPLES = 200
+
+
+class LatencyHistory:
+    """
+    每个模型最近的耗时样本（秒），线程安全
+    """
+
+    def __init__(self, max_samples=LATENCY_SAMPLES):
+        self._samples = defaultdict(lambda: deque(maxlen=max_samples))
+        self._lock = threading.Lock()
+
+    def record(self, model, seconds):
+        with self._lock:
+            self._samples[model].append(seconds)
+
+    def percentile(self, model, percentile, min_samples=1):
+        """
+        耗时的分位数（最近邻法）；样本少于 min_samples 时返回None
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        index = min(len(samples) - 1, max(0, int(round(percentile / 100.0 * len(samples))) - 1))
+        return samples[index]
+
+    def summary(self, model):
+        """样本数和 p50/p90/p99 耗时（秒）"""
+        result = {"samples": len(self._samples.get(model, ()))}
+        for percentile in (50, 90, 99):
+            value = self.percentile(model, percentile, min_samples=1)
+            result[f"p{percentile}"] = round(value, 1) if value is not None else None
+        return result
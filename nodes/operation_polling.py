@@ -0,0 +1,170 @@
+"""
+ComfyUI-JM-Gemini-API Operation Polling
+长时间运行任务（Veo视频生成）的自适应轮询
+
+- 任意两次查询的间隔在 MIN_POLL_INTERVAL 和 MAX_POLL_INTERVAL（原来固定轮询的10秒）之间：
+  查询次数不会因间隔过短而增加，完成后最多多等待10秒
+- 每个模型记录任务的完成时间；有足够记录时，最早可能完成（5%分位数）之前按最长间隔查询，
+  并正好在5%分位数处查询；5%~95%分位数之间间隔按已等待时间的比例缩短，尽早发现完成；
+  超过95%分位数后恢复最长间隔。缩短间隔只在大多数任务完成的时间段内增加少量查询
+- 没有记录时按最长间隔查询，与原来的固定轮询相同
+- 总等待时间受截止时间限制
+
+API只在查询时才能发现任务已完成，实际完成时间在上一次查询和本次查询之间：
+本次间隔是“完成后多等待的时间”的上限，取中点作为估计值，同时作为该次任务的完成时间记录。
+"""
+
+import math
+import time
+import logging
+import threading
+from collections import defaultdict
+
+from .latency import LatencyHistory
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 查询间隔的下限和上限（秒）；上限即原来固定轮询的间隔
+MIN_POLL_INTERVAL = 6.0
+MAX_POLL_INTERVAL = 10.0
+
+# 有历史时在这两个完成时间分位数之间缩短间隔
+POLL_PERCENTILES = (5, 95)
+
+# 两个分位数之间的间隔占已等待时间的比例（再限制在上下限之间）
+DENSE_POLL_FRACTION = 0.08
+
+# 有该数量的完成记录后按历史分布安排查询
+MIN_HISTORY = 3
+
+# 默认总等待时间（秒）
+DEFAULT_POLL_DEADLINE = 1200
+
+
+def next_poll_delay(elapsed, checkpoints=None):
+    """
+    下一次查询前等待的秒数，始终在 MIN_POLL_INTERVAL 和 MAX_POLL_INTERVAL 之间
+
+    Args:
+        elapsed: 任务创建后已等待的秒数
+        checkpoints: 该模型完成时间的 POLL_PERCENTILES 分位数（升序；没有足够历史时为None）
+    """
+    if not checkpoints or elapsed >= checkpoints[-1]:
+        return MAX_POLL_INTERVAL
+    if elapsed < checkpoints[0]:
+        # 最早可能完成之前：用最少的查询次数（间隔不超过上限）正好到达第一个分位数
+        remaining = checkpoints[0] - elapsed
+        return max(MIN_POLL_INTERVAL, remaining / math.ceil(remaining / MAX_POLL_INTERVAL))
+    return min(MAX_POLL_INTERVAL, max(MIN_POLL_INTERVAL, elapsed * DENSE_POLL_FRACTION))
+
+
+class OperationPoller:
+    """
+    按模型记录完成时间并自适应轮询，线程安全
+    """
+
+    def __init__(self, history=None, sleep=time.sleep, clock=time.monotonic):
+        self.history = history or LatencyHistory()
+        self.sleep = sleep
+        self.clock = clock
+        self._stats = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+
+    def checkpoints(self, model):
+        """该模型完成时间的 POLL_PERCENTILES 分位数（升序、去重）；历史不足时为None"""
+        values = [self.history.percentile(model, percentile, min_samples=MIN_HISTORY)
+                  for percentile in POLL_PERCENTILES]
+        if values[0] is None:
+            return None
+        return sorted(set(values))
+
+    def wait(self, operation, refresh, model, deadline=DEFAULT_POLL_DEADLINE, start=None):
+        """
+        轮询直到 operation.done
+
+        Args:
+            operation: 刚创建的任务
+            refresh: refresh(operation) 返回最新状态的任务
+            model: 模型名（完成时间历史和统计的键）
+            deadline: 从 start 开始最多等待的秒数
+            start: 任务创建时间（clock()的值），默认为现在
+
+        Returns:
+            tuple: (完成的任务, 本次统计dict)
+
+        Raises:
+            TimeoutError: 超过截止时间仍未完成
+        """
+        start = self.clock() if start is None else start
+        checkpoints = self.checkpoints(model)
+        polls = 0
+        last_poll = start
+        while not operation.done:
+            elapsed = self.clock() - start
+            if elapsed >= deadline:
+                self._record(model, timeouts=1, status_calls=polls)
+                raise TimeoutError(f"Video generation did not finish within {deadline:.0f}s "
+                                   f"({polls} status checks)")
+            delay = min(next_poll_delay(elapsed, checkpoints), deadline - elapsed)
+            logger.info(f"[JM-Gemini] Checking operation status in {delay:.1f}s "
+                        f"(waited {elapsed:.0f}s, {polls} checks so far)")
+            self.sleep(delay)
+            last_poll, previous_poll = self.clock(), last_poll
+            operation = refresh(operation)
+            polls += 1
+
+        done_at = self.clock()
+        if polls:
+            # 任务在上一次查询和本次查询之间完成
+            wait_after_done_max = last_poll - previous_poll
+            completed = (previous_poll + last_poll) / 2 - start
+            self.history.record(model, completed)
+        else:
+            wait_after_done_max = 0.0
+            completed = 0.0
+        run = {
+            "status_calls": polls,
+            "elapsed": round(done_at - start, 1),
+            "completed_estimate": round(completed, 1),
+            "wait_after_done_max": round(wait_after_done_max, 1),
+            "wait_after_done_estimate": round(wait_after_done_max / 2, 1),
+        }
+        self._record(model, operations=1, status_calls=polls, wait_after_done=wait_after_done_max / 2)
+        return operation, run
+
+    def _record(self, model, **counters):
+        with self._lock:
+            stats = self._stats[model]
+            for name, value in counters.items():
+                stats[name] += value
+
+    def stats(self, model):
+        """
+        完成的任务数、超时次数、查询总次数和平均每个任务的查询次数、
+        平均完成后多等待的估计秒数，以及完成时间分位数
+        """
+        with self._lock:
+            stats = dict(self._stats.get(model, {}))
+        operations = int(stats.get("operations", 0))
+        return {
+            "operations": operations,
+            "timeouts": int(stats.get("timeouts", 0)),
+            "status_calls": int(stats.get("status_calls", 0)),
+            "status_calls_per_operation": round(stats.get("status_calls", 0) / operations, 1) if operations else 0.0,
+            "wait_after_done_avg": round(stats.get("wait_after_done", 0) / operations, 1) if operations else 0.0,
+            "completion": self.history.summary(model),
+        }
+
+
+_POLLER = OperationPoller()
+
+
+def get_poller():
+    """获取进程内共享的轮询器（完成时间历史按模型共享）"""
+    return _POLLER
+
+
+def polling_stats(model):
+    """模型的轮询统计和完成时间分位数"""
+    return _POLLER.stats(model)
@@ -0,0 +1,307 @@
+"""
+ComfyUI-JM-Gemini-API Rate Limiter
+进程内共享的请求调度器
+
+同一个ComfyUI进程中的所有节点（图像、视频、逆向）在发送请求前向调度器申请：
+- 每个 (API key, 模型) 一个令牌桶限制每分钟请求数（RPM），同时限制进行中的请求数；
+  配额属于key，key池中的每个key各自计算
+- 排队的请求按优先级放行，同优先级按到达顺序
+- 请求按配额匀速发出，而不是一起发出再被429拒绝后重试
+- 记录每个队列的排队等待时间
+
+默认不限速，只记录统计。通过环境变量 JM_GEMINI_RATE_LIMITS 开启，格式为逗号分隔的
+"模型名前缀=RPM/并发数"，例如 "gemini-3-pro-image=30/8,veo=4/2"；0 表示不限制，最长的匹配前缀生效。
+值为 "default" 时使用 SUGGESTED_RATE_LIMITS，也可以在其后追加覆盖项，例如 "default,veo=4/2"。
+"""
+
+import os
+import math
+import hashlib
+import time
+import heapq
+import logging
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+RATE_LIMITS_ENV = "JM_GEMINI_RATE_LIMITS"
+
+# 建议限额（每个key）：模型名前缀 -> (RPM, 并发数)，JM_GEMINI_RATE_LIMITS=default 时使用
+SUGGESTED_RATE_LIMITS = {
+    "gemini-3-pro-image": (20, 8),
+    "gemini-2.5-flash-image": (60, 8),
+    "veo": (10, 4),
+    "gemini-web": (10, 2),
+}
+SUGGESTED_KEYWORD = "default"
+
+# 没有匹配的前缀时的限额：不限制
+FALLBACK_RATE_LIMIT = (0, 0)
+
+# 令牌桶容量：相当于多少秒的配额（允许的突发请求数）
+BURST_SECONDS = 10.0
+
+# 统计等待时间分位数时保留的最近请求数
+WAIT_SAMPLES = 200
+
+
+def parse_rate_limits(text):
+    """
+    解析 "前缀=RPM/并发数" 列表；"default" 展开为 SUGGESTED_RATE_LIMITS，后面的项覆盖前面的
+
+    Raises:
+        ValueError: 格式错误
+    """
+    limits = {}
+    for item in text.replace("\n", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if item == SUGGESTED_KEYWORD:
+            limits.update(SUGGESTED_RATE_LIMITS)
+            continue
+        prefix, _, value = item.partition("=")
+        rpm, _, concurrency = value.partition("/")
+        try:
+            limits[prefix.strip()] = (int(rpm), int(concurrency or 0))
+        except ValueError:
+            raise ValueError(f"Invalid rate limit {item!r}, expected prefix=RPM/concurrency")
+    return limits
+
+
+def account_id(api_key):
+    """
+    API key 在队列键和统计中的标识：key的哈希前缀，不保存key本身；None 表示不区分账号
+    """
+    if not api_key:
+        return None
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+def queue_label(model, account):
+    """统计中队列的名称"""
+    return model if account is None else f"{model}@{account}"
+
+
+class ModelQueue:
+    """
+    单个 (账号, 模型) 的令牌桶、并发计数、等待队列和统计（由 RateLimitScheduler 加锁访问）
+    """
+
+    def __init__(self, rpm, max_concurrent):
+        self.rpm = rpm
+        self.max_concurrent = max_concurrent
+        self.capacity = max(1.0, math.ceil(rpm * BURST_SECONDS / 60.0)) if rpm > 0 else 0.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.waiting = []
+        self.granted = 0
+        self.queued = 0
+        self.timed_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+
+    def ready_in(self, now):
+        """
+        距离可以放行下一个请求的秒数：0 表示现在可以；None 表示要等进行中的请求结束
+        """
+        if self.max_concurrent > 0 and self.in_flight >= self.max_concurrent:
+            return None
+        if self.rpm <= 0:
+            return 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rpm / 60.0)
+        self.updated = now
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) * 60.0 / self.rpm
+
+    def take(self, wait, queued):
+        if self.rpm > 0:
+            self.tokens -= 1.0
+        self.in_flight += 1
+        self.granted += 1
+        self.queued += queued
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.waits.append(wait)
+
+
+class RateLimitScheduler:
+    """
+    按 (API key, 模型) 限速的请求调度器，线程安全
+
+    acquire / release 成对使用（或使用 slot 上下文）。priority 越大越先放行。
+    limits 为空（默认）时不限速，只记录统计。
+    """
+
+    def __init__(self, limits=None):
+        self.limits = dict(limits or {})
+        self._queues = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def limit_for(self, model):
+        """模型的 (RPM, 并发数)：最长的匹配前缀，没有匹配时使用 FALLBACK_RATE_LIMIT"""
+        matches = [prefix for prefix in self.limits if model.startswith(prefix)]
+        return self.limits[max(matches, key=len)] if matches else FALLBACK_RATE_LIMIT
+
+    def _queue(self, model, account):
+        queue = self._queues.get((account, model))
+        if queue is None:
+            queue = self._queues[(account, model)] = ModelQueue(*self.limit_for(model))
+        return queue
+
+    def acquire(self, model, priority=0, timeout=None, api_key=None):
+        """
+        等待 api_key 在该模型上的配额和并发名额
+
+        Args:
+            model: 模型名（限额按前缀匹配）
+            priority: 优先级，越大越先放行
+            timeout: 最多等待的秒数，None 表示一直等待
+            api_key: 发送请求使用的key，每个key单独计算配额；None 表示所有请求共用一个队列
+
+        Returns:
+            float: 排队等待的秒数
+
+        Raises:
+            TimeoutError: 超过 timeout 仍未放行
+        """
+        start = time.monotonic()
+        account = account_id(api_key)
+        with self._cond:
+            queue = self._queue(model, account)
+            entry = (-priority, next(self._seq))
+            heapq.heappush(queue.waiting, entry)
+            queued = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = queue.ready_in(now) if queue.waiting[0] == entry else None
+                    if wait == 0:
+                        heapq.heappop(queue.waiting)
+                        waited = now - start
+                        queue.take(waited, queued)
+                        # 队首换人了，让新的队首检查是否也能放行
+                        self._cond.notify_all()
+                        if waited >= 1.0:
+                            logger.info(f"[JM-Gemini] {queue_label(model, account)} request waited "
+                                        f"{waited:.1f}s in the rate-limit queue")
+                        return waited
+                    if timeout is not None:
+                        remaining = start + timeout - now
+                        if remaining <= 0:
+                            queue.timed_out += 1
+                            raise TimeoutError(f"Waited {timeout:.0f}s for a {queue_label(model, account)} "
+                                               f"rate-limit slot")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    queued = True
+                    self._cond.wait(wait)
+            except BaseException:
+                if entry in queue.waiting:
+                    queue.waiting.remove(entry)
+                    heapq.heapify(queue.waiting)
+                    self._cond.notify_all()
+                raise
+
+    def try_acquire(self, model, priority=0, api_key=None):
+        """
+        不等待地占用名额：有配额和并发名额、且没有请求在排队时占用并返回True，否则返回False
+        """
+        with self._cond:
+            queue = self._queue(model, account_id(api_key))
+            if queue.waiting or queue.ready_in(time.monotonic()) != 0:
+                return False
+            queue.take(0.0, False)
+            return True
+
+    def release(self, model, api_key=None):
+        """请求结束，释放并发名额"""
+        with self._cond:
+            queue = self._queues.get((account_id(api_key), model))
+            if queue is not None and queue.in_flight > 0:
+                queue.in_flight -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, model, priority=0, timeout=None, api_key=None):
+        """在 with 块中占用一个请求名额"""
+        self.acquire(model, priority, timeout, api_key)
+        try:
+            yield
+        finally:
+            self.release(model, api_key)
+
+    def stats(self, model=None):
+        """
+        每个队列（或指定模型的各个队列）的限额、进行中请求数、排队数，以及放行次数、
+        需要排队的次数和排队等待时间（平均、p95、最大，秒）。
+        队列名为 "模型@key哈希"，不区分key的队列只用模型名
+        """
+        with self._cond:
+            result = {}
+            for (account, name), queue in self._queues.items():
+                if model is not None and name != model:
+                    continue
+                waits = sorted(queue.waits)
+                result[queue_label(name, account)] = {
+                    "rpm": queue.rpm,
+                    "max_concurrent": queue.max_concurrent,
+                    "in_flight": queue.in_flight,
+                    "waiting": len(queue.waiting),
+                    "granted": queue.granted,
+                    "queued": queue.queued,
+                    "timed_out": queue.timed_out,
+                    "wait_avg": round(queue.wait_total / queue.granted, 2) if queue.granted else 0.0,
+                    "wait_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 2) if waits else 0.0,
+                    "wait_max": round(queue.wait_max, 2),
+                }
+            if model is not None and not result:
+                rpm, concurrency = self.limit_for(model)
+                result[model] = {"rpm": rpm, "max_concurrent": concurrency, "granted": 0}
+        return result
+
+
+_SCHEDULER = None
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def get_scheduler():
+    """获取进程内共享的调度器（首次使用时按环境变量设置限额，未设置时不限速）"""
+    global _SCHEDULER
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER is None:
+            limits = {}
+            value = os.environ.get(RATE_LIMITS_ENV, "").strip()
+            if value:
+                try:
+                    limits = parse_rate_limits(value)
+                except ValueError as e:
+                    logger.warning(f"[JM-Gemini] Ignoring {RATE_LIMITS_ENV}: {e}")
+            _SCHEDULER = RateLimitScheduler(limits)
+        return _SCHEDULER
+
+
+def rate_limit_stats(model=None):
+    """每个队列（或指定模型的各个队列）的排队和等待时间统计"""
+    return get_scheduler().stats(model)
+
+
+def rate_limit_input_types():
+    """
+    节点共用的调度选项（放在节点的 optional 输入中）
+    """
+    return {
+        "queue_priority": ("INT", {
+            "default": 0,
+            "min": -10,
+            "max": 10,
+            "tooltip": "When requests queue for the per-key, per-model rate limit (JM_GEMINI_RATE_LIMITS), higher priority goes first"
+        }),
+    }
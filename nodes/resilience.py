@@ -0,0 +1,395 @@
+"""
+ComfyUI-JM-Gemini-API Resilience
+google-genai 调用的重试、退避和熔断
+
+- 错误分类：限流（429）、服务端错误（5xx）、超时和网络错误可以重试，其他错误（400、403等）直接抛出
+- 指数退避加随机抖动；服务端给出 Retry-After 头或 RetryInfo 时按其等待
+- 每个模型一个熔断器：连续多次可重试的失败后暂停该模型的请求，冷却后放行试探请求
+- 总截止时间：重试和等待不会超过 deadline
+- 指标：每个模型的调用、重试、失败次数和等待时间
+"""
+
+import re
+import time
+import random
+import logging
+import threading
+import email.utils
+from collections import defaultdict
+
+import httpx
+from google.genai import errors
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 默认重试策略
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BASE_DELAY = 2.0
+DEFAULT_MAX_DELAY = 60.0
+DEFAULT_DEADLINE = 300.0
+
+# 熔断：同一模型连续失败该次数后暂停 BREAKER_COOLDOWN 秒
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_COOLDOWN = 60.0
+
+# 错误分类
+RATE_LIMIT = "rate_limit"
+SERVER_ERROR = "server_error"
+TIMEOUT = "timeout"
+NETWORK = "network"
+RETRYABLE_ERRORS = (RATE_LIMIT, SERVER_ERROR, TIMEOUT, NETWORK)
+
+# 创建类请求（例如 generate_videos）超时后可能已在服务端执行，重试会重复计费，不重试超时
+NON_IDEMPOTENT_RETRYABLE_ERRORS = (RATE_LIMIT, SERVER_ERROR, NETWORK)
+
+RETRYABLE_STATUS = {408: TIMEOUT, 429: RATE_LIMIT, 500: SERVER_ERROR, 502: SERVER_ERROR,
+                    503: SERVER_ERROR, 504: TIMEOUT}
+
+
+class CircuitOpenError(RuntimeError):
+    """模型的熔断器处于打开状态，且在截止时间内不会恢复"""
+
+
+class RetryLaterError(RuntimeError):
+    """
+    本地资源暂时不可用（例如key池中所有key都在冷却），retry_after 秒后可以重试
+
+    按限流错误重试，由 call_with_retry 在截止时间内决定是否等待；请求没有发出，不计入熔断器
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def classify_error(error):
+    """
+    将异常分类为可重试的错误类型
+
+    Returns:
+        str 或 None: RETRYABLE_ERRORS 之一；None 表示不可重试
+    """
+    if isinstance(error, errors.APIError):
+        return RETRYABLE_STATUS.get(error.code)
+    if isinstance(error, RetryLaterError):
+        return RATE_LIMIT
+    if isinstance(error, httpx.TimeoutException):
+        return TIMEOUT
+    if isinstance(error, (httpx.TransportError, ConnectionError)):
+        return NETWORK
+    if isinstance(error, TimeoutError):
+        return TIMEOUT
+    return None
+
+
+def retry_after_seconds(error):
+    """
+    服务端要求的等待时间（秒）：Retry-After 响应头（秒数或HTTP日期），
+    或错误详情中 google.rpc.RetryInfo 的 retryDelay；都没有时返回None。
+    RetryLaterError 返回它的 retry_after
+    """
+    if isinstance(error, RetryLaterError):
+        return error.retry_after
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if value:
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        details = details.get("error", details).get("details", [])
+    for detail in details if isinstance(details, list) else []:
+        if isinstance(detail, dict) and str(detail.get("@type", "")).endswith("RetryInfo"):
+            match = re.fullmatch(r"([\d.]+)s", str(detail.get("retryDelay", "")))
+            if match:
+                return float(match.group(1))
+    return None
+
+
+class RetryPolicy:
+    """
+    重试策略
+
+    Args:
+        max_retries: 最多重试次数（不含第一次调用）
+        base_delay: 第一次重试的退避上限（秒），之后每次翻倍
+        max_delay: 单次退避的上限（秒）
+        deadline: 从第一次调用开始的总时间上限（秒），0 表示不限制
+        retry_on: 可重试的错误类型
+    """
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY,
+                 max_delay=DEFAULT_MAX_DELAY, deadline=DEFAULT_DEADLINE, retry_on=RETRYABLE_ERRORS):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_on = tuple(retry_on)
+
+    def backoff(self, retry):
+        """第 retry 次重试前的退避时间：[0, min(max_delay, base_delay * 2^retry)] 内均匀随机（full jitter）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry)))
+
+    def replace(self, **changes):
+        """返回修改了部分参数的新策略"""
+        params = {"max_retries": self.max_retries, "base_delay": self.base_delay, "max_delay": self.max_delay,
+                  "deadline": self.deadline, "retry_on": self.retry_on}
+        params.update(changes)
+        return RetryPolicy(**params)
+
+
+class CircuitBreaker:
+    """
+    单个模型的熔断器
+
+    连续 failure_threshold 次可重试的失败后打开，cooldown 秒内不放行请求；
+    冷却结束后进入半开状态，只放行一个试探请求，其余请求直接拒绝；
+    试探成功则关闭，失败则重新打开。线程安全。
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.opened = 0
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """熔断器还要保持打开的秒数（0 表示冷却已结束）"""
+        with self._lock:
+            return max(0.0, self.open_until - time.monotonic())
+
+    def allow(self):
+        """
+        申请发送一次请求
+
+        Returns:
+            tuple: (是否放行, 还要保持打开的秒数, 是否为半开状态的试探请求)；
+            半开状态下已有试探请求在进行时不放行，等待秒数为0
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.open_until > now:
+                return False, self.open_until - now, False
+            if self.failures < self.failure_threshold:
+                return True, 0.0, False
+            if self.probing:
+                return False, 0.0, False
+            self.probing = True
+            return True, 0.0, True
+
+    def end_probe(self):
+        """试探请求以不说明服务状态的方式结束（例如参数错误），允许下一个请求试探"""
+        with self._lock:
+            self.probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.open_until = 0.0
+            self.probing = False
+
+    def record_failure(self, probe=False):
+        """
+        记录一次可重试的失败
+
+        Args:
+            probe: 失败的是否为半开状态的试探请求
+
+        Returns:
+            bool: 本次失败是否打开了熔断器
+        """
+        with self._lock:
+            if probe:
+                self.probing = False
+            self.failures += 1
+            if self.failures >= self.failure_threshold and self.open_until <= time.monotonic():
+                self.open_until = time.monotonic() + self.cooldown
+                self.opened += 1
+                return True
+            return False
+
+    def state(self):
+        with self._lock:
+            if self.open_until > time.monotonic():
+                return "open"
+            if self.failures < self.failure_threshold:
+                return "closed"
+            return "half_open_probing" if self.probing else "half_open"
+
+
+class ResilienceRegistry:
+    """
+    每个模型的熔断器和调用指标，线程安全
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._breakers = {}
+        self._metrics = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+
+    def breaker(self, model):
+        with self._lock:
+            breaker = self._breakers.get(model)
+            if breaker is None:
+                breaker = self._breakers[model] = CircuitBreaker(self.failure_threshold, self.cooldown)
+            return breaker
+
+    def record(self, model, **counters):
+        with self._lock:
+            metrics = self._metrics[model]
+            for name, value in counters.items():
+                metrics[name] += value
+
+    def stats(self, model=None):
+        """
+        指标：calls（调用次数）、retries（重试次数）、failures（最终失败次数）、
+        wait_seconds（退避和熔断等待的总秒数）、short_circuited（熔断直接拒绝次数）、
+        circuit_opened（熔断打开次数）、errors.<类型>（各类错误次数）和熔断器状态
+        """
+        with self._lock:
+            models = [model] if model is not None else list(self._metrics)
+            result = {}
+            for name in models:
+                metrics = {key: (round(value, 1) if key == "wait_seconds" else int(value))
+                           for key, value in sorted(self._metrics.get(name, {}).items())}
+                breaker = self._breakers.get(name)
+                metrics["circuit"] = breaker.state() if breaker is not None else "closed"
+                result[name] = metrics
+        return result[model] if model is not None else result
+
+    def clear(self):
+        with self._lock:
+            self._breakers.clear()
+            self._metrics.clear()
+
+
+_REGISTRY = ResilienceRegistry()
+
+
+def get_resilience_registry():
+    """获取进程内共享的熔断器和指标"""
+    return _REGISTRY
+
+
+def resilience_stats(model=None):
+    """每个模型（或指定模型）的重试和熔断指标"""
+    return _REGISTRY.stats(model)
+
+
+def call_with_retry(func, *args, model, policy=None, registry=None, label=None, sleep=time.sleep, **kwargs):
+    """
+    调用 func(*args, model=model, **kwargs)，可重试的错误按策略退避后重试
+
+    Args:
+        func: 要调用的函数（例如 client.models.generate_content）
+        model: 模型名，同时作为熔断器和指标的键并传给 func
+        policy: RetryPolicy，默认 RetryPolicy()
+        registry: ResilienceRegistry，默认进程内共享的实例
+        label: 日志中的调用名，默认为函数名
+
+    Raises:
+        CircuitOpenError: 熔断器打开且在截止时间内不会恢复
+        最后一次调用的异常：不可重试、重试次数用尽或超过截止时间
+    """
+    policy = policy or RetryPolicy()
+    registry = registry or _REGISTRY
+    breaker = registry.breaker(model)
+    label = label or getattr(func, "__name__", "call")
+    start = time.monotonic()
+    deadline = start + policy.deadline if policy.deadline else float("inf")
+    registry.record(model, calls=1)
+
+    retry = 0
+    while True:
+        # 熔断器打开时：能在截止时间内恢复就等待，否则直接失败；
+        # 半开状态下已有试探请求在进行时直接失败，不把请求压到可能仍未恢复的服务上
+        allowed, wait, probe = breaker.allow()
+        if not allowed:
+            if wait <= 0:
+                registry.record(model, short_circuited=1, failures=1)
+                raise CircuitOpenError(f"Circuit for {model} is half-open and a trial request is already running; "
+                                       f"try again later")
+            if time.monotonic() + wait > deadline:
+                registry.record(model, short_circuited=1, failures=1)
+                raise CircuitOpenError(f"Circuit for {model} is open for another {wait:.0f}s "
+                                       f"after repeated failures; try again later")
+            logger.warning(f"[JM-Gemini] Circuit for {model} is open, waiting {wait:.1f}s")
+            registry.record(model, wait_seconds=wait)
+            sleep(wait)
+            continue
+
+        try:
+            result = func(*args, model=model, **kwargs)
+        except Exception as e:
+            error_type = classify_error(e)
+            if error_type is not None and not isinstance(e, RetryLaterError):
+                registry.record(model, **{f"errors.{error_type}": 1})
+                if breaker.record_failure(probe):
+                    registry.record(model, circuit_opened=1)
+                    logger.warning(f"[JM-Gemini] Circuit for {model} opened for {breaker.cooldown:.0f}s "
+                                   f"after {breaker.failures} consecutive failures")
+            elif probe:
+                breaker.end_probe()
+
+            if error_type not in policy.retry_on or retry >= policy.max_retries:
+                registry.record(model, failures=1)
+                raise
+
+            server_delay = retry_after_seconds(e)
+            delay = server_delay if server_delay is not None else policy.backoff(retry)
+            if time.monotonic() + delay > deadline:
+                registry.record(model, failures=1)
+                logger.warning(f"[JM-Gemini] {label} for {model} failed ({error_type}); "
+                               f"retry in {delay:.1f}s would pass the {policy.deadline:.0f}s deadline")
+                raise
+
+            retry += 1
+            registry.record(model, retries=1, wait_seconds=delay)
+            logger.warning(f"[JM-Gemini] {label} for {model} failed ({error_type}: {e}); "
+                           f"retry {retry}/{policy.max_retries} in {delay:.1f}s"
+                           f"{' (Retry-After)' if server_delay is not None else ''}")
+            sleep(delay)
+            continue
+        except BaseException:
+            if probe:
+                breaker.end_probe()
+            raise
+
+        breaker.record_success()
+        if retry:
+            logger.info(f"[JM-Gemini] {label} for {model} succeeded after {retry} retries "
+                        f"in {time.monotonic() - start:.1f}s")
+        return result
+
+
+def retry_input_types():
+    """
+    节点共用的重试选项（放在节点的 optional 输入中）
+    """
+    return {
+        "max_retries": ("INT", {
+            "default": DEFAULT_MAX_RETRIES,
+            "min": 0,
+            "max": 10,
+            "tooltip": "Retries for rate-limit (429), server (5xx), timeout and network errors"
+        }),
+        "retry_deadline": ("INT", {
+            "default": int(DEFAULT_DEADLINE),
+            "min": 0,
+            "max": 3600,
+            "tooltip": "Give up retrying after this many seconds in total (0 = no limit)"
+        }),
+    }
@@ -0,0 +1,271 @@
+"""
+ComfyUI-JM-Gemini-API Response Cache
+图像生成响应的磁盘缓存
+
+按请求内容寻址：键为模型、提示词和参考图像（实际发送的编码字节的哈希）、生成参数
+（宽高比、分辨率、seed）的哈希。API返回的图像字节原样保存在磁盘上，命中时直接
+重建响应，不再调用API。缓存总大小和条目存活时间超过上限时按最近最少使用淘汰。
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import mimetypes
+from collections import OrderedDict
+from google.genai import types
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 缓存位置和上限，可通过环境变量修改
+CACHE_DIR_ENV = "JM_GEMINI_CACHE_DIR"
+CACHE_MAX_MB_ENV = "JM_GEMINI_CACHE_MAX_MB"
+CACHE_MAX_AGE_HOURS_ENV = "JM_GEMINI_CACHE_MAX_AGE_HOURS"
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "responses")
+DEFAULT_CACHE_MAX_MB = 2048
+DEFAULT_CACHE_MAX_AGE_HOURS = 24 * 7
+
+# 节点的缓存模式：off 不使用缓存；on 命中时直接返回；bypass 跳过查找，重新调用API并更新缓存
+CACHE_MODES = ["off", "on", "bypass"]
+
+MANIFEST_NAME = "manifest.json"
+
+
+def _hash_contents(hasher, contents):
+    """将请求的contents（字符串、Part或它们的列表）写入哈希"""
+    if not isinstance(contents, (list, tuple)):
+        contents = [contents]
+    for item in contents:
+        if isinstance(item, str):
+            hasher.update(b"text\0" + item.encode("utf-8") + b"\0")
+        elif getattr(item, "inline_data", None) is not None:
+            # 参考图像：哈希实际发送的编码字节（上传策略不同时字节不同，键也不同）
+            hasher.update(b"blob\0" + (item.inline_data.mime_type or "").encode("utf-8") + b"\0")
+            hasher.update(hashlib.sha256(item.inline_data.data).digest())
+        elif getattr(item, "text", None) is not None:
+            hasher.update(b"text\0" + item.text.encode("utf-8") + b"\0")
+        else:
+            hasher.update(b"part\0" + item.model_dump_json(exclude_none=True).encode("utf-8"))
+
+
+class ResponseCache:
+    """
+    内容寻址的响应磁盘缓存
+
+    每个条目一个目录：manifest.json 记录文本部分、图像的MIME类型、原始请求耗时，
+    图像部分按API返回的字节原样保存为单独的文件。线程安全；写入先在临时目录完成再重命名，
+    不会留下不完整的条目。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024,
+                 max_age=DEFAULT_CACHE_MAX_AGE_HOURS * 3600):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # key -> [字节数, 创建时间, 最近访问时间]，按最近访问排序
+        self._entries = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def make_key(model, contents, config=None, seed=None):
+        """
+        计算请求的缓存键
+
+        Args:
+            model: 模型名
+            contents: 请求的contents（提示词和参考图像）
+            config: GenerateContentConfig（包含宽高比、分辨率和多张生成时的seed）
+            seed: 节点的seed
+        """
+        hasher = hashlib.sha256(b"model\0" + model.encode("utf-8") + b"\0")
+        _hash_contents(hasher, contents)
+        if config is not None:
+            hasher.update(b"config\0" + config.model_dump_json(exclude_none=True).encode("utf-8"))
+        hasher.update(f"seed\0{seed}".encode("utf-8"))
+        return hasher.hexdigest()
+
+    def _load_index(self):
+        """首次使用时扫描缓存目录，按最近访问时间建立索引"""
+        if self._entries is not None:
+            return
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for key in os.listdir(self.cache_dir):
+                entry_dir = os.path.join(self.cache_dir, key)
+                manifest_path = os.path.join(entry_dir, MANIFEST_NAME)
+                if key.startswith(".") or not os.path.isfile(manifest_path):
+                    continue
+                try:
+                    with open(manifest_path, "r", encoding="utf-8") as f:
+                        created = json.load(f)["created"]
+                    size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+                    entries.append((os.stat(manifest_path).st_mtime, key, size, created))
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning(f"[JM-Gemini] Skipping unreadable cache entry {key}: {e}")
+        entries.sort()
+        self._entries = OrderedDict((key, [size, created, accessed]) for accessed, key, size, created in entries)
+        self._bytes = sum(entry[0] for entry in self._entries.values())
+
+    def _remove(self, key, evicted=True):
+        size = self._entries.pop(key)[0]
+        self._bytes -= size
+        self.evicted += evicted
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def _evict(self, now):
+        """移除过期条目，再按最近最少使用淘汰直到总大小不超过上限"""
+        if self.max_age > 0:
+            for key in [key for key, (_, created, _) in self._entries.items() if now - created > self.max_age]:
+                self._remove(key)
+        while self._entries and self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def get(self, key):
+        """
+        查找缓存的响应
+
+        Returns:
+            types.GenerateContentResponse 或 None（未命中）
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        now = time.time()
+        with self._lock:
+            self._load_index()
+            entry = self._entries.get(key)
+            if entry is not None and self.max_age > 0 and now - entry[1] > self.max_age:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+
+            try:
+                with open(os.path.join(entry_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                parts = []
+                for part in manifest["parts"]:
+                    if "text" in part:
+                        parts.append(types.Part(text=part["text"]))
+                    else:
+                        with open(os.path.join(entry_dir, part["file"]), "rb") as f:
+                            parts.append(types.Part.from_bytes(data=f.read(), mime_type=part["mime_type"]))
+                os.utime(os.path.join(entry_dir, MANIFEST_NAME))
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"[JM-Gemini] Dropping unreadable cache entry {key}: {e}")
+                self._remove(key, evicted=False)
+                self.misses += 1
+                return None
+
+            entry[2] = now
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += manifest.get("elapsed", 0.0)
+
+        return types.GenerateContentResponse(candidates=[
+            types.Candidate(content=types.Content(role="model", parts=parts))
+        ])
+
+    def put(self, key, response, elapsed=0.0):
+        """
+        保存响应的文本和图像部分（不含图像的响应不缓存）
+
+        Args:
+            key: make_key 计算的缓存键
+            response: generate_content 返回的响应
+            elapsed: 原始请求耗时（秒），用于统计命中节省的时间
+        """
+        parts = getattr(response, "parts", None) or []
+        if not any(getattr(part, "inline_data", None) is not None and part.inline_data.data for part in parts):
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp_", dir=self.cache_dir)
+        try:
+            manifest_parts = []
+            for idx, part in enumerate(parts):
+                inline_data = getattr(part, "inline_data", None)
+                if inline_data is not None and inline_data.data:
+                    mime_type = inline_data.mime_type or "image/png"
+                    file_name = f"part_{idx}{mimetypes.guess_extension(mime_type) or '.bin'}"
+                    with open(os.path.join(tmp_dir, file_name), "wb") as f:
+                        f.write(inline_data.data)
+                    manifest_parts.append({"file": file_name, "mime_type": mime_type})
+                elif part.text is not None:
+                    manifest_parts.append({"text": part.text})
+
+            now = time.time()
+            with open(os.path.join(tmp_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+                json.dump({"created": now, "elapsed": elapsed, "parts": manifest_parts}, f, ensure_ascii=False)
+            size = sum(entry.stat().st_size for entry in os.scandir(tmp_dir))
+
+            with self._lock:
+                self._load_index()
+                if key in self._entries:
+                    self._remove(key, evicted=False)
+                os.rename(tmp_dir, os.path.join(self.cache_dir, key))
+                self._entries[key] = [size, now, now]
+                self._bytes += size
+                self._evict(now)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def stats(self):
+        """命中/未命中次数、命中率、条目数、占用字节和命中节省的API耗时"""
+        with self._lock:
+            self._load_index()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "evicted": self.evicted,
+                "saved_seconds": round(self.saved_seconds, 1),
+            }
+
+    def clear(self):
+        """删除所有缓存条目"""
+        with self._lock:
+            self._load_index()
+            for key in list(self._entries):
+                self._remove(key, evicted=False)
+
+
+def _env_number(name, default):
+    value = os.environ.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"[JM-Gemini] Ignoring invalid {name}={value!r}")
+        return default
+
+
+_RESPONSE_CACHE = None
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+
+def get_response_cache():
+    """获取进程内共享的响应缓存（首次使用时按环境变量创建）"""
+    global _RESPONSE_CACHE
+    with _RESPONSE_CACHE_LOCK:
+        if _RESPONSE_CACHE is None:
+            _RESPONSE_CACHE = ResponseCache(
+                cache_dir=os.environ.get(CACHE_DIR_ENV, "").strip() or DEFAULT_CACHE_DIR,
+                max_bytes=int(_env_number(CACHE_MAX_MB_ENV, DEFAULT_CACHE_MAX_MB) * 1024 * 1024),
+                max_age=_env_number(CACHE_MAX_AGE_HOURS_ENV, DEFAULT_CACHE_MAX_AGE_HOURS) * 3600,
+            )
+        return _RESPONSE_CACHE
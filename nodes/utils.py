@@ -3,44 +3,481 @@ ComfyUI-JM-Gemini-API Utils
 Shared utility functions for all nodes
 """
 
+import io
 import os
+import atexit
+import queue
+import time
+import hashlib
+import logging
+import shutil
+import tempfile
+import warnings
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
 import numpy as np
 import torch
 from PIL import Image
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 输出文件格式：PNG（可调压缩级别）、无损WebP、原始字节（API返回的编码数据，没有时退回PNG）
+OUTPUT_FORMATS = ["png", "webp_lossless", "original"]
+DEFAULT_OUTPUT_FORMAT = "png"
+# 生成节点默认原样写入API返回的字节，省去一次完整的重新编码
+DEFAULT_GENERATED_OUTPUT_FORMAT = "original"
+DEFAULT_PNG_COMPRESS_LEVEL = 6
+
+# 后台写入队列的最大长度，队列满时提交方阻塞（防止未写入的图像堆积在内存中）
+OUTPUT_QUEUE_SIZE = 8
+
+# 内容哈希文件名中保留的十六进制位数
+OUTPUT_HASH_LENGTH = 16
+
+# tensor转PIL时每块float32临时缓冲区的大小
+CONVERSION_CHUNK_BYTES = 4 * 1024 * 1024
+
+# 通道数对应的PIL模式
+PIL_MODES = {1: "L", 3: "RGB", 4: "RGBA"}
+
+# 参考图像编码缓存的内存上限（编码后字节数之和）
+ENCODED_IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# 编码格式对应的MIME类型
+IMAGE_MIME_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+
+# 参考图像上传编码：default 表示节点原有的编码方式
+UPLOAD_FORMATS = ["default", "png", "jpeg", "webp"]
+DEFAULT_UPLOAD_QUALITY = 90
+
+
+def iter_tensor2pil(images):
+    """
+    逐帧将ComfyUI的tensor格式图像转换为PIL Image
+    ComfyUI图像格式: (batch, height, width, channels) 值范围0-1
+
+    每帧乘以255后截断为uint8，与 (x * 255).astype(np.uint8) 逐位一致；
+    按行分块写入一个小的float32缓冲区，再转换到逐帧复用的uint8缓冲区，
+    不产生float64或整帧大小的float临时数组。
+    缓冲区与图像在同一设备上（例如CUDA），只把每帧转换后的uint8结果复制到CPU。
+    """
+    # 确保是4D tensor
+    if images.dim() == 3:
+        images = images.unsqueeze(0)
+
+    height, width, channels = images.shape[1:]
+    scratch, frame_uint8 = _conversion_buffers(images)
+    mode = PIL_MODES[channels]
+
+    for frame in images.detach():
+        pixels = _frame_to_uint8(frame, scratch, frame_uint8)
+        # frombytes 复制像素，缓冲区可以给下一帧复用
+        yield Image.frombytes(mode, (width, height), pixels)
+
+
+def _conversion_buffers(images):
+    """iter_tensor2pil 使用的分块float32缓冲区和整帧uint8缓冲区（与图像在同一设备上）"""
+    height, width, channels = images.shape[-3:]
+    rows = max(1, CONVERSION_CHUNK_BYTES // (width * channels * 4))
+    scratch = torch.empty((min(rows, height), width, channels), dtype=torch.float32, device=images.device)
+    frame_uint8 = torch.empty((height, width, channels), dtype=torch.uint8, device=images.device)
+    return scratch, frame_uint8
+
+
+def _frame_to_uint8(frame, scratch, frame_uint8):
+    """
+    将单帧 (height, width, channels) 按行分块转换为uint8，返回CPU上的numpy数组
+    （CPU上的帧直接返回 frame_uint8 的视图，下一次转换会覆盖它）
+    """
+    rows = scratch.shape[0]
+    for start in range(0, frame.shape[0], rows):
+        chunk = frame[start:start + rows]
+        torch.mul(chunk, 255, out=scratch[:chunk.shape[0]])
+        frame_uint8[start:start + rows].copy_(scratch[:chunk.shape[0]])
+    pixels = frame_uint8 if frame_uint8.device.type == "cpu" else frame_uint8.cpu()
+    return pixels.numpy()
+
+
+def tensor2uint8(image_tensor):
+    """
+    将单帧图像转换为 (height, width, channels) 的uint8 numpy数组，与 tensor2pil 的像素逐位一致
+    """
+    if image_tensor.dim() == 4:
+        image_tensor = image_tensor[0]
+    scratch, frame_uint8 = _conversion_buffers(image_tensor)
+    return _frame_to_uint8(image_tensor.detach(), scratch, frame_uint8)
+
+
+def tensor2pil_batch(images):
+    """
+    将整个批次转换为PIL Image列表
+    """
+    return list(iter_tensor2pil(images))
+
 
 def tensor2pil(image_tensor):
     """
     将ComfyUI的tensor格式图像转换为PIL Image
     ComfyUI图像格式: (batch, height, width, channels) 值范围0-1
+    批次中有多帧时只转换第一帧，需要全部帧时使用 tensor2pil_batch
     """
     # 确保是4D tensor
-    if len(image_tensor.shape) == 3:
+    if image_tensor.dim() == 3:
         image_tensor = image_tensor.unsqueeze(0)
 
-    # 转换为numpy并调整值范围到0-255
-    image_np = (image_tensor.squeeze(0).cpu().numpy() * 255).astype(np.uint8)
+    if image_tensor.shape[0] > 1:
+        logger.warning(f"[JM-Gemini] tensor2pil received a batch of {image_tensor.shape[0]} images, using the first one")
 
-    # 转换为PIL Image
-    return Image.fromarray(image_np)
+    return next(iter_tensor2pil(image_tensor[:1]))
 
 
-def pil2tensor(image):
+def _copy_pil_into(image_tensor, image):
     """
-    将PIL Image转换为ComfyUI的tensor格式
+    将RGB PIL Image的像素按行分块复制到 (height, width, 3) 的tensor中（uint8转换为tensor的类型）
+
+    每次只导出一小块行，不产生整幅图像大小的中间副本。
+    """
+    width, height = image.size
+    rows = max(1, CONVERSION_CHUNK_BYTES // (width * 3))
+    for start in range(0, height, rows):
+        stop = min(start + rows, height)
+        strip = np.frombuffer(image.crop((0, start, width, stop)).tobytes(), dtype=np.uint8)
+        # 导出的字节是只读的，这里只读取它，忽略torch对只读数组的警告
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            image_tensor[start:stop].copy_(torch.from_numpy(strip).view(stop - start, width, 3))
+
+
+def pil2tensor(images):
+    """
+    将PIL Image（或尺寸相同的PIL Image列表）转换为ComfyUI的tensor格式
     返回格式: (batch, height, width, channels) 值范围0-1
+
+    所有图像直接写入一个预分配的float32 tensor，再原地缩放到0-1，
+    结果与 np.array(image).astype(np.float32) / 255.0 逐位一致。
+    """
+    if isinstance(images, Image.Image):
+        images = [images]
+
+    width, height = images[0].size
+    image_tensor = torch.empty((len(images), height, width, 3), dtype=torch.float32)
+    for i, image in enumerate(images):
+        if image.size != (width, height):
+            raise ValueError(f"All images must have the same size, got {image.size} and {(width, height)}")
+        # 确保是RGB模式
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        _copy_pil_into(image_tensor[i], image)
+
+    return image_tensor.div_(255.0)
+
+
+def load_image_tensor(source):
     """
-    # 确保是RGB模式
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
+    将编码后的图像（字节或文件路径）解码为ComfyUI的tensor格式
 
-    # 转换为numpy数组
-    image_np = np.array(image).astype(np.float32) / 255.0
+    只解码一次：像素按行分块复制到uint8 tensor后立即释放解码出的图像（PIL的RGB图像
+    每像素占4字节），再一次性转换为float32并原地缩放到0-1。解码器的缓冲区、PIL图像
+    和float32 tensor不会同时存在，额外的峰值内存约为输出tensor的1.25倍。
+    返回格式: (1, height, width, 3) 值范围0-1
+    """
+    image = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    try:
+        image.load()
+        if image.mode != 'RGB':
+            converted = image.convert('RGB')
+            image.close()
+            image = converted
 
-    # 转换为tensor并添加batch维度
-    image_tensor = torch.from_numpy(image_np).unsqueeze(0)
+        width, height = image.size
+        image_uint8 = torch.empty((height, width, 3), dtype=torch.uint8)
+        _copy_pil_into(image_uint8, image)
+    finally:
+        image.close()
+    del image
 
-    return image_tensor
+    image_tensor = image_uint8.to(torch.float32).unsqueeze(0)
+    del image_uint8
+    return image_tensor.div_(255.0)
+
+
+def stack_images(images):
+    """
+    将多个IMAGE tensor拼接为一个批次
+
+    尺寸相同时直接拼接；尺寸不同时（例如模型返回了不同宽高比的图像）写入一个
+    预分配的批次，较小的图像左上角对齐，其余区域用0填充。
+    返回格式: (batch, height, width, channels)
+    """
+    if len(images) == 1:
+        return images[0]
+
+    shapes = {tuple(image.shape[1:]) for image in images}
+    if len(shapes) == 1:
+        return torch.cat(images, dim=0)
+
+    height = max(image.shape[1] for image in images)
+    width = max(image.shape[2] for image in images)
+    channels = max(image.shape[3] for image in images)
+    logger.warning(f"[JM-Gemini] Stacking images of different sizes {sorted(shapes)}, "
+                   f"padding to {width}x{height}")
+
+    batch = torch.zeros((sum(image.shape[0] for image in images), height, width, channels),
+                        dtype=images[0].dtype)
+    offset = 0
+    for image in images:
+        b, h, w, c = image.shape
+        batch[offset:offset + b, :h, :w, :c] = image
+        offset += b
+    return batch
+
+
+class EncodedImageCache:
+    """
+    参考图像编码缓存（按内容寻址的LRU）
+
+    键为转换后uint8像素（即实际被编码的像素）的哈希加上编码参数，值为编码后的字节和MIME类型。
+    同一组参考图像在多次运行中只编码一次；总字节数超过上限时淘汰最久未使用的条目。
+    每次查找先把帧转换为uint8（未命中时直接用于编码），只对float数据四分之一大小的字节求哈希；
+    安装了 xxhash 时使用 xxh3_128，否则使用 sha256（通常有硬件加速，比 blake2b 快）。
+    """
+
+    def __init__(self, max_bytes=ENCODED_IMAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.lookup_seconds = 0.0
+
+    @staticmethod
+    def _key(pixels, image_format, max_pixels, params):
+        """uint8像素的哈希 + 形状和编码参数"""
+        data = memoryview(pixels).cast("B")
+        digest = xxhash.xxh3_128_hexdigest(data) if xxhash is not None else hashlib.sha256(data).hexdigest()
+        return (digest, pixels.shape, image_format, max_pixels, tuple(sorted(params.items())))
+
+    def encode(self, image_tensor, image_format="PNG", max_pixels=0, **params):
+        """
+        编码单帧图像，命中缓存时直接返回已编码的结果
+
+        Args:
+            image_tensor: (height, width, channels) 或只有一帧的 (1, height, width, channels)
+            image_format: PIL编码格式（PNG / JPEG / WEBP）
+            max_pixels: 像素数上限，超过时按比例缩小后再编码（0 表示不限制）
+            **params: 传给 PIL Image.save 的编码参数
+
+        Returns:
+            tuple: (编码后的字节, MIME类型)
+        """
+        start = time.perf_counter()
+        pixels = tensor2uint8(image_tensor)
+        key = self._key(pixels, image_format, max_pixels, params)
+        lookup = time.perf_counter() - start
+
+        with self._lock:
+            self.lookup_seconds += lookup
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += entry[2]
+                return entry[0], entry[1]
+            self.misses += 1
+
+        start = time.perf_counter()
+        pil_image = Image.frombytes(PIL_MODES[pixels.shape[2]], (pixels.shape[1], pixels.shape[0]), pixels)
+        if pil_image.mode != 'RGB':
+            pil_image = pil_image.convert('RGB')
+        size = fit_image_size(pil_image.width, pil_image.height, max_pixels)
+        if size != pil_image.size:
+            pil_image = pil_image.resize(size, Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        pil_image.save(buffer, format=image_format, **params)
+        data = buffer.getvalue()
+        mime_type = IMAGE_MIME_TYPES.get(image_format, f"image/{image_format.lower()}")
+        elapsed = time.perf_counter() - start
+
+        if len(data) <= self.max_bytes:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = (data, mime_type, elapsed)
+                    self._bytes += len(data)
+                    while self._bytes > self.max_bytes:
+                        _, (evicted, _, _) = self._entries.popitem(last=False)
+                        self._bytes -= len(evicted)
+
+        return data, mime_type
+
+    def stats(self):
+        """命中/未命中次数、条目数、占用字节数、节省的编码时间，以及查找（转换和哈希）的平均耗时"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "lookup_ms_avg": round(self.lookup_seconds / total * 1000, 2) if total else 0.0,
+                "hash": "xxh3_128" if xxhash is not None else "sha256",
+            }
+
+    def clear(self):
+        """清空缓存和计数"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.saved_seconds = 0.0
+            self.lookup_seconds = 0.0
+
+
+_ENCODED_IMAGE_CACHE = EncodedImageCache()
+
+
+def get_encoded_image_cache():
+    """获取进程内共享的参考图像编码缓存"""
+    return _ENCODED_IMAGE_CACHE
+
+
+def encode_image_tensor(image_tensor, image_format="PNG", max_pixels=0, **params):
+    """
+    通过共享缓存编码单帧图像
+
+    Returns:
+        tuple: (编码后的字节, MIME类型)
+    """
+    return _ENCODED_IMAGE_CACHE.encode(image_tensor, image_format, max_pixels, **params)
+
+
+def iter_encoded_frames(images, image_format="PNG", **params):
+    """逐帧编码IMAGE批次，产出 (编码后的字节, MIME类型)"""
+    if images.dim() == 3:
+        images = images.unsqueeze(0)
+    for frame in images:
+        yield encode_image_tensor(frame, image_format, **params)
+
+
+def fit_image_size(width, height, max_pixels):
+    """按比例缩小到不超过 max_pixels 个像素（0 表示不限制），返回 (宽, 高)"""
+    if not max_pixels or width * height <= max_pixels:
+        return width, height
+    scale = (max_pixels / (width * height)) ** 0.5
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def upload_input_types():
+    """
+    节点共用的参考图像上传选项（放在节点的 optional 输入中）
+    默认值保持节点原有的编码方式和分辨率
+    """
+    return {
+        "upload_max_megapixels": ("FLOAT", {
+            "default": 0.0,
+            "min": 0.0,
+            "max": 64.0,
+            "step": 0.1,
+            "tooltip": "上传前将参考图像缩小到不超过该百万像素数（0 表示保持原分辨率）"
+        }),
+        "upload_format": (UPLOAD_FORMATS, {
+            "default": "default",
+            "tooltip": "参考图像的上传编码：default 为节点原有编码，jpeg/webp 为有损编码，png 为无损编码"
+        }),
+        "upload_quality": ("INT", {
+            "default": DEFAULT_UPLOAD_QUALITY,
+            "min": 1,
+            "max": 100,
+            "tooltip": "jpeg/webp 的编码质量"
+        }),
+        "lossless_max_megapixels": ("FLOAT", {
+            "default": 0.0,
+            "min": 0.0,
+            "max": 64.0,
+            "step": 0.1,
+            "tooltip": "不超过该百万像素数的参考图像始终使用无损PNG（0 表示不启用）"
+        }),
+    }
+
+
+def upload_policy(upload_max_megapixels=0.0, upload_format="default", upload_quality=DEFAULT_UPLOAD_QUALITY,
+                  lossless_max_megapixels=0.0):
+    """由节点输入构建上传策略"""
+    return {
+        "max_pixels": int(upload_max_megapixels * 1_000_000),
+        "format": upload_format,
+        "quality": upload_quality,
+        "lossless_max_pixels": int(lossless_max_megapixels * 1_000_000),
+    }
+
+
+def encode_for_upload(image_tensor, policy=None, default_format="PNG"):
+    """
+    按上传策略缩小并编码单帧参考图像（结果有缓存）
+
+    Args:
+        image_tensor: (height, width, channels) 或只有一帧的 (1, height, width, channels)
+        policy: upload_policy() 的结果，None 表示节点原有的编码方式
+        default_format: 节点原有的编码格式
+
+    Returns:
+        tuple: (编码后的字节, MIME类型, 统计 {raw_bytes, sent_bytes, width, height, format})
+    """
+    policy = policy or upload_policy()
+    height, width = image_tensor.shape[-3:-1]
+    out_width, out_height = fit_image_size(width, height, policy["max_pixels"])
+
+    params = {}
+    if policy["lossless_max_pixels"] and out_width * out_height <= policy["lossless_max_pixels"]:
+        image_format = "PNG"
+    elif policy["format"] == "default":
+        image_format = default_format
+    else:
+        image_format = policy["format"].upper()
+        if image_format in ("JPEG", "WEBP"):
+            params["quality"] = policy["quality"]
+
+    data, mime_type = encode_image_tensor(image_tensor, image_format, policy["max_pixels"], **params)
+    return data, mime_type, {
+        "raw_bytes": width * height * 3,
+        "sent_bytes": len(data),
+        "width": out_width,
+        "height": out_height,
+        "format": image_format,
+    }
+
+
+def iter_upload_frames(images, policy=None, default_format="PNG"):
+    """逐帧按上传策略编码IMAGE批次，产出 (编码后的字节, MIME类型, 统计)"""
+    if images.dim() == 3:
+        images = images.unsqueeze(0)
+    for frame in images:
+        yield encode_for_upload(frame, policy, default_format)
+
+
+def format_upload_summary(upload_stats):
+    """汇总一次请求中参考图像的上传大小（原始RGB像素 → 实际发送的编码字节）"""
+    raw = sum(stats["raw_bytes"] for stats in upload_stats)
+    sent = sum(stats["sent_bytes"] for stats in upload_stats)
+    formats = ", ".join(f"{stats['width']}x{stats['height']} {stats['format']}" for stats in upload_stats)
+    return (f"{len(upload_stats)} images, {raw / 1048576:.1f} MB raw RGB -> {sent / 1048576:.2f} MB encoded "
+            f"({formats})")
 
 
 def get_output_dir():
@@ -63,3 +500,216 @@ def get_output_dir():
     output_dir = os.path.join(os.getcwd(), "output")
     os.makedirs(output_dir, exist_ok=True)
     return output_dir
+
+
+def output_input_types(default_format=DEFAULT_OUTPUT_FORMAT):
+    """
+    节点共用的输出保存选项（放在节点的 optional 输入中）
+    """
+    return {
+        "save_to_disk": ("BOOLEAN", {
+            "default": True,
+            "tooltip": "是否将结果保存到output目录（后台写入，不阻塞节点返回）"
+        }),
+        "output_format": (OUTPUT_FORMATS, {
+            "default": default_format,
+            "tooltip": "png：按压缩级别编码；webp_lossless：无损WebP；original：原样写入API返回的字节（没有时使用PNG）"
+        }),
+        "png_compress_level": ("INT", {
+            "default": DEFAULT_PNG_COMPRESS_LEVEL,
+            "min": 0,
+            "max": 9,
+            "tooltip": "PNG压缩级别，0最快，9最小"
+        }),
+    }
+
+
+def _content_digest(image=None, data=None, path=None):
+    """计算输出内容的哈希：对原始字节或文件内容计算，否则对像素、模式和尺寸计算"""
+    hasher = hashlib.sha256()
+    if data is not None:
+        hasher.update(data)
+    elif path is not None:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                hasher.update(chunk)
+    else:
+        hasher.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+        hasher.update(image.tobytes())
+    return hasher.hexdigest()[:OUTPUT_HASH_LENGTH]
+
+
+def commit_output_file(tmp_path, prefix, extension, output_dir=None):
+    """
+    将已写好的临时文件按内容哈希重命名为最终输出文件
+
+    相同内容得到相同文件名，已存在时直接删除临时文件。
+
+    Returns:
+        str: 最终文件路径
+    """
+    output_dir = output_dir or os.path.dirname(tmp_path)
+    file_path = os.path.join(output_dir, f"{prefix}_{_content_digest(path=tmp_path)}{extension}")
+    if os.path.exists(file_path):
+        os.unlink(tmp_path)
+    else:
+        os.replace(tmp_path, file_path)
+    return file_path
+
+
+def write_output_file(prefix, image=None, data=None, source_path=None, extension=".png",
+                      output_format=DEFAULT_OUTPUT_FORMAT, compress_level=DEFAULT_PNG_COMPRESS_LEVEL,
+                      output_dir=None):
+    """
+    同步写入一个输出文件，文件名为 {prefix}_{内容哈希}{扩展名}
+
+    Args:
+        prefix: 文件名前缀
+        image: PIL图像（没有原始数据或需要重新编码时使用）
+        data: 原始编码字节（例如API返回的PNG/JPEG）
+        source_path: 已编码的源文件（original 格式时硬链接，跨文件系统时复制）
+        extension: 原始字节/源文件对应的扩展名
+        output_format: 输出格式，见 OUTPUT_FORMATS
+        compress_level: PNG压缩级别
+        output_dir: 输出目录，默认 get_output_dir()
+
+    Returns:
+        str: 文件路径
+    """
+    output_dir = output_dir or get_output_dir()
+
+    if output_format == "original" and data is not None:
+        file_path = os.path.join(output_dir, f"{prefix}_{_content_digest(data=data)}{extension}")
+        if not os.path.exists(file_path):
+            _atomic_write(file_path, lambda f: f.write(data))
+        return file_path
+
+    if output_format == "original" and source_path is not None:
+        file_path = os.path.join(output_dir, f"{prefix}_{_content_digest(path=source_path)}{extension}")
+        if not os.path.exists(file_path):
+            _link_or_copy(source_path, file_path)
+        return file_path
+
+    if image is None:
+        image = Image.open(io.BytesIO(data) if data is not None else source_path)
+
+    if output_format == "webp_lossless":
+        extension, save_kwargs = ".webp", {"format": "WEBP", "lossless": True}
+    else:
+        extension, save_kwargs = ".png", {"format": "PNG", "compress_level": compress_level}
+
+    file_path = os.path.join(output_dir, f"{prefix}_{_content_digest(image=image)}{extension}")
+    if not os.path.exists(file_path):
+        _atomic_write(file_path, lambda f: image.save(f, **save_kwargs))
+    return file_path
+
+
+def _atomic_write(file_path, write):
+    """先写入同目录下的临时文件再重命名，避免留下不完整的文件"""
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", dir=os.path.dirname(file_path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _link_or_copy(source_path, file_path):
+    """硬链接源文件，不支持硬链接（如跨文件系统）时复制"""
+    try:
+        os.link(source_path, file_path)
+    except FileExistsError:
+        pass
+    except OSError:
+        with open(source_path, "rb") as src:
+            _atomic_write(file_path, lambda f: shutil.copyfileobj(src, f))
+
+
+class OutputWriter:
+    """
+    后台输出写入器
+
+    所有节点共用一个写入线程和一个有界队列：节点提交图像后立即返回，
+    编码和写盘在后台完成；队列满时提交方阻塞，未写入的图像数量有上限。
+    """
+
+    def __init__(self, max_pending=OUTPUT_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="JM-Gemini-OutputWriter", daemon=True)
+                self._thread.start()
+
+    def submit(self, prefix, **kwargs):
+        """
+        提交一个写入任务，参数同 write_output_file
+
+        传入的PIL图像在写入完成前不能再被修改。
+
+        Returns:
+            Future: 结果为文件路径
+        """
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((future, prefix, kwargs))
+        return future
+
+    def flush(self):
+        """等待所有已提交的写入完成"""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            future, prefix, kwargs = self._queue.get()
+            try:
+                file_path = write_output_file(prefix, **kwargs)
+                logger.info(f"[JM-Gemini] Saved output to {file_path}")
+                future.set_result(file_path)
+            except Exception as e:
+                logger.warning(f"[JM-Gemini] Failed to save output {prefix}: {e}")
+                future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+
+_OUTPUT_WRITER = None
+_OUTPUT_WRITER_LOCK = threading.Lock()
+
+
+def get_output_writer():
+    """获取进程内共享的输出写入器，进程退出前会等待未完成的写入"""
+    global _OUTPUT_WRITER
+    with _OUTPUT_WRITER_LOCK:
+        if _OUTPUT_WRITER is None:
+            _OUTPUT_WRITER = OutputWriter()
+            atexit.register(_OUTPUT_WRITER.flush)
+        return _OUTPUT_WRITER
+
+
+def save_output(prefix, image=None, data=None, source_path=None, extension=".png", save_to_disk=True,
+                output_format=DEFAULT_OUTPUT_FORMAT, compress_level=DEFAULT_PNG_COMPRESS_LEVEL):
+    """
+    节点保存结果的统一入口：在后台写入output目录
+
+    Returns:
+        Future 或 None（save_to_disk 为 False 时）
+    """
+    if not save_to_disk:
+        return None
+    return get_output_writer().submit(
+        prefix,
+        image=image,
+        data=data,
+        source_path=source_path,
+        extension=extension,
+        output_format=output_format,
+        compress_level=compress_level,
+        output_dir=get_output_dir(),
+    )
@@ -0,0 +1,376 @@
+"""
+ComfyUI-JM-Gemini-API Watermark Batch Remover
+离线批量去除Gemini水印的命令行入口（不依赖ComfyUI）
+
+用法:
+    python -m nodes.watermark_batch INPUT_DIR [INPUT_DIR/FILE ...] -o OUTPUT_DIR
+    python -m nodes.watermark_batch --list paths.txt -o OUTPUT_DIR --resume
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+from PIL import Image
+
+from .jm_gemini_watermark_remover import (
+    ASSETS_DIR,
+    DETECTION_SEARCH_RADIUS,
+    DETECTION_THRESHOLD,
+    WATERMARK_CONFIGS,
+    calculate_watermark_position,
+    detect_watermark_config,
+    detect_watermarks,
+    load_alpha_map,
+    remove_watermark,
+)
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 支持的图像扩展名
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp"}
+
+# 清单中视为已完成的状态（--resume 时跳过）
+DONE_STATUSES = {"processed", "skipped"}
+
+# 工作进程内的全局状态（由 _init_worker 设置）
+_worker_shm = None
+_worker_alpha_maps = None
+_worker_options = None
+
+
+def share_alpha_maps(alpha_maps):
+    """
+    将alpha映射复制到一块共享内存中，供工作进程零拷贝访问
+
+    Args:
+        alpha_maps: {logo_size: alpha_map}
+
+    Returns:
+        tuple: (SharedMemory, 布局 {logo_size: (偏移, 形状)})
+    """
+    total = sum(alpha_map.nbytes for alpha_map in alpha_maps.values())
+    shm = shared_memory.SharedMemory(create=True, size=total)
+    layout = {}
+    offset = 0
+    for logo_size, alpha_map in alpha_maps.items():
+        view = np.ndarray(alpha_map.shape, dtype=np.float32, buffer=shm.buf, offset=offset)
+        view[:] = alpha_map
+        layout[logo_size] = (offset, alpha_map.shape)
+        offset += alpha_map.nbytes
+    return shm, layout
+
+
+def _attach_shared_memory(name):
+    """附加主进程创建的共享内存，由主进程负责释放"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 没有 track 参数；工作进程与主进程共用同一个资源跟踪器，
+        # 重复登记不会导致工作进程退出时释放共享内存
+        return shared_memory.SharedMemory(name=name)
+
+
+def _init_worker(shm_name, layout, options):
+    """工作进程初始化：附加共享的alpha映射"""
+    global _worker_shm, _worker_alpha_maps, _worker_options
+
+    # 每个进程单线程，避免与进程池争抢CPU
+    torch.set_num_threads(1)
+
+    _worker_shm = _attach_shared_memory(shm_name)
+    _worker_alpha_maps = {}
+    for logo_size, (offset, shape) in layout.items():
+        alpha_map = np.ndarray(shape, dtype=np.float32, buffer=_worker_shm.buf, offset=offset)
+        alpha_map.setflags(write=False)
+        _worker_alpha_maps[logo_size] = alpha_map
+    _worker_options = options
+
+
+def _write_output(dst_path, write):
+    """
+    write(f) 写入输出目录中独立的临时文件，写完后原子替换 dst_path；失败时删除临时文件
+    """
+    dst_dir = os.path.dirname(dst_path) or "."
+    os.makedirs(dst_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dst_dir, prefix=".tmp-", suffix=os.path.splitext(dst_path)[1])
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        # mkstemp 创建的文件权限为0600，改为与普通新建文件相同
+        os.chmod(tmp_path, _worker_options["file_mode"])
+        os.replace(tmp_path, dst_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _copy_original(src_path, dst_path):
+    """把源文件原样复制到输出路径"""
+    def write(f):
+        with open(src_path, "rb") as src:
+            shutil.copyfileobj(src, f)
+    _write_output(dst_path, write)
+
+
+def _process_file(src_path, dst_path):
+    """
+    工作进程：解码、去除水印并重新编码单张图像；检测为无水印的图像原样复制到输出路径
+    （清单中记为 skipped，copied 为True），输出目录与输入保持一致
+
+    Returns:
+        dict: 清单记录
+    """
+    start = time.perf_counter()
+    record = {"path": src_path, "output": dst_path}
+    try:
+        with Image.open(src_path) as image:
+            image_format = image.format
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGB")
+            image_array = np.array(image)
+
+        height, width = image_array.shape[:2]
+
+        if _worker_options["detect"]:
+            # 互相关与亮度缩放无关，直接在uint8数据上检测
+            detection = detect_watermarks(
+                torch.from_numpy(image_array)[None],
+                _worker_alpha_maps,
+                search_radius=_worker_options["search_radius"],
+                threshold=_worker_options["threshold"],
+            )[0]
+            record["confidence"] = detection["confidence"]
+            if not detection["watermarked"]:
+                _copy_original(src_path, dst_path)
+                record["status"] = "skipped"
+                record["copied"] = True
+                record["seconds"] = round(time.perf_counter() - start, 4)
+                return record
+            logo_size = detection["logo_size"]
+            position = {"x": detection["x"], "y": detection["y"], "width": logo_size, "height": logo_size}
+        else:
+            config = detect_watermark_config(width, height)
+            logo_size = config["logo_size"]
+            position = calculate_watermark_position(width, height, config)
+
+        remove_watermark(image_array, _worker_alpha_maps[logo_size], position)
+
+        save_kwargs = {}
+        if image_format == "PNG":
+            save_kwargs["compress_level"] = _worker_options["png_compress_level"]
+        elif image_format in ("JPEG", "WEBP"):
+            save_kwargs["quality"] = _worker_options["quality"]
+        # 每个任务使用独立的临时文件，写完后原子替换
+        _write_output(dst_path, lambda f: Image.fromarray(image_array).save(
+            f, format=image_format or "PNG", **save_kwargs))
+
+        record.update({
+            "status": "processed",
+            "logo_size": logo_size,
+            "x": position["x"],
+            "y": position["y"],
+        })
+    except Exception as e:
+        record["status"] = "failed"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = round(time.perf_counter() - start, 4)
+    return record
+
+
+def iter_input_files(inputs, list_file=None):
+    """
+    逐个产出 (源路径, 相对输出路径)，不一次性展开整个目录树
+
+    目录中的文件保留相对于该目录的路径；单独指定的文件只保留文件名，
+    不同输入的输出路径可能相同，由 run_batch 检查
+
+    Args:
+        inputs: 目录或文件路径列表
+        list_file: 每行一个路径的列表文件（"-" 表示标准输入）
+    """
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                        path = os.path.join(root, name)
+                        yield path, os.path.relpath(path, item)
+        else:
+            yield item, os.path.basename(item)
+
+    if list_file:
+        stream = sys.stdin if list_file == "-" else open(list_file, "r", encoding="utf-8")
+        try:
+            for line in stream:
+                path = line.strip()
+                if path:
+                    yield path, os.path.basename(path)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+
+def load_completed(manifest_path):
+    """读取已有清单，返回已完成（处理或跳过）的源路径集合"""
+    completed = set()
+    if not os.path.exists(manifest_path):
+        return completed
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("status") in DONE_STATUSES:
+                completed.add(record["path"])
+    return completed
+
+
+def run_batch(inputs, output_dir, list_file=None, workers=None, manifest_path=None, resume=False,
+              detect=False, threshold=DETECTION_THRESHOLD, search_radius=DETECTION_SEARCH_RADIUS,
+              png_compress_level=6, quality=95, progress_interval=100):
+    """
+    批量去除水印
+
+    使用进程池并行解码、去除水印并重新编码，同时在途的任务数有上限，
+    结果按完成顺序逐条写入JSONL清单。输出路径与之前的另一个输入相同的文件不提交处理，
+    记为失败，不会覆盖之前的输出；重复出现的同一个文件只处理一次。
+
+    Returns:
+        dict: 统计信息 {processed, skipped, failed, resumed, seconds, images_per_second}
+    """
+    workers = workers or os.cpu_count() or 1
+    manifest_path = manifest_path or os.path.join(output_dir, "manifest.jsonl")
+    os.makedirs(output_dir, exist_ok=True)
+
+    completed = load_completed(manifest_path) if resume else set()
+    counts = {"processed": 0, "skipped": 0, "failed": 0, "resumed": 0}
+
+    alpha_maps = {size: load_alpha_map(os.path.join(ASSETS_DIR, f"bg_{size}.png")) for size in WATERMARK_CONFIGS}
+    shm, layout = share_alpha_maps(alpha_maps)
+    umask = os.umask(0)
+    os.umask(umask)
+    options = {
+        "file_mode": 0o666 & ~umask,
+        "detect": detect,
+        "threshold": threshold,
+        "search_radius": search_radius,
+        "png_compress_level": png_compress_level,
+        "quality": quality,
+    }
+
+    max_in_flight = workers * 4
+    start = time.perf_counter()
+    done_count = 0
+
+    try:
+        with open(manifest_path, "a", encoding="utf-8") as manifest, \
+                ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                    initargs=(shm.name, layout, options)) as executor:
+            pending = set()
+
+            def drain(return_when):
+                nonlocal pending, done_count
+                done, pending = wait(pending, return_when=return_when)
+                for future in done:
+                    record = future.result()
+                    counts[record["status"]] += 1
+                    manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    if record["status"] == "failed":
+                        logger.warning(f"[JM-Gemini] Failed: {record['path']}: {record['error']}")
+                    done_count += 1
+                    if done_count % progress_interval == 0:
+                        manifest.flush()
+                        elapsed = time.perf_counter() - start
+                        logger.info(f"[JM-Gemini] {done_count} images, {done_count / elapsed:.1f} images/s")
+
+            # 输出路径 -> 占用它的源路径
+            claimed = {}
+            for src_path, rel_path in iter_input_files(inputs, list_file):
+                dst_path = os.path.join(output_dir, rel_path)
+                dst_key = os.path.normcase(os.path.abspath(dst_path))
+                owner = claimed.get(dst_key)
+                if owner is not None:
+                    if os.path.realpath(owner) == os.path.realpath(src_path):
+                        # 同一个文件被多个输入包含，只处理一次
+                        continue
+                    record = {"path": src_path, "output": dst_path, "status": "failed",
+                              "error": f"output path already used by {owner}"}
+                    counts["failed"] += 1
+                    manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    logger.warning(f"[JM-Gemini] Failed: {src_path}: {record['error']}")
+                    continue
+                claimed[dst_key] = src_path
+                if src_path in completed:
+                    counts["resumed"] += 1
+                    continue
+                pending.add(executor.submit(_process_file, src_path, dst_path))
+                if len(pending) >= max_in_flight:
+                    drain(FIRST_COMPLETED)
+
+            while pending:
+                drain(FIRST_COMPLETED)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    elapsed = time.perf_counter() - start
+    total = counts["processed"] + counts["skipped"] + counts["failed"]
+    stats = dict(counts)
+    stats["seconds"] = round(elapsed, 3)
+    stats["images_per_second"] = round(total / elapsed, 2) if elapsed > 0 else 0.0
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量去除Gemini生成图像上的水印")
+    parser.add_argument("inputs", nargs="*", help="输入目录或图像文件")
+    parser.add_argument("-o", "--output", required=True, help="输出目录")
+    parser.add_argument("--list", dest="list_file", help="每行一个图像路径的列表文件，'-' 表示标准输入")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="工作进程数（默认CPU核数）")
+    parser.add_argument("--manifest", help="清单文件路径（默认 OUTPUT/manifest.jsonl）")
+    parser.add_argument("--resume", action="store_true", help="跳过清单中已处理或已跳过的文件")
+    parser.add_argument("--detect", action="store_true", help="先检测水印，跳过无水印的图像")
+    parser.add_argument("--threshold", type=float, default=DETECTION_THRESHOLD, help="检测置信度阈值")
+    parser.add_argument("--search-radius", type=int, default=DETECTION_SEARCH_RADIUS, help="检测搜索范围（像素）")
+    parser.add_argument("--png-compress-level", type=int, default=6, help="PNG压缩级别 0-9")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG/WebP质量")
+    args = parser.parse_args(argv)
+
+    if not args.inputs and not args.list_file:
+        parser.error("需要至少一个输入目录/文件或 --list")
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    stats = run_batch(
+        args.inputs,
+        args.output,
+        list_file=args.list_file,
+        workers=args.workers,
+        manifest_path=args.manifest,
+        resume=args.resume,
+        detect=args.detect,
+        threshold=args.threshold,
+        search_radius=args.search_radius,
+        png_compress_level=args.png_compress_level,
+        quality=args.quality,
+    )
+    print(json.dumps(stats, ensure_ascii=False))
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())